@@ -1,13 +1,117 @@
+from collections import deque
+from contextlib import contextmanager
+from itertools import chain
+from typing import Dict
 from typing import List
+from typing import Optional
+from typing import Sequence
 from typing import Tuple
-import logging
+import heapq
+import threading
+import time
 
-logging.basicConfig(level=logging.DEBUG)
+from BankersMetrics import timed
+
+
+# Matrices a change passed to patch() can set cells of
+MATRICES = ("resources", "allocation", "max")
+
+# Verbosity levels for the logs returned by safety() and request()
+QUIET = "none"
+SUMMARY = "summary"
+FULL = "full"
+VERBOSITY = (QUIET, SUMMARY, FULL)
+
+# Versions stay at or below this, the biggest integer a JavaScript number
+# holds exactly, so static/index.js reads them back as they were sent
+MAX_VERSION = 2 ** 53
+
+# Verdicts from evaluate_request()
+GRANTABLE = "grantable"
+UNSAFE = "unsafe"
+INVALID = "invalid"
+
+
+def first_version() -> int:
+    """Version to start a whole new system at. Versions start from the
+    clock in microseconds, so a system that was deleted and made again
+    never reuses a version another process may still have cached, and
+    they stay below MAX_VERSION until the year 2255"""
+    return time.time_ns() // 1000
+
+
+class Trace(Sequence):
+    """Logs kept as (message, args) event tuples. The messages are only
+    formatted when a log line is read, and events the verbosity does not
+    ask for are never stored. Reads like a list of strings.
+    """
+
+    def __init__(self, verbosity: str = FULL):
+        """Start an empty trace
+
+        Args:
+            verbosity (str): none for no logs, summary for the outcome of
+                             each step, or full to also log every process
+                             that runs
+
+        Raises:
+            ValueError: If the verbosity is not one of the levels
+        """
+        if verbosity not in VERBOSITY:
+            raise ValueError(f"Verbosity must be one of {VERBOSITY}, " +
+                             f"{verbosity} is not")
+
+        self.verbosity = verbosity
+        self.summary = verbosity != QUIET
+        self.full = verbosity == FULL
+        self.events = []
+
+    def append(self, message: str, *args):
+        """Log a summary event, message is formatted with args when read"""
+        if self.summary:
+            self.events.append((message, args))
+
+    def detail(self, message: str, *args):
+        """Log an event that is only kept for the full trace"""
+        if self.full:
+            self.events.append((message, args))
+
+    def __iadd__(self, other):
+        # Events from another trace were already filtered by its verbosity
+        if isinstance(other, Trace):
+            self.events += other.events
+        else:
+            for line in other:
+                self.append(line)
+        return self
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [message.format(*args)
+                    for message, args in self.events[index]]
+        message, args = self.events[index]
+        return message.format(*args)
+
+    def __len__(self) -> int:
+        return len(self.events)
+
+    def __eq__(self, other) -> bool:
+        return list(self) == list(other)
+
+    def __repr__(self) -> str:
+        return repr(list(self))
 
 
 class BankersAlgorithm:
+    # Most changes kept for changes_since()
+    journal_size = 10000
+
+    # Name of the backend, for building the system again somewhere else
+    backend = "list"
+
     def __init__(self, num_proc: int, num_res: int, resources: List[int],
-                 allocation: List[List[int]], maximum: List[List[int]]):
+                 allocation: List[List[int]], maximum: List[List[int]],
+                 trusted: bool = False):
         """Initialize the Bankers Algorithm
 
         Args:
@@ -17,8 +121,67 @@ class BankersAlgorithm:
             allocation (List[List[int]]): Current resource allocation
                                           for processes
             maximum (List[List[int]]): Maximum possible resource allocation
+            trusted (bool): Skip checking the arguments, for states the
+                            system made itself such as snapshots and clones
         """
 
+        if not trusted:
+            self._validate(num_proc, num_res, resources, allocation, maximum)
+
+        # Cached need and available arrays, rebuilt when they are None
+        self._need = None
+        self._available = None
+
+        # Bumped on every change to the state of the system. Versions start
+        # at the time, like the versions of a state store, so a system made
+        # again under the same ID never hands out a version the last one did
+        self.version = first_version()
+
+        # The changes made after version _journal_start, as (version,
+        # changes) pairs, for changes_since()
+        self._journal = deque()
+        self._journal_start = self.version
+        self._journal_changes = 0
+
+        # Slots of finished processes that add_process() hands out again,
+        # as a heap so the lowest slot is reused first, and as a set
+        self._free = []
+        self._free_set = set()
+
+        # The last safe sequence found as a (version, sequence, position,
+        # bound) tuple, see _remember_safe
+        self._safe = None
+
+        # The last result of safety() at each verbosity as (version,
+        # is_safe, sequence, log events), handed out again until the
+        # version moves on
+        self._safety_results = {}
+
+        # Writers hold the lock and make _seq odd while they change the
+        # state. Readers never take the lock, they check that _seq was even
+        # and did not move while they read, and try again if it did
+        self._lock = threading.RLock()
+        self._seq = 0
+
+        # Default verbosity of the logs from safety() and request()
+        self.verbosity = FULL
+
+        # Counters for how often requests skip the safety algorithm, and
+        # how often safety() reuses the cached safe sequence as it is,
+        # repairs it or has to search from scratch, see hit_rates()
+        self.stats = {"fast_path_hits": 0, "fast_path_misses": 0,
+                      "safety_hits": 0, "safety_repairs": 0,
+                      "safety_misses": 0, "deadlock_full_runs": 0,
+                      "deadlock_incremental_runs": 0,
+                      "commit_conflicts": 0}
+
+        # The request each blocked process is waiting on, for deadlocks(),
+        # and the processes whose request changed since the last full
+        # detection run
+        self._waiting = {}
+        self._waiting_log = []
+        self._detector = None
+
         # Update all of the datamembers
         self.num_proc = num_proc
         self.num_res = num_res
@@ -26,57 +189,1017 @@ class BankersAlgorithm:
         self.allocation = allocation
         self.maximum = maximum
 
+    @timed("validate")
+    def _validate(self, num_proc: int, num_res: int, resources: List[int],
+                  allocation: List[List[int]], maximum: List[List[int]]):
+        """Check the arguments to __init__
+
+        Raises:
+            ValueError: Explaining what is wrong
+        """
         # Check that everything is valid, if not throw a value error
         # explaining what's wrong
-        if(type(self.num_proc) is not int):
+        if(type(num_proc) is not int):
             raise ValueError("Number of Processes must be an integer," +
-                             f"{type(self.num_proc)} is not int.")
+                             f"{type(num_proc)} is not int.")
 
-        if(type(self.num_res) is not int):
+        if(type(num_res) is not int):
             raise ValueError("Number of Resources must be an integer," +
-                             f"{type(self.num_res)} is not int.")
+                             f"{type(num_res)} is not int.")
 
-        if len(self.resources) != self.num_res:
+        if len(resources) != num_res:
             raise ValueError("Length of resource array must equal number " +
-                             f"of resources, {len(self.resources)} is not " +
-                             f" {self.num_res}")
+                             f"of resources, {len(resources)} is not " +
+                             f" {num_res}")
 
-        if len(self.allocation) != self.num_proc:
+        if len(allocation) != num_proc:
             raise ValueError("Rows of allocation matrix must equal number " +
-                             f"of processes, {len(self.allocation)} is not " +
-                             f" {self.num_proc}")
+                             f"of processes, {len(allocation)} is not " +
+                             f" {num_proc}")
 
-        if len(self.maximum) != self.num_proc:
+        if len(maximum) != num_proc:
             raise ValueError("Rows of maximum matrix must equal number " +
-                             f"of processes, {len(self.maximum)} is not " +
-                             f" {self.num_proc}")
+                             f"of processes, {len(maximum)} is not " +
+                             f" {num_proc}")
 
-        for i in range(self.num_proc):
-            if len(self.allocation[i]) != self.num_res:
+        # Check the rows and cells in bulk, and only go looking for the one
+        # that is wrong when there is one
+        lengths = set(map(len, allocation)) | set(map(len, maximum))
+        types = (set(map(type, chain.from_iterable(allocation))) |
+                 set(map(type, chain.from_iterable(maximum))))
+        if (lengths <= {num_res} and types <= {int} and
+                min(chain.from_iterable(allocation), default=0) >= 0):
+            return
+
+        for i in range(num_proc):
+            if len(allocation[i]) != num_res:
                 raise ValueError("Cols of allocation matrix must equal " +
                                  f"number of resources, " +
-                                 f"{len(self.allocation)} is not" +
-                                 f" {self.num_res}")
-            if len(self.maximum[i]) != self.num_res:
+                                 f"{len(allocation)} is not" +
+                                 f" {num_res}")
+            if len(maximum[i]) != num_res:
                 raise ValueError("Cols of maximum matrix must equal number " +
-                                 f"of resources, {len(self.maximum)} is not " +
-                                 f" {self.num_res}")
+                                 f"of resources, {len(maximum)} is not " +
+                                 f" {num_res}")
 
-        for i in range(self.num_proc):
-            for j in range(self.num_res):
-                if type(self.allocation[i][j]) is not int:
+        for i in range(num_proc):
+            for j in range(num_res):
+                if type(allocation[i][j]) is not int:
                     raise ValueError("All values in allocation matrix should" +
                                      " be of type int. " +
-                                     f"{type(self.allocation[i][j])}" +
+                                     f"{type(allocation[i][j])}" +
                                      f" at {i},{j} is not int")
-                if type(self.maximum[i][j]) is not int:
+                # A process can not hold less than nothing, the safety
+                # algorithm relies on work only ever growing
+                if allocation[i][j] < 0:
+                    raise ValueError("All values in allocation matrix should" +
+                                     " be at least 0. " +
+                                     f"{allocation[i][j]}" +
+                                     f" at {i},{j} is not")
+                if type(maximum[i][j]) is not int:
                     raise ValueError("All values in maximum matrix should" +
                                      " be of type int. " +
-                                     f"{type(self.allocation[i][j])}" +
+                                     f"{type(allocation[i][j])}" +
                                      f" at {i},{j} is not int")
 
+    @classmethod
+    def from_buffers(cls, num_proc: int, num_res: int, resources,
+                     allocation, maximum,
+                     copy: bool = True) -> "BankersAlgorithm":
+        """Build a system from flat buffers of int64 cells, such as bytes,
+        array.array("q") or numpy arrays. Only the size and type of each
+        buffer is checked, and that no allocation cell is below 0, the
+        cells are not checked one by one
+
+        Args:
+            num_proc (int): Number of processes
+            num_res (int): Number of resources
+            resources: num_res cells of resources
+            allocation: num_proc * num_res cells of allocation, row by row
+            maximum: num_proc * num_res cells of maximum, row by row
+            copy (bool): If False, backends that can keep their state in
+                         writable buffers use them as they are
+
+        Returns:
+            BankersAlgorithm: The system
+
+        Raises:
+            ValueError: If a buffer is not int64 cells or the wrong size, or
+                        an allocation cell is below 0
+        """
+        if type(num_proc) is not int or type(num_res) is not int:
+            raise ValueError("Number of Processes and Resources must be " +
+                             f"integers, {num_proc} and {num_res} are not")
+        size = num_proc * num_res
+        allocation = int64_cells(allocation, size, "allocation")
+        # Buffers come from outside, and the safety algorithm relies on
+        # work only ever growing, as in _validate
+        least = cls._least(allocation)
+        if least < 0:
+            raise ValueError("All values in allocation matrix should be " +
+                             f"at least 0. {least} is not")
+        return cls(num_proc, num_res,
+                   int64_cells(resources, num_res, "resources").tolist(),
+                   cls._rows(allocation, num_proc, num_res, copy),
+                   cls._rows(int64_cells(maximum, size, "maximum"),
+                             num_proc, num_res, copy),
+                   trusted=True)
+
+    @staticmethod
+    def _least(cells: memoryview) -> int:
+        """The smallest of flat cells, 0 when there are none"""
+        return min(cells, default=0)
+
+    @staticmethod
+    def _rows(cells: memoryview, num_proc: int, num_res: int, copy: bool):
+        """Split flat cells into the matrix form the backend stores"""
+        if not num_res:
+            return [[] for _ in range(num_proc)]
+        cells = cells.tolist()
+        return [cells[i:i + num_res]
+                for i in range(0, num_proc * num_res, num_res)]
+
+    def clone(self) -> "BankersAlgorithm":
+        """Copy the system. The copy is not checked again, and does not
+        share any state with this system
+
+        Returns:
+            BankersAlgorithm: The copy
+        """
+        state = self.snapshot()
+        b = type(self)(state["num_proc"], state["num_res"],
+                       state["resources"], state["allocation"], state["max"],
+                       trusted=True)
+        b._restore_free(state["free"])
+        b._waiting = self.waiting
+        b.verbosity = self.verbosity
+        return b
+
+    def _restore_free(self, slots: List[int]):
+        """Mark slots as free, for states that were saved with free slots
+
+        Args:
+            slots (List[int]): The free slots
+
+        Raises:
+            ValueError: If a slot is out of range or given twice, or its
+                        process holds or claims any resources
+        """
+        free = set(slots)
+        if len(free) != len(slots):
+            raise ValueError(f"Free slots {slots} should each be given once")
+        for proc_num in free:
+            if type(proc_num) is not int or not 0 <= proc_num < self.num_proc:
+                raise ValueError(f"Free slot: {proc_num} is invalid")
+            if not self._empty(proc_num):
+                raise ValueError(f"Free slot: {proc_num} holds or claims " +
+                                 "resources")
+        self._free = sorted(free)
+        self._free_set = free
+
+    def _empty(self, proc_num: int) -> bool:
+        """Check that a process holds and claims nothing"""
+        _, allocation, maximum = self._matrices()
+        return not any(allocation[proc_num]) and not any(maximum[proc_num])
+
+    # BankersSnapshot imports this module, so it is only imported when used
+
+    def save(self, path: str):
+        """Save the system to a binary snapshot file, see BankersSnapshot
+
+        Args:
+            path (str): Path of the file
+        """
+        import BankersSnapshot
+        BankersSnapshot.save(self, path)
+
+    @classmethod
+    def load(cls, path: str) -> "BankersAlgorithm":
+        """Open a binary snapshot file with mmap, see BankersSnapshot
+
+        Args:
+            path (str): Path of the file
+
+        Returns:
+            BankersAlgorithm: The system
+
+        Raises:
+            ValueError: If the file is not a snapshot
+        """
+        import BankersSnapshot
+        return BankersSnapshot.load(path, cls)
+
+    @property
+    def resources(self) -> List[int]:
+        return self._resources
+
+    @resources.setter
+    def resources(self, resources: List[int]):
+        self._resources = resources
+        self.invalidate()
+
+    @property
+    def allocation(self) -> List[List[int]]:
+        return self._allocation
+
+    @allocation.setter
+    def allocation(self, allocation: List[List[int]]):
+        self._allocation = allocation
+        self.invalidate()
+
+    @property
+    def maximum(self) -> List[List[int]]:
+        return self._maximum
+
+    @maximum.setter
+    def maximum(self, maximum: List[List[int]]):
+        self._maximum = maximum
+        self.invalidate()
+
+    @property
+    def need(self) -> List[List[int]]:
+        """The need array, calculated once and then kept up to date by
+        every request"""
+        return self._cached("_need", self.calculate_need)
+
+    @property
+    def available(self) -> List[int]:
+        """The available array, calculated once and then kept up to date
+        by every request"""
+        return self._cached("_available", self.calculate_available)
+
+    def _cached(self, name: str, build):
+        """Read a cached array, building it if it is missing. It is built
+        while holding the lock, so it is never built from a state a writer
+        is part way through changing, or put in place after a writer has
+        already started updating the one it built
+
+        Args:
+            name (str): Attribute the array is cached in
+            build: Calculates the array from the state
+
+        Returns:
+            The cached array
+        """
+        value = getattr(self, name)
+        if value is None:
+            with self._lock:
+                value = getattr(self, name)
+                if value is None:
+                    value = build()
+                    setattr(self, name, value)
+        return value
+
+    def invalidate(self):
+        """Drop the cached need and available arrays and the cached safe
+        sequence. Assigning to resources, allocation or maximum does this
+        automatically, it only has to be called after changing one of them
+        in place
+        """
+        with self._write():
+            self._need = None
+            self._available = None
+            self._safe = None
+            self.version += 1
+
+            # Nobody knows what changed, so the journal starts again
+            self._journal.clear()
+            self._journal_start = self.version
+            self._journal_changes = 0
+
+    def _record(self, changes: List[Dict]):
+        """Bump the version and journal the changes that made it. Has to be
+        called while writing
+
+        Args:
+            changes (List[Dict]): The changes, in the form patch() takes
+        """
+        self.version += 1
+        self._journal.append((self.version, changes))
+        self._journal_changes += len(changes)
+        while self._journal_changes > self.journal_size:
+            version, dropped = self._journal.popleft()
+            self._journal_start = version
+            self._journal_changes -= len(dropped)
+
+    @contextmanager
+    def _write(self):
+        """Hold the lock and mark the state as changing"""
+        with self._lock:
+            self._seq += 1
+            try:
+                yield
+            finally:
+                self._seq += 1
+
+    def _read_begin(self) -> int:
+        """Start an optimistic read of the state
+
+        Returns:
+            int: Sequence number to hand to _read_end
+        """
+        seq = self._seq
+        while seq % 2:
+            # A writer is part way through a change, wait for it to finish
+            with self._lock:
+                pass
+            seq = self._seq
+        return seq
+
+    def _read_end(self, seq: int) -> bool:
+        """Finish an optimistic read of the state
+
+        Args:
+            seq (int): Sequence number from _read_begin
+
+        Returns:
+            bool: If nothing changed during the read
+        """
+        return self._seq == seq
+
+    def _as_vector(self, resource_req: List[int]) -> List[int]:
+        """Convert a resource vector to the form used by the backend"""
+        return resource_req
+
+    def _apply(self, proc_num: int, resource_req: List[int]):
+        """Add resources to the allocation of a process and update the
+        need and available arrays to match
+
+        Args:
+            proc_num (int): Process number to allocate to
+            resource_req (List[int]): Number of resources to add
+        """
+        allocation = self.allocation[proc_num]
+        need = self.need[proc_num]
+        available = self.available
+        for i in range(self.num_res):
+            allocation[i] += resource_req[i]
+            need[i] -= resource_req[i]
+            available[i] -= resource_req[i]
+        self._record([{"op": "set_row", "matrix": "allocation",
+                       "proc": proc_num, "row": list(allocation)}])
+
+    def _matrices(self) -> Tuple:
+        """The resources, allocation and maximum as the backend stores
+        them, for patch() to change in place"""
+        return self._resources, self._allocation, self._maximum
+
+    def _held(self, proc_num: int) -> List[int]:
+        """The resources a process holds, as a list of ints"""
+        return [int(value) for value in self._matrices()[1][proc_num]]
+
+    def _set_cell(self, matrix: str, proc_num: Optional[int], res_num: int,
+                  value: int):
+        """Set one cell and update the need and available arrays to match
+
+        Args:
+            matrix (str): resources, allocation or max
+            proc_num (Optional[int]): Process of the cell, None for
+                                      resources
+            res_num (int): Resource of the cell
+            value (int): New value of the cell
+        """
+        resources, allocation, maximum = self._matrices()
+        if matrix == "resources":
+            change = value - resources[res_num]
+            resources[res_num] = value
+            if self._available is not None:
+                self._available[res_num] += change
+            return
+
+        row = (allocation if matrix == "allocation" else maximum)[proc_num]
+        change = value - row[res_num]
+        row[res_num] = value
+        if matrix == "allocation":
+            change = -change
+            if self._available is not None:
+                self._available[res_num] += change
+        if self._need is not None:
+            self._need[proc_num][res_num] += change
+
+    def _add_row(self, allocation: List[int], maximum: List[int]):
+        """Add a process after the last one, updating the need and
+        available arrays to match"""
+        self._allocation.append(list(allocation))
+        self._maximum.append(list(maximum))
+        if self._need is not None:
+            self._need.append([maximum[j] - allocation[j]
+                               for j in range(self.num_res)])
+        if self._available is not None:
+            for j in range(self.num_res):
+                self._available[j] -= allocation[j]
+        self.num_proc += 1
+
+    def _remove_row(self, proc_num: int):
+        """Remove a process, the processes after it move down by one. The
+        need and available arrays are updated to match"""
+        allocation = self._allocation.pop(proc_num)
+        self._maximum.pop(proc_num)
+        if self._need is not None:
+            self._need.pop(proc_num)
+        if self._available is not None:
+            for j in range(self.num_res):
+                self._available[j] += allocation[j]
+        self.num_proc -= 1
+
+    def _first_over(self, proc_num: int,
+                    resource_req: List[int]) -> Optional[int]:
+        """Find the first resource a request asks for more of than the
+        process needs or than is available
+
+        Args:
+            proc_num (int): Process number that the request is being made on
+            resource_req (List[int]): Number of extra resources requested
+
+        Returns:
+            Optional[int]: The resource, or None if the request fits
+        """
+        need = self.need[proc_num]
+        available = self.available
+        for i in range(self.num_res):
+            if resource_req[i] > need[i] or resource_req[i] > available[i]:
+                return i
+        return None
+
+    def _below_zero(self, proc_num: int, resource_req: List[int]) -> bool:
+        """Check if a request would take a process below zero resources"""
+        allocation = self.allocation[proc_num]
+        return any(allocation[i] + resource_req[i] < 0
+                   for i in range(self.num_res))
+
+    def _safe_order(self, proc_num: Optional[int] = None,
+                    resource_req: Optional[List[int]] = None) -> List[int]:
+        """Find the order processes can finish in, without changing the
+        state of the system
+
+        Args:
+            proc_num (Optional[int]): Process to pretend to grant a request
+                                      to first
+            resource_req (Optional[List[int]]): The request to pretend to
+                                                grant
+
+        Returns:
+            List[int]: The processes that were able to finish, in order
+        """
+        work = list(self.available)
+        need = self.need
+        allocation = self.allocation
+        if proc_num is not None:
+            # Only the row of the requesting process changes, so copy the
+            # outer lists and replace that one row
+            work = [work[j] - resource_req[j] for j in range(self.num_res)]
+            need = list(need)
+            need[proc_num] = [need[proc_num][j] - resource_req[j]
+                              for j in range(self.num_res)]
+            allocation = list(allocation)
+            allocation[proc_num] = [allocation[proc_num][j] +
+                                    resource_req[j]
+                                    for j in range(self.num_res)]
+        return safe_order(work, need, allocation)
+
+    def _remember_safe(self, process_order: List[int],
+                       version: Optional[int] = None):
+        """Cache a safe sequence for the current state. For every position
+        k in the sequence this keeps the smallest amount of each resource
+        that was left over when the processes before k ran. A request by
+        the process at position k that fits inside that bound leaves the
+        whole sequence safe, because only the processes before k see less
+        work, and the processes after k get it all back when k finishes
+
+        Args:
+            process_order (List[int]): A safe sequence for the current state
+            version (Optional[int]): Version the sequence was found at,
+                                     defaults to the current version
+        """
+        if version is None:
+            version = self.version
+        work = list(self.available)
+        need = self.need
+        bound = [float("inf")] * self.num_res
+        position = [None] * self.num_proc
+        safe_bound = []
+        for k, i in enumerate(process_order):
+            position[i] = k
+            safe_bound.append(bound)
+            bound = [min(bound[j], work[j] - need[i][j])
+                     for j in range(self.num_res)]
+            for j in range(self.num_res):
+                work[j] += self.allocation[i][j]
+
+        self._safe = (version, process_order, position, safe_bound)
+
+    def _repair_order(self, process_order: List[int]) -> List[int]:
+        """Check a safe sequence found at an earlier version against the
+        current state. The processes that can still finish in that order
+        keep their places, and the search goes on from the first one that
+        no longer can, with the work the ones before it gave back. Letting
+        a process finish never stops another one from finishing, so this
+        finds every process the full search would, only maybe in another
+        order
+
+        Args:
+            process_order (List[int]): An earlier safe sequence
+
+        Returns:
+            List[int]: The processes that were able to finish, in order
+        """
+        work = list(self.available)
+        need = self.need
+        allocation = self.allocation
+        num_res = self.num_res
+        finished = [False] * self.num_proc
+        prefix = []
+        for i in process_order:
+            if (i >= self.num_proc or
+                    any(need[i][j] > work[j] for j in range(num_res))):
+                break
+            finished[i] = True
+            prefix.append(i)
+            row = allocation[i]
+            for j in range(num_res):
+                work[j] += row[j]
+
+        rest = [i for i in range(self.num_proc) if not finished[i]]
+        return prefix + [rest[k] for k in safe_order(
+            work, [need[i] for i in rest], [allocation[i] for i in rest])]
+
+    def _fast_safe(self, proc_num: int, resource_req: List[int]) -> bool:
+        """Check if granting a request keeps the cached safe sequence safe
+
+        Args:
+            proc_num (int): Process number that the request is being made on
+            resource_req (List[int]): Number of extra resources requested
+
+        Returns:
+            bool: True if the system is known to be safe after the request,
+                  False if the safety algorithm has to be run
+        """
+        safe = self._safe
+        if safe is None or safe[0] != self.version:
+            return False
+        bound = safe[3][safe[2][proc_num]]
+        return all(resource_req[j] <= bound[j] for j in range(self.num_res))
+
+    def stored_cells(self) -> int:
+        """Number of cells the state takes, for a registry to weigh the
+        system by"""
+        return 2 * self.num_proc * self.num_res + self.num_res
+
+    def snapshot(self) -> Dict:
+        """Take a consistent copy of the state of the system without
+        blocking requests
 
+        Returns:
+            Dict: num_proc, num_res, resources, allocation, max, free and
+                  version
+        """
+        while True:
+            seq = self._read_begin()
+            state = {'num_proc': self.num_proc,
+                     'num_res': self.num_res,
+                     'resources': list(self.resources),
+                     'allocation': [list(row) for row in self.allocation],
+                     'max': [list(row) for row in self.maximum],
+                     'free': self.free,
+                     'version': self.version}
+            if self._read_end(seq):
+                return state
+
+    def patch(self, changes: List[Dict]) -> int:
+        """Change the state of the system in place, without rebuilding it.
+        Either every change is made or, if any of them is invalid, none
+
+        Args:
+            changes (List[Dict]): Changes made in order, each one of
+                {"op": "set", "matrix": "resources", "res": j, "value": k}
+                {"op": "set", "matrix": "allocation" or "max", "proc": i,
+                 "res": j, "value": k}
+                {"op": "set_row", "matrix": "allocation" or "max",
+                 "proc": i, "row": [...]}
+                {"op": "add_process", "allocation": [...], "max": [...]},
+                which adds process num_proc
+                {"op": "remove_process", "proc": i}, which moves every
+                later process down by one. Cells of finished processes can
+                not be set, see add_process()
+
+        Returns:
+            int: The version of the system after the changes
 
+        Raises:
+            ValueError: If any of the changes is invalid
+        """
+        with self._write():
+            self._check_changes(changes)
+            for change in changes:
+                op = change["op"]
+                if op == "set":
+                    self._set_cell(change["matrix"], change.get("proc"),
+                                   change["res"], change["value"])
+                elif op == "set_row":
+                    for j, value in enumerate(change["row"]):
+                        self._set_cell(change["matrix"], change["proc"], j,
+                                       value)
+                elif op == "add_process":
+                    self._add_row(change["allocation"], change["max"])
+                else:
+                    self._remove_row(change["proc"])
+                    # Later slots moved down by one
+                    self._free_set = {i - (i > change["proc"])
+                                      for i in self._free_set
+                                      if i != change["proc"]}
+                    self._free = sorted(self._free_set)
+                    self._waiting = {i - (i > change["proc"]): row
+                                     for i, row in self._waiting.items()
+                                     if i != change["proc"]}
+            self._record(list(changes))
+            return self.version
+
+    def _check_changes(self, changes: List[Dict]):
+        """Check every change for patch() before any of them is made
+
+        Raises:
+            ValueError: If any of the changes is invalid
+        """
+        def check_index(value, size: int, name: str):
+            if type(value) is not int or not 0 <= value < size:
+                raise ValueError(f"{name} number: {value} is invalid")
+
+        def check_held(values: List[int]):
+            # A process can not hold less than nothing
+            for value in values:
+                if value < 0:
+                    raise ValueError("All values in allocation should be " +
+                                     f"at least 0, {value} is not")
+
+        check_row = self._check_row
+
+        # Adding and removing processes changes the process numbers later
+        # changes can use, and the slots of finished processes among them
+        num_proc = self.num_proc
+        free = set(self._free_set)
+        for change in changes:
+            op = change.get("op")
+            if op == "add_process":
+                check_row(change.get("allocation"), "allocation")
+                check_held(change["allocation"])
+                check_row(change.get("max"), "max")
+                num_proc += 1
+                continue
+            if op not in ("set", "set_row", "remove_process"):
+                raise ValueError(f"Unknown change {op}")
+            if op == "remove_process":
+                check_index(change.get("proc"), num_proc, "Process")
+                free = {i - (i > change["proc"]) for i in free
+                        if i != change["proc"]}
+                num_proc -= 1
+                continue
+
+            matrix = change.get("matrix")
+            if matrix not in MATRICES or (op == "set_row" and
+                                          matrix == "resources"):
+                raise ValueError(f"Can not {op} matrix {matrix}")
+            if matrix != "resources":
+                check_index(change.get("proc"), num_proc, "Process")
+                # Finished slots stay empty until add_process() hands them
+                # out again
+                if change["proc"] in free:
+                    raise ValueError("Process number: " +
+                                     f"{change['proc']} has finished")
+            if op == "set_row":
+                check_row(change.get("row"), matrix)
+                if matrix == "allocation":
+                    check_held(change["row"])
+                continue
+            check_index(change.get("res"), self.num_res, "Resource")
+            if type(change.get("value")) is not int:
+                raise ValueError("Value should be of type int. " +
+                                 f"{type(change.get('value'))} is not int")
+            if matrix == "allocation":
+                check_held([change["value"]])
+
+    def _check_row(self, row: List[int], name: str):
+        """Check that a row has one int per resource
+
+        Raises:
+            ValueError: If it does not
+        """
+        if type(row) is not list or len(row) != self.num_res:
+            raise ValueError(f"Length of {name} row must equal number " +
+                             f"of resources, {row} is not {self.num_res}")
+        for value in row:
+            if type(value) is not int:
+                raise ValueError(f"All values in {name} row should be " +
+                                 f"of type int. {type(value)} is not int")
+
+    def _check_running(self, proc_num: int):
+        """Check that a process number is in range and not finished
+
+        Raises:
+            ValueError: If it is not
+        """
+        if proc_num >= self.num_proc or proc_num < 0:
+            raise ValueError("Requested process number: " +
+                             f"{proc_num} is invalid")
+        if proc_num in self._free_set:
+            raise ValueError("Requested process number: " +
+                             f"{proc_num} has finished")
+
+    @property
+    def free(self) -> List[int]:
+        """Slots of finished processes, that add_process() hands out
+        again"""
+        return sorted(self._free_set)
+
+    def add_process(self, maximum: List[int]) -> int:
+        """Start a new process that holds no resources yet. The slot of a
+        finished process is reused if there is one, so the matrices only
+        grow when every slot is in use
+
+        Args:
+            maximum (List[int]): Maximum possible resource allocation of
+                                 the process
+
+        Returns:
+            int: Process number of the new process
+
+        Raises:
+            ValueError: If the maximum is invalid or more than the system
+                        has of some resource, which could never be safe
+        """
+        self._check_row(maximum, "maximum")
+        with self._write():
+            resources = self._matrices()[0]
+            for j in range(self.num_res):
+                if not 0 <= maximum[j] <= resources[j]:
+                    raise ValueError(f"Maximum of resource_{j} must be " +
+                                     f"between 0 and {resources[j]}, " +
+                                     f"{maximum[j]} is not")
+
+            changes = []
+            if not self._free:
+                slots = self._grow()
+                changes += [{"op": "add_process",
+                             "allocation": [0] * self.num_res,
+                             "max": [0] * self.num_res}] * slots
+                for proc_num in range(self.num_proc - slots, self.num_proc):
+                    heapq.heappush(self._free, proc_num)
+                    self._free_set.add(proc_num)
+
+            proc_num = heapq.heappop(self._free)
+            self._free_set.discard(proc_num)
+            for j in range(self.num_res):
+                self._set_cell("max", proc_num, j, maximum[j])
+            changes.append({"op": "set_row", "matrix": "max",
+                            "proc": proc_num, "row": list(maximum)})
+            self._record(changes)
+            return proc_num
+
+    def _grow(self) -> int:
+        """Add empty slots after the last process for add_process()
+
+        Returns:
+            int: The number of slots added
+        """
+        self._add_row([0] * self.num_res, [0] * self.num_res)
+        return 1
+
+    def release(self, proc_num: int,
+                resource_rel: Optional[List[int]] = None) -> List[int]:
+        """Give back resources a process holds. Giving resources back can
+        never make a safe state unsafe, so the safety algorithm is not run
+        and the cached safe sequence is kept
+
+        Args:
+            proc_num (int): Process number giving the resources back
+            resource_rel (Optional[List[int]]): Number of each resource to
+                                                give back, defaults to
+                                                every resource it holds
+
+        Returns:
+            List[int]: The resources that were given back
+
+        Raises:
+            ValueError: If the process number is out of range or finished,
+                        or the process does not hold what it gives back.
+                        Nothing is changed then
+        """
+        self._check_running(proc_num)
+        if resource_rel is not None:
+            self._check_row(resource_rel, "release")
+        with self._write():
+            allocation = self._held(proc_num)
+            if resource_rel is None:
+                released = allocation
+            else:
+                self._check_release(allocation, resource_rel)
+                released = list(resource_rel)
+            self._give_back(proc_num, released)
+            return released
+
+    def _check_release(self, allocation: List[int], resource_rel: List[int]):
+        """Check that a process holds what it gives back
+
+        Raises:
+            ValueError: If it does not
+        """
+        for j in range(self.num_res):
+            if not 0 <= resource_rel[j] <= allocation[j]:
+                raise ValueError(f"Release of resource_{j} must be " +
+                                 f"between 0 and {allocation[j]}, " +
+                                 f"{resource_rel[j]} is not")
+
+    def _give_back(self, proc_num: int, released: List[int]):
+        """Take resources from the allocation of a process. Has to be called
+        while writing
+
+        Args:
+            proc_num (int): Process number giving the resources back
+            released (List[int]): Number of each resource to give back
+        """
+        safe = self._safe
+        self._apply(proc_num, self._as_vector([-count for count in released]))
+        # Every process in the cached safe sequence sees at least as much
+        # work as before, so the sequence and its bounds still hold
+        if safe is not None and safe[0] == self.version - 1:
+            self._safe = (self.version,) + safe[1:]
+
+    def exchange(self, proc_num: int, acquire: List[int],
+                 release: List[int], verbosity: Optional[str] = None
+                 ) -> Tuple[bool, List[int], List[str]]:
+        """Give back some resources and ask for others in one step. Either
+        both happen or, if the state would be unsafe, neither. When nothing
+        more of any resource is asked for than is given back, the safety
+        algorithm is not run
+
+        Args:
+            proc_num (int): Process number making the exchange
+            acquire (List[int]): Number of each resource to ask for
+            release (List[int]): Number of each resource to give back
+            verbosity (Optional[str]): Log verbosity, defaults to the
+                                       verbosity of the object
+
+        Returns:
+            Tuple[bool, List[int], List[str]]: If the exchange was made, the
+                                               safe sequence after it, which
+                                               is empty when only resources
+                                               were given back and no safe
+                                               sequence was cached, and the
+                                               logs
+
+        Raises:
+            ValueError: If the process number is out of range or finished,
+                        either vector is invalid or the process does not
+                        hold what it gives back
+        """
+        self._check_running(proc_num)
+        self._check_row(acquire, "acquire")
+        self._check_row(release, "release")
+        for j in range(self.num_res):
+            if acquire[j] < 0:
+                raise ValueError(f"Acquire of resource_{j} must be at " +
+                                 f"least 0, {acquire[j]} is not")
+        net = [acquire[j] - release[j] for j in range(self.num_res)]
+
+        if all(count <= 0 for count in net):
+            # Checks the verbosity before anything is given back
+            logs = Trace(verbosity or self.verbosity)
+            with self._write():
+                self._check_release(self._held(proc_num), release)
+                self._give_back(proc_num, [-count for count in net])
+                safe = self._safe
+                if safe is None or safe[0] != self.version:
+                    safe = None
+            logs.append("Exchange only gives resources back")
+            return True, list(safe[1]) if safe is not None else [], logs
+
+        while True:
+            valid, safe_seq, logs, version = self.check_request(
+                proc_num, net, verbosity)
+            if not valid:
+                return False, safe_seq, logs
+
+            # The release is checked against the state the request was
+            # checked against, commit() fails if that state has gone
+            self._check_release(self._held(proc_num), release)
+            if self.commit(proc_num, net, safe_seq, version):
+                logs.append("System is safe with new resource allocation")
+                return True, safe_seq, logs
+
+    def finish(self, proc_num: int):
+        """Give back every resource a process holds and free its slot for
+        the next add_process()
+
+        Args:
+            proc_num (int): Process number that finished
+
+        Raises:
+            ValueError: If the process number is out of range or finished
+        """
+        self._check_running(proc_num)
+        with self._write():
+            for j in range(self.num_res):
+                self._set_cell("allocation", proc_num, j, 0)
+                self._set_cell("max", proc_num, j, 0)
+            heapq.heappush(self._free, proc_num)
+            self._free_set.add(proc_num)
+            if self._waiting.pop(proc_num, None) is not None:
+                self._waiting_log.append(proc_num)
+            self._record([{"op": "set_row", "matrix": matrix,
+                           "proc": proc_num, "row": [0] * self.num_res}
+                          for matrix in ("allocation", "max")])
+
+    def wait(self, proc_num: int, resource_req: List[int]):
+        """Record the request a process is blocked on, for deadlocks().
+        Outstanding requests play no part in request() or safety(), and are
+        not kept in snapshots or the journal
+
+        Args:
+            proc_num (int): Process number that is waiting
+            resource_req (List[int]): Number of each resource it is waiting
+                                      for, all zeros when it no longer waits
+
+        Raises:
+            ValueError: If the process number is out of range or finished,
+                        or the request is invalid
+        """
+        self._check_running(proc_num)
+        self._check_row(resource_req, "request")
+        for j in range(self.num_res):
+            if resource_req[j] < 0:
+                raise ValueError(f"Request of resource_{j} must be at " +
+                                 f"least 0, {resource_req[j]} is not")
+        with self._write():
+            if any(resource_req):
+                self._waiting[proc_num] = list(resource_req)
+            else:
+                self._waiting.pop(proc_num, None)
+            self._waiting_log.append(proc_num)
+
+    @property
+    def waiting(self) -> Dict[int, List[int]]:
+        """The request each waiting process is blocked on"""
+        with self._lock:
+            return {proc_num: list(row)
+                    for proc_num, row in self._waiting.items()}
+
+    @timed("deadlocks")
+    def deadlocks(self) -> List[int]:
+        """Find the processes that are deadlocked, from what each process
+        holds and the request it waits on. Maximum claims play no part.
+        Only the processes changed since the last full run and the ones
+        deadlocked then are looked at again when possible, see
+        BankersDeadlocks
+
+        Returns:
+            List[int]: The deadlocked processes, in order
+        """
+        if self._detector is None:
+            # BankersDeadlocks imports this module
+            import BankersDeadlocks
+            self._detector = BankersDeadlocks.DeadlockDetector(self)
+        deadlocked, incremental = self._detector.detect()
+        self.stats["deadlock_incremental_runs" if incremental else
+                   "deadlock_full_runs"] += 1
+        return deadlocked
+
+    def _detect_order(self, requests: List[List[int]]) -> List[int]:
+        """Find the order processes can finish in when each one only needs
+        its outstanding request, without changing the state of the system
+
+        Args:
+            requests (List[List[int]]): Outstanding request of each process
+
+        Returns:
+            List[int]: The processes that were able to finish, in order
+        """
+        return safe_order(list(self.available), requests, self.allocation)
+
+    def _running(self, process_order: List[int]) -> List[int]:
+        """Leave the slots of finished processes out of a process order"""
+        if not self._free_set:
+            return process_order
+        return [i for i in process_order if i not in self._free_set]
+
+    def changes_since(self, version: int) -> Optional[Dict]:
+        """Find the changes made since a version, so a client that has the
+        state at that version can catch up without fetching all of it
+
+        Args:
+            version (int): Version the client has
+
+        Returns:
+            Optional[Dict]: The current version and the changes in the form
+                            patch() takes, or None if the changes are no
+                            longer kept and the whole state is needed
+        """
+        with self._lock:
+            if not self._journal_start <= version <= self.version:
+                return None
+            return {"version": self.version,
+                    "changes": [change for changed, changes in self._journal
+                                if changed > version for change in changes]}
+
+    @timed("calculate_available")
     def calculate_available(self) -> List[int]:
         """Calculate the available array. This contains the number of
         free resources that are not allocated to a process. available[i] = k
@@ -100,6 +1223,7 @@ class BankersAlgorithm:
         # Return the available array
         return available
 
+    @timed("calculate_need")
     def calculate_need(self) -> List[List[int]]:
         """Calculate the need array. This contains the number of resources
         that a process could request. need[i][j] = k means that process i
@@ -112,13 +1236,112 @@ class BankersAlgorithm:
         return [[self.maximum[i][j] - self.allocation[i][j]
                  for j in range(self.num_res)] for i in range(self.num_proc)]
 
-    def request(self, proc_num: int,
-                resource_req: List[int]) -> Tuple[bool, List[int], List[str]]:
+    def hit_rates(self) -> Dict:
+        """How often the cached safe sequence saved running the whole
+        safety algorithm
+
+        Returns:
+            Dict: The counters in stats, the share of requests that took
+                  the fast path, and the share of safety() calls that gave
+                  back the cached sequence as it was and that repaired it
+        """
+        stats = dict(self.stats)
+        requests = stats["fast_path_hits"] + stats["fast_path_misses"]
+        checks = (stats["safety_hits"] + stats["safety_repairs"] +
+                  stats["safety_misses"])
+        stats["fast_path_rate"] = stats["fast_path_hits"] / max(requests, 1)
+        stats["safety_hit_rate"] = stats["safety_hits"] / max(checks, 1)
+        stats["safety_repair_rate"] = (stats["safety_repairs"] /
+                                       max(checks, 1))
+        return stats
+
+    def fits(self, proc_num: int, resource_req: List[int]) -> bool:
+        """Check if a request is within what the process may still ask for
+        and what is free, and leaves it at least zero of everything, without
+        checking safety. A request that fits but is refused by request()
+        would have left the system unsafe
+
+        Args:
+            proc_num (int): Process number that the request is being made on
+            resource_req (List[int]): Number of extra resources requested
+
+        Returns:
+            bool: If the request fits
+        """
+        resource_req = self._as_vector(resource_req)
+        return (self._first_over(proc_num, resource_req) is None and
+                not self._below_zero(proc_num, resource_req))
+
+    def evaluate_request(self, proc_num: int, resource_req: List[int]) -> str:
+        """Find if a request could be granted right now, without changing
+        anything
+
+        Args:
+            proc_num (int): Process number that the request is being made on
+            resource_req (List[int]): Number of extra resources requested
+
+        Returns:
+            str: grantable, unsafe if granting it would leave the system
+                 unsafe, or invalid if the process or request is invalid or
+                 does not fit, see fits()
+        """
+        try:
+            if self.check_request(proc_num, resource_req, QUIET)[0]:
+                return GRANTABLE
+        except ValueError:
+            return INVALID
+        return UNSAFE if self.fits(proc_num, resource_req) else INVALID
+
+    def evaluate_requests(self, candidates: List[Tuple[int, List[int]]],
+                          processes: Optional[int] = None) -> List[str]:
+        """Find which of many requests could each be granted on their own
+        right now, without changing anything. Every request is checked
+        against the same snapshot of the state, and big batches are spread
+        over a process pool, see BankersEvaluate
+
+        Args:
+            candidates (List[Tuple[int, List[int]]]): (process number,
+                                                      resource request)
+                                                      pairs
+            processes (Optional[int]): Most worker processes to use,
+                                       defaults to one per core
+
+        Returns:
+            List[str]: The verdict of evaluate_request() for each request
+        """
+        # BankersEvaluate imports this module
+        import BankersEvaluate
+        return BankersEvaluate.evaluate_requests(self, candidates, processes)
+
+    def plan_grants(self, requests: List[Tuple[int, List[int]]],
+                    weights: Optional[List[float]] = None) -> Dict:
+        """Find a maximal set of requests that can be granted together,
+        without changing anything, see BankersPlanner
+
+        Args:
+            requests (List[Tuple[int, List[int]]]): (process number,
+                                                    resource request) pairs
+            weights (Optional[List[float]]): Priority of each request,
+                                             higher weights are tried first
+
+        Returns:
+            Dict: The plan, its order can be handed to request_batch()
+        """
+        # BankersPlanner imports this module
+        import BankersPlanner
+        return BankersPlanner.plan_grants(self, requests, weights)
+
+    @timed("request")
+    def request(self, proc_num: int, resource_req: List[int],
+                verbosity: Optional[str] = None
+                ) -> Tuple[bool, List[int], List[str]]:
         """Request for a process to be allocated extra resources
 
         Args:
             proc_num (int): Process number that the request is being made on
             resource_req (List[int]): Number of extra resources requested
+            verbosity (Optional[str]): Log verbosity, defaults to the
+                                       verbosity of the object
 
         Returns:
             bool: If the request was carried out and the system is currently
@@ -127,76 +1350,277 @@ class BankersAlgorithm:
         Raises:
             ValueError: If either the process number is out of range
         """
-        # Check that the process number is not out of range
-        if proc_num >= self.num_proc or proc_num < 0:
-            raise ValueError("Requested process number: " +
-                             f"{proc_num} is invalid")
+        # Check the request against a consistent view of the state without
+        # holding the lock, then take the lock only to commit it. If
+        # anything changed in the meantime the check is done again
+        while True:
+            valid_request, safe_seq, logs, version = self.check_request(
+                proc_num, resource_req, verbosity)
+
+            if not valid_request:
+                return False, safe_seq, logs
+
+            if self.commit(proc_num, resource_req, safe_seq, version):
+                logs.append("System is safe with new resource allocation")
+
+                # Return if the request was valid and the system is in a
+                # current safe state
+                return True, safe_seq, logs
+
+    @timed("check_request")
+    def check_request(self, proc_num: int, resource_req: List[int],
+                      verbosity: Optional[str] = None, search: bool = True
+                      ) -> Tuple[Optional[bool], List[int], List[str], int]:
+        """Check if a request could be granted right now, without changing
+        anything. The answer can be handed to commit() later
+
+        Args:
+            proc_num (int): Process number that the request is being made on
+            resource_req (List[int]): Number of extra resources requested
+            verbosity (Optional[str]): Log verbosity, defaults to the
+                                       verbosity of the object
+            search (bool): Run the safety algorithm when the cached safe
+                           sequence does not show the request is safe. If
+                           False the answer is None instead, for callers
+                           that run the algorithm somewhere else
+
+        Returns:
+            Tuple[Optional[bool], List[int], List[str], int]: If the
+                request can be granted, or None if search is False and that
+                takes the safety algorithm, the safe sequence after it, the
+                logs, and the version the check was made at
+
+        Raises:
+            ValueError: If either the process number is out of range
+        """
+        # Check that the process number is not out of range or finished
+        self._check_running(proc_num)
 
         # Check that the resource request is of the correct size
         if len(resource_req) != self.num_res:
             raise ValueError("Length of resource request " +
                              f"{len(resource_req)} is not {self.num_res}")
 
-        # Start logs for request
-        logs = []
+        resource_req = self._as_vector(resource_req)
+
+        while True:
+            # Start logs for request
+            logs = Trace(verbosity or self.verbosity)
+
+            seq = self._read_begin()
+            version = self.version
+            valid_request, safe_seq = self._check_request(
+                proc_num, resource_req, logs, search)
+            if self._read_end(seq):
+                return valid_request, safe_seq, logs, version
+
+    def commit(self, proc_num: int, resource_req: List[int],
+               safe_seq: List[int], version: int) -> bool:
+        """Grant a request that check_request() said could be granted. If
+        other processes were granted or gave back resources since the
+        check, the request is checked again against the safe sequence
+        their commits left, instead of running the check again
+
+        Args:
+            proc_num (int): Process number that the request is being made on
+            resource_req (List[int]): Number of extra resources requested
+            safe_seq (List[int]): Safe sequence from check_request(), set
+                                  in place to the sequence the request was
+                                  granted with
+            version (int): Version from check_request()
+
+        Returns:
+            bool: If the request was granted, False if the state changed
+                  since the check and it has to be made again
+        """
+        resource_req = self._as_vector(resource_req)
+        with self._write():
+            if self.version != version:
+                if not self._still_grantable(proc_num, resource_req,
+                                             safe_seq, version):
+                    self.stats["commit_conflicts"] += 1
+                    return False
 
-        # Calculate the need and available arrays
-        need = self.calculate_need()
-        available = self.calculate_available()
+            # Add the resources to the allocation for that process, this
+            # also updates the need and available arrays
+            self._apply(proc_num, resource_req)
+            self._remember_safe(safe_seq)
+        return True
 
-        # Set the flag for valid request to true
-        valid_request = True
+    def _still_grantable(self, proc_num: int, resource_req: List[int],
+                         safe_seq: List[int], version: int) -> bool:
+        """Check a request that was checked at an earlier version against
+        the current state, using only what it depends on. Only the
+        allocation of other processes may have changed since, so the
+        request still fits what its own process needs and holds, and the
+        same processes are running. It still has to fit what is available,
+        and be shown safe by the current safe sequence or by the one the
+        check found. Has to be called while writing
 
+        Args:
+            proc_num (int): Process number that the request is being made on
+            resource_req (List[int]): Number of extra resources requested
+            safe_seq (List[int]): Safe sequence from the check, set in place
+                                  to the current one if that shows the
+                                  request is safe
+            version (int): Version the request was checked at
+
+        Returns:
+            bool: If the request can still be granted
+        """
+        if version < self._journal_start:
+            return False
+        for changed, changes in reversed(self._journal):
+            if changed <= version:
+                break
+            if any(change.get("matrix") != "allocation" or
+                   change.get("proc") == proc_num for change in changes):
+                return False
+        if self._first_over(proc_num, resource_req) is not None:
+            return False
+        if self._fast_safe(proc_num, resource_req):
+            safe_seq[:] = self._safe[1]
+            return True
+        return self._order_holds(proc_num, resource_req, safe_seq)
+
+    def _order_holds(self, proc_num: int, resource_req: List[int],
+                     process_order: List[int]) -> bool:
+        """Check if a sequence of every running process is still a safe
+        sequence once a request is granted, in one pass over it
+
+        Args:
+            proc_num (int): Process number that the request is being made on
+            resource_req (List[int]): Number of extra resources requested
+            process_order (List[int]): The sequence
+
+        Returns:
+            bool: If every process can finish in that order
+        """
+        work = [self.available[j] - resource_req[j]
+                for j in range(self.num_res)]
+        need = self.need
+        allocation = self.allocation
+        for i in process_order:
+            asked = resource_req if i == proc_num else [0] * self.num_res
+            if any(need[i][j] - asked[j] > work[j]
+                   for j in range(self.num_res)):
+                return False
+            for j in range(self.num_res):
+                work[j] += allocation[i][j] + asked[j]
+        return True
+
+    def _check_request(self, proc_num: int, resource_req: List[int],
+                       logs: Trace, search: bool = True
+                       ) -> Tuple[Optional[bool], List[int]]:
+        """Check if a request can be granted, without changing anything
+
+        Args:
+            proc_num (int): Process number that the request is being made on
+            resource_req (List[int]): Number of extra resources requested
+            logs (Trace): Logs to add to
+            search (bool): Run the safety algorithm if the cached safe
+                           sequence does not settle it, see check_request()
+
+        Returns:
+            Tuple[Optional[bool], List[int]]: If the request can be granted,
+                                              and the safe sequence after
+                                              granting it
+        """
         # Check if any of the values of the request either go above
         # the maximum bound for the process or exceed the number
         # of available resources for the system
-        for i in range(self.num_res):
-            if (resource_req[i] > need[proc_num][i] or
-                    resource_req[i] > available[i]):
-                logs.append(f"Process request of resource_{i} unable " +
-                            "to be fulfulled, not enough resources")
-                # If the request is invalid then log and set the flag
-                valid_request = False
-                break
+        over = self._first_over(proc_num, resource_req)
+        if over is not None:
+            logs.append("Process request of resource_{} unable " +
+                        "to be fulfulled, not enough resources", over)
+            return False, []
 
-        # If the request is valid then add the resources to the allocation
-        # for that process. No need to update the need or available arrays
-        # because they are recalculated during at each function where they
-        # may be modified
-        safe_seq = []
-        if valid_request:
-            logs.append("Valid Request. Adding new process resources")
-            for i in range(self.num_res):
-                self.allocation[proc_num][i] += resource_req[i]
-
-            # Check if any of the allocations are below zero and that
-            # the system is currently in a safe state
-            logs.append("Checking system safety")
-            is_safe, safe_seq, safety_logs = self.safety()
-            logs += safety_logs
-            if min(self.allocation[proc_num]) < 0 or not is_safe:
-                if not is_safe:
-                    logs.append("Resource request puts system in unsafe " +
-                                "state. Resetting to last known good")
-                if min(self.allocation[proc_num]) < 0:
-                    logs.append("Resource request allocated below 0 " +
-                                "resources. Resetting to last known good")
-                # If the system is not safe then unset the valid flag
-                # and reset the requested resources
-                valid_request = False
-                for i in range(self.num_res):
-                    self.allocation[proc_num][i] -= resource_req[i]
-
-            if is_safe:
-                logs.append("System is safe with new resource allocation")
+        # A request can not take a process below zero resources
+        if self._below_zero(proc_num, resource_req):
+            logs.append("Resource request allocated below 0 " +
+                        "resources. Resetting to last known good")
+            return False, []
+
+        logs.append("Valid Request. Adding new process resources")
+
+        # Check the request against the last known safe sequence, if that
+        # sequence still works then the system is safe without running the
+        # whole safety algorithm
+        safe = self._safe
+        if self._fast_safe(proc_num, resource_req):
+            self.stats["fast_path_hits"] += 1
+            logs.append("Cached safe sequence is still safe")
+            return True, list(safe[1])
 
-        # Return if the request was valid and the system is in a current safe
-        # state
-        return valid_request, safe_seq, logs
+        self.stats["fast_path_misses"] += 1
+        if not search:
+            return None, []
+        logs.append("Checking system safety")
+        safe_seq = self._running(self._safe_order(proc_num, resource_req))
+        if not self._log_safety(safe_seq, logs):
+            logs.append("Resource request puts system in unsafe " +
+                        "state. Resetting to last known good")
+            return False, safe_seq
 
+        return True, safe_seq
 
-    def safety(self) -> Tuple[bool, List[int], List[str]]:
-        """Check the safety of the current state of the system.
+    def request_batch(self, requests: List[Tuple[int, List[int]]],
+                      order: Optional[List[int]] = None,
+                      verbosity: Optional[str] = None
+                      ) -> List[Tuple[bool, List[int], List[str]]]:
+        """Carry out many resource requests one after the other. The need
+        and available arrays are shared by all of them, so each request
+        only pays for its own check and safety pass
+
+        Args:
+            requests (List[Tuple[int, List[int]]]): (process number,
+                                                    resource request) pairs
+            order (Optional[List[int]]): Indexes into requests giving the
+                                         order they are admitted in,
+                                         defaults to the order given.
+                                         "plan" admits them in the order
+                                         of plan_grants(), to grant as
+                                         many of them as possible
+            verbosity (Optional[str]): Log verbosity, defaults to the
+                                       verbosity of the object
+
+        Returns:
+            List[Tuple[bool, List[int], List[str]]]: The result of each
+                                                     request, in the same
+                                                     order as requests
+
+        Raises:
+            ValueError: If order is not an ordering of the requests
+        """
+        if order == "plan":
+            order = self.plan_grants(requests)["order"]
+
+        results = [None] * len(requests)
+        for i in admission_order(requests, order):
+            proc_num, resource_req = requests[i]
+            # A bad request should not stop the rest of the batch
+            try:
+                results[i] = self.request(proc_num, resource_req,
+                                          verbosity)
+            except ValueError as ve:
+                results[i] = (False, [], ["Value Error: " + str(ve)])
+
+        return results
+
+    @timed("safety")
+    def safety(self, verbosity: Optional[str] = None
+               ) -> Tuple[bool, List[int], List[str]]:
+        """Check the safety of the current state of the system. The last
+        safe sequence is kept, and is given back as it is while the state
+        has not changed. After a change it is repaired from the first
+        process that can no longer finish, and only if that leaves the
+        system unsafe is the whole safety algorithm run again. The whole
+        result, safe or not, is kept for each verbosity and given back
+        again until the state changes
+
+        Args:
+            verbosity (Optional[str]): Log verbosity, defaults to the
+                                       verbosity of the object
 
         Returns:
             Tuple[bool, List[int], List[str]]: 3-tuple containing if the
@@ -205,60 +1629,190 @@ class BankersAlgorithm:
                                                and the logs to print on
                                                the screen
         """
-        # Start all processes out as unfinished
-        finish = [False] * self.num_proc
-
-        # Calculate the current avaliable resources
-        work = self.calculate_available()
-
-        # Caclulate the number of resources each process could request
-        need = self.calculate_need()
-
-        # Set the flag for the loop
-        done = False
-
-        # Create a queue to store the process order
-        process_order = []
-
-        # Define an array for the logs
-        logs = []
-
-        # Loop while the done flag is unset
-        while(not done):
-            # Find an index i such that both finish[i] == false and
-            # need[i] <= work[i] for all i in need and work
-
-            found_i = False
-            for i in range(self.num_proc):
-                if finish[i]:
-                    continue
-
-                logs.append(f"Checking proc {i}")
-                can_do = True
-                for j in range(self.num_res):
-                    if need[i][j] <= work[j]:
-                        continue
-                    else:
-                        can_do = False
-                        break
-
-                if can_do:
-                    logs.append(f"Executing proc {i}")
-                    found_i = True
-                    process_order.append(i)
-                    finish[i] = True
-                    for j in range(self.num_res):
-                        work[j] += self.allocation[i][j]
-                    break
-
-            if not found_i or min(finish):
-                if not found_i:
-                    logs.append("No more processes are able to execute")
-                if min(finish):
-                    logs.append("All processes are finished")
-                done = True
-
-        return min(finish), process_order, logs
+        verbosity = verbosity or self.verbosity
+        cached = self._safety_results.get(verbosity)
+        if cached is not None and cached[0] == self.version:
+            self.stats["safety_hits"] += 1
+            logs = Trace(verbosity)
+            logs.events = list(cached[3])
+            return cached[1], list(cached[2]), logs
+
+        # Find the order the processes are able to run in, from a
+        # consistent view of the state
+        while True:
+            seq = self._read_begin()
+            version = self.version
+            safe = self._safe
+            if safe is not None and safe[0] == version:
+                outcome = "safety_hits"
+                process_order = list(safe[1])
+            else:
+                process_order = None
+                if safe is not None:
+                    outcome = "safety_repairs"
+                    process_order = self._running(
+                        self._repair_order(safe[1]))
+                    if len(process_order) != (self.num_proc -
+                                              len(self._free_set)):
+                        process_order = None
+                if process_order is None:
+                    # Unsafe states always come from the full search, so
+                    # they are logged the same whatever was cached
+                    outcome = "safety_misses"
+                    process_order = self._running(self._safe_order())
+            if self._read_end(seq):
+                break
+        self.stats[outcome] += 1
+
+        # Define the logs, only the full trace lists every process
+        logs = Trace(verbosity)
+        is_safe = self._log_safety(process_order, logs)
+        if is_safe and outcome != "safety_hits":
+            self._remember_safe(process_order, version)
+        self._safety_results[verbosity] = (version, is_safe,
+                                           list(process_order),
+                                           list(logs.events))
+
+        return is_safe, process_order, logs
+
+    def _log_safety(self, process_order: List[int], logs: Trace) -> bool:
+        """Log the outcome of the safety algorithm
+
+        Args:
+            process_order (List[int]): Processes that were able to finish
+            logs (Trace): Logs to add to
+
+        Returns:
+            bool: If every process was able to finish
+        """
+        if logs.full:
+            for i in process_order:
+                logs.detail("Executing proc {}", i)
+
+        is_safe = len(process_order) == self.num_proc - len(self._free_set)
+        if is_safe:
+            logs.append("All processes are finished")
+        else:
+            logs.append("No more processes are able to execute")
+
+        return is_safe
+
+
+def admission_order(requests: List[Tuple[int, List[int]]],
+                    order: Optional[List[int]] = None) -> Sequence[int]:
+    """The order to admit a batch of requests in, see request_batch()
+
+    Args:
+        requests (List[Tuple[int, List[int]]]): (process number, resource
+                                                request) pairs
+        order (Optional[List[int]]): Indexes into requests, defaults to the
+                                     order given
+
+    Returns:
+        Sequence[int]: Indexes into requests
+
+    Raises:
+        ValueError: If order is not an ordering of the requests
+    """
+    if order is None:
+        return range(len(requests))
+    if sorted(order) != list(range(len(requests))):
+        raise ValueError("Admission order must use every request " +
+                         "exactly once")
+    return order
+
+
+def int64_cells(buffer, count: int, name: str) -> memoryview:
+    """View a buffer as a flat run of int64 cells
+
+    Args:
+        buffer: Object with the buffer protocol, raw bytes or int64 items
+        count (int): Number of cells it should have
+        name (str): Name of the buffer for errors
+
+    Returns:
+        memoryview: The cells
+
+    Raises:
+        ValueError: If the buffer is not int64 cells or the wrong size
+    """
+    try:
+        view = memoryview(buffer)
+    except TypeError:
+        raise ValueError(f"{name} should be a buffer of int64 cells, " +
+                         f"{type(buffer)} is not")
+    if view.format not in ("B", "b", "c") and (
+            view.itemsize != 8 or view.format.lstrip("@=<") not in "ql"):
+        raise ValueError(f"All values in {name} should be int64, " +
+                         f"{view.format} is not")
+    if view.nbytes != 8 * count:
+        raise ValueError(f"{name} should have {count} cells, " +
+                         f"{view.nbytes // 8} is not {count}")
+    return view.cast("B").cast("q")
+
+
+def safe_order(work: List[int], need: List[List[int]],
+               allocation: List[List[int]]) -> List[int]:
+    """Find the order processes can finish in, always running the lowest
+    numbered process that is able to run next. This is the same order as
+    rescanning every process from 0 after each one finishes, but each
+    process is only looked at again when one of the resources it is
+    waiting on grows.
+
+    Args:
+        work (List[int]): Resources free at the start, this is modified
+        need (List[List[int]]): Resources each process could still request
+        allocation (List[List[int]]): Resources held by each process
+
+    Returns:
+        List[int]: The processes that were able to finish, in order
+    """
+    num_proc = len(need)
+    num_res = len(work)
+
+    # blocked[i] is the number of resources process i needs more of than
+    # are currently in work
+    blocked = [0] * num_proc
+
+    # For each resource, the processes blocked on it sorted by their need
+    waiting = []
+    for j in range(num_res):
+        column = sorted((need[i][j], i) for i in range(num_proc)
+                        if need[i][j] > work[j])
+        for _, i in column:
+            blocked[i] += 1
+        waiting.append(column)
+
+    # Position of the first process in each column that is still blocked
+    position = [0] * num_res
+
+    # Processes that are able to run, smallest process number first
+    ready = [i for i in range(num_proc) if blocked[i] == 0]
+    heapq.heapify(ready)
+
+    process_order = []
+    while ready:
+        i = heapq.heappop(ready)
+        process_order.append(i)
+
+        # Free the resources of the process and unblock every process
+        # that was only waiting on the resources that grew
+        for j in range(num_res):
+            if allocation[i][j] <= 0:
+                continue
+            work[j] += allocation[i][j]
+            column = waiting[j]
+            k = position[j]
+            while k < len(column) and column[k][0] <= work[j]:
+                proc = column[k][1]
+                blocked[proc] -= 1
+                if blocked[proc] == 0:
+                    heapq.heappush(ready, proc)
+                k += 1
+            position[j] = k
+
+    return process_order
+
 
 if __name__ == '__main__':
 
@@ -0,0 +1,353 @@
+from concurrent.futures import ThreadPoolExecutor
+from operator import itemgetter
+from typing import List
+from typing import Tuple
+from urllib.parse import urlencode
+from urllib.request import urlopen
+import argparse
+import json
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+
+from BankersAlgorithm import BankersAlgorithm as ba
+
+
+def random_system(num_proc: int, num_res: int, seed: int = 0,
+                  safe: bool = True, backend=ba) -> ba:
+    """Build a reproducible random system. Processes are chained through a
+    random finishing order, each one needs up to what the processes before
+    it have given back, so the safety algorithm has real work to do. An
+    unsafe system has a last process that needs one more of a resource
+    than there will ever be, so every other process still finishes first
+
+    Args:
+        num_proc (int): Number of processes
+        num_res (int): Number of resources
+        seed (int): Seed for the random number generator
+        safe (bool): If the system should be safe
+        backend: BankersAlgorithm class to build
+
+    Returns:
+        BankersAlgorithm: The system
+    """
+    rng = random.Random(seed)
+    spare = [rng.randint(0, 10) for _ in range(num_res)]
+    allocation = [None] * num_proc
+    maximum = [None] * num_proc
+
+    work = list(spare)
+    order = list(range(num_proc))
+    rng.shuffle(order)
+    for i in order:
+        need = [rng.randint(0, min(w, 10)) for w in work]
+        allocation[i] = [rng.randint(0, 5) for _ in range(num_res)]
+        maximum[i] = [a + n for a, n in zip(allocation[i], need)]
+        work = [w + a for w, a in zip(work, allocation[i])]
+
+    if not safe and num_proc and num_res:
+        last = order[-1]
+        j = rng.randrange(num_res)
+        maximum[last][j] = allocation[last][j] + work[j] + 1
+
+    resources = [s + sum(col) for s, col in zip(spare, zip(*allocation))]
+    if not num_proc:
+        resources = spare
+    return backend(num_proc, num_res, resources, allocation, maximum,
+                   trusted=True)
+
+
+def stress(num_threads: int, num_proc: int, num_res: int,
+           requests_per_thread: int) -> Tuple[float, int]:
+    """Make random requests and releases from many threads at once
+
+    Args:
+        num_threads (int): Number of threads
+        num_proc (int): Number of processes
+        num_res (int): Number of resources
+        requests_per_thread (int): Requests each thread makes
+
+    Returns:
+        Tuple[float, int]: Requests handled per second, and how many
+                           commits found the state had changed in a way
+                           that made the request be checked again
+    """
+    b = random_system(num_proc, num_res)
+    b.verbosity = "none"
+
+    def worker(seed: int):
+        rng = random.Random(seed)
+        for _ in range(requests_per_thread):
+            b.request(rng.randrange(num_proc),
+                      [rng.randint(-1, 1) for _ in range(num_res)])
+
+    threads = [threading.Thread(target=worker, args=(seed,))
+               for seed in range(num_threads)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    return (num_threads * requests_per_thread / elapsed,
+            b.stats["commit_conflicts"])
+
+
+def measure(function, repeat: int) -> dict:
+    """Time a function and record the peak memory it allocates
+
+    Args:
+        function: Function to call with no arguments
+        repeat (int): Number of timed calls
+
+    Returns:
+        dict: Best and median seconds per call and peak bytes allocated
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    # Memory is measured on its own call since tracing slows everything
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {"best": min(times), "median": percentile(times, 50),
+            "peak_bytes": peak}
+
+
+def scale(procs: List[int], resources: List[int], max_cells: int,
+          repeat: int, requests: int, backend=ba) -> List[dict]:
+    """Time safety(), request(), calculate_need() and calculate_available()
+    on safe and unsafe random systems of every size asked for. safety() and
+    request() are timed without the results cached by earlier calls
+
+    Args:
+        procs (List[int]): Numbers of processes to try
+        resources (List[int]): Numbers of resources to try
+        max_cells (int): Skip sizes with more matrix cells than this
+        repeat (int): Timed calls of each entry point
+        requests (int): Random requests timed per request() call
+        backend: BankersAlgorithm class to benchmark
+
+    Returns:
+        List[dict]: One result per size, safety and entry point
+    """
+    results = []
+    for num_proc in procs:
+        for num_res in resources:
+            if num_proc * num_res > max_cells:
+                continue
+            for safe in (True, False):
+                b = random_system(num_proc, num_res, safe=safe,
+                                  backend=backend)
+                b.verbosity = "none"
+                rng = random.Random(0)
+                reqs = [(rng.randrange(num_proc),
+                         [rng.randint(0, 1) for _ in range(num_res)])
+                        for _ in range(requests)]
+
+                def safety():
+                    # Without the cached arrays, sequence and result, so
+                    # every call runs the whole safety algorithm
+                    b.invalidate()
+                    b.safety()
+
+                def request():
+                    # Every request is checked against the same state. An
+                    # empty patch moves the version on, so the cached safe
+                    # sequence never vouches for a request
+                    b.patch([])
+                    for proc_num, resource_req in reqs:
+                        b.check_request(proc_num, resource_req)
+
+                entry_points = {"safety": safety,
+                                "request": request,
+                                "calculate_need": b.calculate_need,
+                                "calculate_available": b.calculate_available}
+                for name, function in entry_points.items():
+                    result = measure(function, repeat)
+                    if name == "request":
+                        result["best"] /= requests
+                        result["median"] /= requests
+                    results.append(dict(result, entry_point=name,
+                                        num_proc=num_proc, num_res=num_res,
+                                        safe=safe))
+                    print(f"{name} n={num_proc} m={num_res} " +
+                          f"{'safe' if safe else 'unsafe'}: " +
+                          f"{result['best'] * 1000:.3f}ms " +
+                          f"{result['peak_bytes'] / 1024:.0f}KiB",
+                          file=sys.stderr)
+    return results
+
+
+def compare(before: dict, after: dict):
+    """Print how each result changed between two scale runs"""
+    key = itemgetter("entry_point", "num_proc", "num_res", "safe")
+    old = {key(result): result for result in before["results"]}
+    for result in after["results"]:
+        if key(result) not in old:
+            continue
+        ratio = result["best"] / max(old[key(result)]["best"], 1e-12)
+        entry_point, num_proc, num_res, safe = key(result)
+        print(f"{entry_point} n={num_proc} m={num_res} " +
+              f"{'safe' if safe else 'unsafe'}: {ratio:.2f}x time")
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"],
+                              capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def percentile(samples: List[float], p: float) -> float:
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(p / 100 * len(samples)))]
+
+
+def load_test(url: str, num_proc: int, num_res: int, clients: int,
+              duration: float) -> dict:
+    """Load a running server with a big system and measure the latency
+    of cheap /current polls while other clients hammer /safety and
+    /request, against app.py (gunicorn) or asgi.py (uvicorn)
+
+    Args:
+        url (str): Base URL of the server
+        num_proc (int): Number of processes in the system
+        num_res (int): Number of resources in the system
+        clients (int): Clients sending /safety and /request
+        duration (float): Seconds to run for
+
+    Returns:
+        dict: p50 and p99 latency in milliseconds for each route
+    """
+    b = random_system(num_proc, num_res)
+    config = {"num_proc": num_proc, "num_res": num_res,
+              "resources": b.resources, "allocation": b.allocation,
+              "max": b.maximum}
+    urlopen(url + "/update", urlencode(
+        {"config": json.dumps({"config": config})}).encode()).read()
+
+    latencies = {"/current": [], "/safety": [], "/request": []}
+    stop = time.perf_counter() + duration
+
+    def client(seed: int, route: str):
+        rng = random.Random(seed)
+        while time.perf_counter() < stop:
+            data = None
+            if route == "/request":
+                data = urlencode(
+                    [("proc_id", rng.randrange(num_proc)),
+                     ("verbosity", "none")] +
+                    [("resource_req[]", rng.randint(0, 1))
+                     for _ in range(num_res)]).encode()
+            query = "?verbosity=none" if route == "/safety" else ""
+            start = time.perf_counter()
+            urlopen(url + route + query, data).read()
+            latencies[route].append(time.perf_counter() - start)
+
+    routes = ["/current"] + ["/safety", "/request"] * clients
+    with ThreadPoolExecutor(len(routes)) as executor:
+        for seed, route in enumerate(routes):
+            executor.submit(client, seed, route)
+
+    return {route: {"p50": percentile(samples, 50) * 1000,
+                    "p99": percentile(samples, 99) * 1000,
+                    "count": len(samples)}
+            for route, samples in latencies.items() if samples}
+
+
+def main(args: List[str] = None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the Bankers Algorithm")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    stress_parser = commands.add_parser(
+        "stress", help="Requests from many threads at once")
+    stress_parser.add_argument("--threads", type=int, nargs="+",
+                               default=[1, 2, 4, 8])
+    stress_parser.add_argument("--procs", type=int, default=1000)
+    stress_parser.add_argument("--resources", type=int, default=8)
+    stress_parser.add_argument("--requests", type=int, default=500)
+
+    http_parser = commands.add_parser(
+        "http", help="Latency of a running server under load")
+    http_parser.add_argument("url", nargs="+")
+    http_parser.add_argument("--procs", type=int, default=20000)
+    http_parser.add_argument("--resources", type=int, default=8)
+    http_parser.add_argument("--clients", type=int, default=4)
+    http_parser.add_argument("--duration", type=float, default=10)
+
+    scale_parser = commands.add_parser(
+        "scale", help="Time every entry point across system sizes")
+    scale_parser.add_argument("--procs", type=int, nargs="+",
+                              default=[10, 100, 1000, 10000, 100000])
+    scale_parser.add_argument("--resources", type=int, nargs="+",
+                              default=[1, 4, 16, 64, 256])
+    scale_parser.add_argument("--max-cells", type=int, default=5_000_000)
+    scale_parser.add_argument("--repeat", type=int, default=3)
+    scale_parser.add_argument("--requests", type=int, default=20)
+    scale_parser.add_argument("--backend",
+                              choices=["list", "numpy", "sparse"],
+                              default="list")
+    scale_parser.add_argument("--output", help="JSON file for the results")
+
+    compare_parser = commands.add_parser(
+        "compare", help="Compare two scale result files")
+    compare_parser.add_argument("before")
+    compare_parser.add_argument("after")
+
+    args = parser.parse_args(args)
+
+    if args.command == "scale":
+        backend = ba
+        if args.backend == "numpy":
+            from NumpyBankersAlgorithm import NumpyBankersAlgorithm
+            backend = NumpyBankersAlgorithm
+        elif args.backend == "sparse":
+            from SparseBankersAlgorithm import SparseBankersAlgorithm
+            backend = SparseBankersAlgorithm
+        results = scale(args.procs, args.resources, args.max_cells,
+                        args.repeat, args.requests, backend)
+        report = {"commit": git_commit(), "backend": args.backend,
+                  "python": platform.python_version(),
+                  "time": time.time(), "results": results}
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(report, f, indent=1)
+        else:
+            json.dump(report, sys.stdout, indent=1)
+
+    if args.command == "compare":
+        with open(args.before) as before, open(args.after) as after:
+            compare(json.load(before), json.load(after))
+
+    if args.command == "stress":
+        for num_threads in args.threads:
+            rate, conflicts = stress(num_threads, args.procs,
+                                     args.resources, args.requests)
+            print(f"{num_threads} threads: {rate:.0f} requests/s, " +
+                  f"{conflicts} checked again")
+
+    if args.command == "http":
+        for url in args.url:
+            for route, stats in load_test(url, args.procs, args.resources,
+                                          args.clients,
+                                          args.duration).items():
+                print(f"{url}{route}: p50 {stats['p50']:.1f}ms " +
+                      f"p99 {stats['p99']:.1f}ms ({stats['count']})")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,16 @@
+import array
+import json
+import random
+import threading
+import tracemalloc
 import unittest
 from BankersAlgorithm import BankersAlgorithm as ba
+from BankersAlgorithm import MAX_VERSION
+import BankersEvaluate
+import BankersSnapshot
+import BankersStream
+from NumpyBankersAlgorithm import NumpyBankersAlgorithm, np
+from SparseBankersAlgorithm import SparseBankersAlgorithm, choose_backend
 
 
 class BankersAlgorithmTestCases(unittest.TestCase):
@@ -124,6 +135,580 @@ class BankersAlgorithmTestCases(unittest.TestCase):
             for i in range(self.b.num_res):
                 self.b.resources[i] += self.b.allocation[process][i]
 
+    def test_safety_order_matches_restart_scan(self):
+        """Test that the safety order is the same as restarting the scan
+        from process 0 every time a process finishes
+        """
+        rng = random.Random(0)
+        for _ in range(50):
+            num_proc = rng.randint(1, 12)
+            num_res = rng.randint(1, 4)
+            allocation = [[rng.randint(0, 3) for _ in range(num_res)]
+                          for _ in range(num_proc)]
+            maximum = [[a + rng.randint(0, 4) for a in row]
+                       for row in allocation]
+            resources = [sum(col) + rng.randint(0, 4)
+                         for col in zip(*allocation)]
+            b = ba(num_proc, num_res, resources, allocation, maximum)
+
+            # Run the scan the slow way
+            work = b.calculate_available()
+            need = b.calculate_need()
+            finish = [False] * num_proc
+            expected = []
+            found = True
+            while found:
+                found = False
+                for i in range(num_proc):
+                    if not finish[i] and all(need[i][j] <= work[j]
+                                             for j in range(num_res)):
+                        finish[i] = True
+                        expected.append(i)
+                        for j in range(num_res):
+                            work[j] += allocation[i][j]
+                        found = True
+                        break
+
+            is_safe, safe_seq, _ = b.safety()
+            self.assertEqual(safe_seq, expected)
+            self.assertEqual(is_safe, all(finish))
+
+    def test_cached_arrays_follow_requests(self):
+        """Test that the cached need and available arrays match a fresh
+        calculation after granted and rejected requests
+        """
+        self.b.request(1, [1, 0, 2])
+        self.b.request(4, [3, 3, 0])
+        self.b.request(0, [-1, 0, 0])
+        self.assertEqual([list(row) for row in self.b.need],
+                         self.b.calculate_need())
+        self.assertEqual(list(self.b.available),
+                         self.b.calculate_available())
+
+    def test_changing_state_invalidates_cache(self):
+        """Test that assigning the state, or calling invalidate after an in
+        place change, drops the cached arrays and bumps the version
+        """
+        version = self.b.version
+        self.b.resources = [10, 5, 9]
+        self.assertEqual(list(self.b.available), [3, 3, 4])
+        self.assertGreater(self.b.version, version)
+
+        allocation = self.b.allocation
+        allocation[0][0] = 1
+        self.b.allocation = allocation
+        self.assertEqual(list(self.b.need[0]), [6, 4, 3])
+
+        version = self.b.version
+        self.b.invalidate()
+        self.assertGreater(self.b.version, version)
+
+    def test_versions_are_exact_in_javascript(self):
+        """Test that versions stay small enough for a JavaScript number to
+        hold exactly, as static/index.js sends them back with ?since=
+        """
+        self.b.patch([])
+        for version in (self.b.version, self.b.clone().version):
+            self.assertLessEqual(version, MAX_VERSION)
+            self.assertEqual(int(float(version)), version)
+
+    def test_request_batch(self):
+        """Test that a batch of requests gives the same results as making
+        the requests one at a time, in the admission order asked for
+        """
+        requests = [(1, [1, 0, 2]), (4, [3, 3, 0]), (7, [0, 0, 0]),
+                    (0, [0, 2, 0])]
+        results = self.b.request_batch(requests, order=[3, 2, 1, 0])
+        self.assertEqual([result[0] for result in results],
+                         [False, False, False, True])
+        self.assertTrue(results[2][2][0].startswith("Value Error"))
+        self.assertEqual(self.b.allocation[0], [0, 3, 0])
+        self.assertEqual(self.b.allocation[1], [2, 0, 0])
+
+        with self.assertRaises(ValueError):
+            self.b.request_batch(requests, order=[0, 0, 1, 2])
+
+    def test_fast_path_matches_full_safety(self):
+        """Test that requests answered from the cached safe sequence get
+        the same verdict as a fresh safety check, and that both paths are
+        counted
+        """
+        rng = random.Random(1)
+        self.b.safety()
+        for _ in range(200):
+            proc_num = rng.randrange(self.b.num_proc)
+            resource_req = [rng.randint(-1, 2) for _ in range(self.b.num_res)]
+            expected = ba(self.b.num_proc, self.b.num_res, self.b.resources,
+                          [list(row) for row in self.b.allocation],
+                          self.b.maximum)
+            self.assertEqual(self.b.request(proc_num, resource_req)[0],
+                             expected.request(proc_num, resource_req)[0])
+            self.assertEqual(self.b.allocation, expected.allocation)
+
+        self.assertGreater(self.b.stats["fast_path_hits"], 0)
+        self.assertGreater(self.b.stats["fast_path_misses"], 0)
+
+    def test_safety_reuses_and_repairs_cached_sequence(self):
+        """Test that safety() gets the same verdict as a fresh check after
+        every kind of change, hands back a sequence that really is safe,
+        and counts how it found it
+        """
+        rng = random.Random(2)
+        self.b.verbosity = "none"
+        safe_steps = 0
+        for step in range(300):
+            proc_num = rng.randrange(self.b.num_proc)
+            if step % 7 == 0:
+                # A patch the fast path of request() never sees
+                res = rng.randrange(3)
+                self.b.patch([{"op": "set", "matrix": "max",
+                               "proc": proc_num, "res": res,
+                               "value": self.b.allocation[proc_num][res] +
+                               rng.randint(0, 3)}])
+            elif step % 5 == 0:
+                self.b.release(proc_num)
+            else:
+                try:
+                    self.b.request(proc_num,
+                                   [rng.randint(0, 1) for _ in range(3)])
+                except ValueError:
+                    pass
+
+            is_safe, safe_seq, _ = self.b.safety()
+            expected = ba(self.b.num_proc, self.b.num_res, self.b.resources,
+                          self.b.allocation, self.b.maximum)
+            self.assertEqual(is_safe, expected.safety("none")[0])
+            if not is_safe:
+                continue
+            safe_steps += 1
+            self.assertEqual(sorted(safe_seq), list(range(self.b.num_proc)))
+            work = expected.available
+            for i in safe_seq:
+                self.assertTrue(all(n <= w for n, w in
+                                    zip(expected.need[i], work)))
+                work = [w + a for w, a in
+                        zip(work, expected.allocation[i])]
+            # Nothing changed, so the cached sequence is handed back
+            self.assertEqual(self.b.safety()[1], safe_seq)
+
+        rates = self.b.hit_rates()
+        self.assertGreater(rates["safety_hits"], 0)
+        self.assertGreater(rates["safety_repairs"], 0)
+        self.assertGreater(rates["safety_misses"], 0)
+        self.assertEqual(rates["safety_hits"] + rates["safety_repairs"] +
+                         rates["safety_misses"], 300 + safe_steps)
+        self.assertGreaterEqual(rates["safety_hits"], safe_steps)
+
+    def test_safety_results_are_cached_by_version(self):
+        """Test that an unchanged state gets the last result back at each
+        verbosity, unsafe ones too, and any change checks it again
+        """
+        self.b.patch([{"op": "set", "matrix": "resources", "res": 0,
+                       "value": 5}])
+        first = self.b.safety()
+        self.assertFalse(first[0])
+        misses = self.b.stats["safety_misses"]
+
+        # Changing what was handed out does not change the cache
+        first[1].append(9)
+        first[2].append("Changed")
+        again = self.b.safety()
+        self.assertEqual(again[1], first[1][:-1])
+        self.assertEqual(again[2], first[2][:-1])
+        self.assertEqual(self.b.stats["safety_misses"], misses)
+        self.assertEqual(len(self.b.safety("summary")[2]), 1)
+        self.assertEqual(self.b.stats["safety_misses"], misses + 1)
+
+        self.b.patch([{"op": "set", "matrix": "resources", "res": 0,
+                       "value": 10}])
+        self.assertTrue(self.b.safety()[0])
+
+    def test_log_verbosity(self):
+        """Test that the summary logs leave out the per process lines, no
+        logs are kept at all when asked, and bad levels are refused
+        """
+        _, safe_seq, logs = self.b.safety("full")
+        self.assertEqual(logs, ["Executing proc 1", "Executing proc 3",
+                                "Executing proc 0", "Executing proc 2",
+                                "Executing proc 4",
+                                "All processes are finished"])
+        self.assertEqual(self.b.safety("summary")[2],
+                         ["All processes are finished"])
+        self.assertEqual(len(self.b.request(1, [1, 0, 2], "none")[2]), 0)
+
+        self.b.verbosity = "summary"
+        self.assertNotIn("Executing proc 1", self.b.request(0, [0, 1, 0])[2])
+
+        with self.assertRaises(ValueError):
+            self.b.safety("loud")
+
+    def test_concurrent_requests_keep_state_consistent(self):
+        """Test that requests from many threads at once leave the cached
+        arrays matching the allocation and the system safe
+        """
+        def worker(seed):
+            rng = random.Random(seed)
+            for _ in range(200):
+                proc_num = rng.randrange(self.b.num_proc)
+                self.b.request(proc_num, [rng.randint(-1, 1)
+                                          for _ in range(self.b.num_res)])
+                self.b.safety()
+                self.b.snapshot()
+
+        threads = [threading.Thread(target=worker, args=(seed,))
+                   for seed in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([list(row) for row in self.b.need],
+                         self.b.calculate_need())
+        self.assertEqual(list(self.b.available),
+                         self.b.calculate_available())
+        self.assertTrue(self.b.safety()[0])
+
+    def test_caches_built_while_requests_are_granted(self):
+        """Test that the need and available arrays one thread builds while
+        other threads grant requests never replace the arrays those grants
+        updated
+        """
+        backend = type(self.b)
+        num_proc, num_res = 400, 4
+        for _ in range(50):
+            b = backend(num_proc, num_res, [2 * num_proc] * num_res,
+                        [[1] * num_res for _ in range(num_proc)],
+                        [[3] * num_res for _ in range(num_proc)])
+            start = threading.Barrier(4)
+
+            def worker(first):
+                start.wait()
+                for proc_num in range(first, num_proc, 40):
+                    b.request(proc_num, [1] * num_res, "none")
+
+            threads = [threading.Thread(target=worker, args=(first,))
+                       for first in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            self.assertEqual([list(row) for row in b.need],
+                             b.calculate_need())
+            self.assertEqual(list(b.available), b.calculate_available())
+
+    def test_commits_only_fail_on_what_the_check_read(self):
+        """Test that a checked request is still committed after requests by
+        other processes that leave it safe, and is checked again after
+        ones that do not, or after changes to its own process
+        """
+        first = self.b.check_request(1, [1, 0, 2])
+        second = self.b.check_request(3, [0, 1, 0])
+        self.assertTrue(self.b.commit(1, [1, 0, 2], first[1], first[3]))
+        self.assertTrue(self.b.commit(3, [0, 1, 0], second[1], second[3]))
+        self.assertTrue(self.b.safety()[0])
+        self.assertEqual(self.b.safety()[1], second[1])
+
+        # Both are safe on their own, but not together
+        self.setUp()
+        first = self.b.check_request(0, [0, 0, 1])
+        second = self.b.check_request(1, [0, 0, 1])
+        self.assertTrue(self.b.commit(0, [0, 0, 1], first[1], first[3]))
+        self.assertFalse(self.b.commit(1, [0, 0, 1], second[1], second[3]))
+        self.assertFalse(self.b.request(1, [0, 0, 1])[0])
+
+        # A patch leaves no cached safe sequence, the one the check found
+        # is walked instead
+        self.setUp()
+        check = self.b.check_request(3, [0, 1, 0])
+        self.b.patch([{"op": "set", "matrix": "allocation", "proc": 1,
+                       "res": 0, "value": 1}])
+        self.assertTrue(self.b.commit(3, [0, 1, 0], check[1], check[3]))
+        check = self.b.check_request(1, [0, 0, 1])
+        self.b.patch([{"op": "set", "matrix": "allocation", "proc": 0,
+                       "res": 2, "value": 1}])
+        self.assertFalse(self.b.commit(1, [0, 0, 1], check[1], check[3]))
+        self.assertEqual(self.b.allocation,
+                         [[0, 1, 1], [1, 0, 0], [3, 0, 2], [2, 2, 1],
+                          [0, 0, 2]])
+
+        self.setUp()
+        check = self.b.check_request(3, [0, 1, 0])
+        self.b.release(3, [1, 0, 0])
+        self.assertFalse(self.b.commit(3, [0, 1, 0], check[1], check[3]))
+        check = self.b.check_request(3, [0, 1, 0])
+        self.b.patch([{"op": "set", "matrix": "max", "proc": 1, "res": 0,
+                       "value": 4}])
+        self.assertFalse(self.b.commit(3, [0, 1, 0], check[1], check[3]))
+        self.assertEqual(self.b.stats["commit_conflicts"], 2)
+        self.assertTrue(self.b.safety()[0])
+
+    def test_rejected_request_leaves_state_alone(self):
+        """Test that a request that would be unsafe never changes the
+        allocation or the version
+        """
+        version = self.b.version
+        self.assertFalse(self.b.request(4, [3, 3, 0])[0])
+        self.assertEqual(self.b.version, version)
+
+    def test_patch(self):
+        """Test that patched cells and processes show up in the state and
+        the cached arrays, and that a bad patch changes nothing
+        """
+        self.b.need
+        self.b.available
+        self.b.patch([{"op": "set", "matrix": "resources", "res": 2,
+                       "value": 9},
+                      {"op": "set", "matrix": "allocation", "proc": 0,
+                       "res": 0, "value": 1},
+                      {"op": "set_row", "matrix": "max", "proc": 1,
+                       "row": [4, 2, 2]},
+                      {"op": "remove_process", "proc": 2},
+                      {"op": "add_process", "allocation": [1, 0, 0],
+                       "max": [2, 2, 2]}])
+        self.assertEqual(self.b.num_proc, 5)
+        self.assertEqual(self.b.resources, [10, 5, 9])
+        self.assertEqual(self.b.allocation[0], [1, 1, 0])
+        self.assertEqual(self.b.maximum[1], [4, 2, 2])
+        self.assertEqual(self.b.allocation[2], [2, 1, 1])
+        self.assertEqual(self.b.maximum[4], [2, 2, 2])
+        self.assertEqual([list(row) for row in self.b.need],
+                         self.b.calculate_need())
+        self.assertEqual(list(self.b.available),
+                         self.b.calculate_available())
+
+        state = self.b.snapshot()
+        for change in ({"op": "set", "matrix": "max", "proc": 5, "res": 0,
+                        "value": 1},
+                       {"op": "set", "matrix": "resources", "res": 0,
+                        "value": 1.5},
+                       {"op": "add_process", "allocation": [0, 0],
+                        "max": [0, 0, 0]},
+                       {"op": "grow"}):
+            with self.assertRaises(ValueError):
+                self.b.patch([{"op": "remove_process", "proc": 0}, change])
+        self.assertEqual(self.b.snapshot(), state)
+
+    def test_process_lifecycle(self):
+        """Test that finished processes give everything back and leave the
+        safe sequence, and that their slots are reused by new processes
+        before the matrices grow
+        """
+        self.assertEqual(self.b.release(3), [2, 1, 1])
+        self.assertEqual(self.b.allocation[3], [0, 0, 0])
+        self.assertEqual(list(self.b.need[3]), [2, 2, 2])
+
+        self.b.finish(1)
+        self.b.finish(2)
+        self.assertEqual(self.b.free, [1, 2])
+        self.assertEqual(list(self.b.available), [10, 4, 5])
+        is_safe, safe_seq, _ = self.b.safety()
+        self.assertTrue(is_safe)
+        self.assertEqual(sorted(safe_seq), [0, 3, 4])
+        with self.assertRaises(ValueError):
+            self.b.request(1, [0, 0, 0])
+        with self.assertRaises(ValueError):
+            self.b.finish(1)
+
+        self.assertEqual(self.b.add_process([1, 1, 1]), 1)
+        self.assertEqual(self.b.add_process([1, 1, 1]), 2)
+        self.assertEqual(self.b.num_proc, 5)
+        self.assertTrue(self.b.request(2, [1, 1, 1])[0])
+
+        proc_num = self.b.add_process([10, 5, 7])
+        self.assertEqual(proc_num, 5)
+        self.assertGreaterEqual(self.b.num_proc, 6)
+        self.assertTrue(self.b.safety()[0])
+        self.assertEqual([list(row) for row in self.b.need],
+                         self.b.calculate_need())
+        self.assertEqual(list(self.b.available),
+                         self.b.calculate_available())
+
+        with self.assertRaises(ValueError):
+            self.b.add_process([11, 0, 0])
+
+    def test_finished_slots_can_not_be_patched(self):
+        """Test that a patch can not give a finished process resources or
+        a claim, so its slot is still empty when it is handed out again
+        """
+        self.b.finish(1)
+        state = self.b.snapshot()
+        for change in ({"op": "set", "matrix": "allocation", "proc": 1,
+                        "res": 0, "value": 4},
+                       {"op": "set_row", "matrix": "max", "proc": 1,
+                        "row": [1, 1, 1]},
+                       {"op": "set", "matrix": "max", "proc": 0, "res": 0,
+                        "value": 1}):
+            with self.assertRaises(ValueError):
+                # Removing process 0 moves the finished slot to 0
+                self.b.patch([{"op": "remove_process", "proc": 0}, change]
+                             if change["proc"] == 0 else [change])
+        self.assertEqual(self.b.snapshot(), state)
+        self.assertTrue(self.b.safety()[0])
+
+        self.b.patch([{"op": "set", "matrix": "max", "proc": 2, "res": 0,
+                       "value": 8}])
+        self.assertEqual(self.b.add_process([1, 1, 1]), 1)
+        self.assertEqual(self.b.allocation[1], [0, 0, 0])
+
+    def test_bulk_construction(self):
+        """Test that systems built from buffers, trusted states and clones
+        match the system they came from, and that bad buffers are refused
+        """
+        def without_version(state):
+            return {key: value for key, value in state.items()
+                    if key != "version"}
+
+        backend = type(self.b)
+        self.b.finish(4)
+        state = self.b.snapshot()
+        allocation = array.array("q", [cell for row in state["allocation"]
+                                       for cell in row])
+        maximum = array.array("q", [cell for row in state["max"]
+                                    for cell in row])
+        b = backend.from_buffers(5, 3, array.array("q", state["resources"]),
+                                 allocation.tobytes(), maximum)
+        self.assertEqual(b.allocation, state["allocation"])
+        self.assertEqual(b.maximum, state["max"])
+
+        trusted = backend(5, 3, state["resources"], state["allocation"],
+                          state["max"], trusted=True)
+        self.assertEqual(trusted.safety()[0], self.b.safety()[0])
+
+        clone = self.b.clone()
+        self.assertEqual(without_version(clone.snapshot()),
+                         without_version(state))
+        self.assertTrue(clone.request(1, [1, 0, 2])[0])
+        self.assertEqual(self.b.allocation[1], [2, 0, 0])
+
+        with self.assertRaises(ValueError):
+            backend.from_buffers(5, 3, array.array("q", state["resources"]),
+                                 allocation, array.array("i", maximum))
+        with self.assertRaises(ValueError):
+            backend.from_buffers(5, 3, state["resources"], allocation,
+                                 maximum)
+        with self.assertRaises(ValueError):
+            backend.from_buffers(5, 3, array.array("q", state["resources"]),
+                                 allocation[:-1], maximum)
+
+    def test_changes_since(self):
+        """Test that the changes since a version bring a copy of the state
+        at that version up to date, until the journal no longer has them
+        """
+        state = self.b.snapshot()
+        self.b.request(1, [1, 0, 2])
+        self.b.patch([{"op": "add_process", "allocation": [0, 0, 0],
+                       "max": [1, 1, 1]}])
+        self.assertEqual(self.b.changes_since(self.b.version),
+                         {"version": self.b.version, "changes": []})
+
+        changes = self.b.changes_since(state["version"])
+        # Sparse snapshots only read like lists, the list backend keeps the
+        # lists it is given
+        copy = ba(state["num_proc"], state["num_res"], state["resources"],
+                  [list(row) for row in state["allocation"]],
+                  [list(row) for row in state["max"]])
+        copy.patch(changes["changes"])
+        self.assertEqual(changes["version"], self.b.version)
+        self.assertEqual(copy.allocation, self.b.allocation)
+        self.assertEqual(copy.maximum, self.b.maximum)
+
+        self.b.journal_size = 1
+        self.b.request(3, [0, 1, 0])
+        self.b.request(3, [0, 0, 1])
+        self.assertIsNone(self.b.changes_since(state["version"]))
+        self.assertIsNone(self.b.changes_since(self.b.version + 1))
+        self.b.invalidate()
+        self.assertIsNone(self.b.changes_since(self.b.version - 1))
+
+    def test_release_and_exchange(self):
+        """Test that part of an allocation can be given back without a
+        safety check, and that an exchange is made whole or not at all
+        """
+        self.b.verbosity = "none"
+        self.b.safety()
+        self.assertEqual(self.b.release(2, [1, 0, 1]), [1, 0, 1])
+        self.assertEqual(self.b.allocation[2], [2, 0, 1])
+        self.assertEqual(list(self.b.available), [4, 3, 3])
+        self.assertEqual(list(self.b.need[2]), [7, 0, 1])
+        # The cached safe sequence survives the release
+        self.assertEqual(self.b.stats["safety_misses"], 1)
+        self.assertTrue(self.b.safety()[0])
+        self.assertEqual(self.b.stats["safety_hits"], 1)
+
+        for bad in ([3, 0, 0], [-1, 0, 0], [1, 0]):
+            with self.assertRaises(ValueError):
+                self.b.release(2, bad)
+        self.assertEqual(self.b.allocation[2], [2, 0, 1])
+
+        # Swap one instance of resource_2 for one of resource_1
+        is_safe, safe_seq, _ = self.b.exchange(4, [0, 1, 0], [0, 0, 1])
+        self.assertTrue(is_safe)
+        self.assertEqual(self.b.allocation[4], [0, 1, 1])
+        self.assertEqual(sorted(safe_seq), list(range(5)))
+
+        # Only giving back, so no safety check is needed
+        misses = self.b.stats["fast_path_misses"]
+        self.assertTrue(self.b.exchange(3, [0, 0, 0], [1, 0, 0])[0])
+        self.assertTrue(self.b.exchange(3, [1, 0, 0], [1, 1, 0])[0])
+        self.assertEqual(self.b.allocation[3], [1, 0, 1])
+        self.assertEqual(self.b.stats["fast_path_misses"], misses)
+
+        # Refused as unsafe, nothing is released either
+        self.assertTrue(self.b.request(1, [1, 0, 1])[0])
+        state = self.b.snapshot()
+        self.assertFalse(self.b.exchange(0, [4, 3, 2], [0, 1, 0])[0])
+        with self.assertRaises(ValueError):
+            self.b.exchange(0, [0, 0, 0], [0, 2, 0])
+        with self.assertRaises(ValueError):
+            self.b.exchange(0, [-1, 0, 0], [0, 0, 0])
+        # A bad verbosity is refused before anything is given back
+        for acquire in ([0, 0, 0], [1, 0, 0]):
+            with self.assertRaises(ValueError):
+                self.b.exchange(3, acquire, [1, 0, 0], "loud")
+        self.assertEqual(self.b.snapshot(), state)
+
+        self.assertEqual(self.b.release(3), [1, 0, 1])
+
+    def test_evaluate_requests(self):
+        """Test that every candidate gets the verdict of making it alone on
+        a copy of the system, in this process and in a pool, and the system
+        is left alone
+        """
+        rng = random.Random(0)
+        self.b.finish(4)
+        candidates = [(1, [1, 0, 2]), (0, [0, 2, 0]), (9, [0, 0, 0]),
+                      (4, [0, 0, 0]), (2, [0, 0])]
+        candidates += [(rng.randrange(4), [rng.randint(-1, 3)
+                                           for _ in range(3)])
+                       for _ in range(40)]
+        expected = []
+        for proc_num, resource_req in candidates:
+            copy = self.b.clone()
+            try:
+                granted = copy.request(proc_num, resource_req)[0]
+            except ValueError:
+                granted = None
+            if granted:
+                expected.append("grantable")
+            elif granted is not None and copy.fits(proc_num, resource_req):
+                expected.append("unsafe")
+            else:
+                expected.append("invalid")
+        self.assertEqual(set(expected), {"grantable", "unsafe", "invalid"})
+
+        version = self.b.version
+        self.assertEqual(self.b.evaluate_requests(candidates), expected)
+        parallel_cells = BankersEvaluate.PARALLEL_CELLS
+        BankersEvaluate.PARALLEL_CELLS = 0
+        try:
+            self.assertEqual(self.b.evaluate_requests(candidates, 2),
+                             expected)
+        finally:
+            BankersEvaluate.PARALLEL_CELLS = parallel_cells
+        self.assertEqual(self.b.version, version)
+        self.assertEqual(self.b.allocation[1], [2, 0, 0])
+
     def test_num_proc_must_be_int(self):
         with self.assertRaises(ValueError):
             self.b = ba("a", 3, [10, 5, 7],
@@ -326,6 +911,189 @@ class BankersAlgorithmTestCases(unittest.TestCase):
                          [2, 2, 2],
                          [4, 3, 3]])
 
+    def test_allocation_can_not_be_negative(self):
+        """Test that a process holding less than nothing is refused, when
+        the system is built and when it is patched, since finishing it
+        would take work away from the safety algorithm
+        """
+        backend = type(self.b)
+        with self.assertRaises(ValueError):
+            backend(2, 1, [1], [[-1], [1]], [[0], [2]])
+        for change in ({"op": "set", "matrix": "allocation", "proc": 0,
+                        "res": 1, "value": -1},
+                       {"op": "set_row", "matrix": "allocation", "proc": 1,
+                        "row": [0, -2, 0]},
+                       {"op": "add_process", "allocation": [-1, 0, 0],
+                        "max": [1, 1, 1]}):
+            with self.assertRaises(ValueError):
+                self.b.patch([change])
+        self.assertEqual(self.b.allocation[0], [0, 1, 0])
+        self.assertEqual(self.b.num_proc, 5)
+
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class NumpyBankersAlgorithmTestCases(BankersAlgorithmTestCases):
+    def setUp(self):
+        """Set up the same system as the list based tests, backed by numpy
+        arrays
+        """
+        self.b = NumpyBankersAlgorithm(5, 3, [10, 5, 7],
+                                       [[0, 1, 0],
+                                        [2, 0, 0],
+                                        [3, 0, 2],
+                                        [2, 1, 1],
+                                        [0, 0, 2]],
+                                       [[7, 5, 3],
+                                        [3, 2, 2],
+                                        [9, 0, 2],
+                                        [2, 2, 2],
+                                        [4, 3, 3]])
+
+    def test_safety_order_matches_restart_scan(self):
+        """The numpy backend finishes processes in batches so only the
+        safety verdict has to match the list backend
+        """
+        rng = random.Random(0)
+        for _ in range(50):
+            num_proc = rng.randint(1, 12)
+            num_res = rng.randint(1, 4)
+            allocation = [[rng.randint(0, 3) for _ in range(num_res)]
+                          for _ in range(num_proc)]
+            maximum = [[a + rng.randint(0, 4) for a in row]
+                       for row in allocation]
+            resources = [sum(col) + rng.randint(0, 4)
+                         for col in zip(*allocation)]
+            expected = ba(num_proc, num_res, resources, allocation, maximum)
+            b = NumpyBankersAlgorithm(num_proc, num_res, resources,
+                                      allocation, maximum)
+            self.assertEqual(b.safety()[0], expected.safety()[0])
+
+    def test_state_is_returned_as_lists(self):
+        """Test that the state can still be read as plain lists"""
+        self.assertEqual(self.b.allocation[0], [0, 1, 0])
+        self.assertEqual(self.b.maximum[2], [9, 0, 2])
+        self.assertEqual(self.b.resources, [10, 5, 7])
+
+
+class SparseBankersAlgorithmTestCases(BankersAlgorithmTestCases):
+    def setUp(self):
+        """Set up the same system as the list based tests, kept as the
+        nonzero cells of each row
+        """
+        self.b = SparseBankersAlgorithm(5, 3, [10, 5, 7],
+                                        [[0, 1, 0],
+                                         [2, 0, 0],
+                                         [3, 0, 2],
+                                         [2, 1, 1],
+                                         [0, 0, 2]],
+                                        [[7, 5, 3],
+                                         [3, 2, 2],
+                                         [9, 0, 2],
+                                         [2, 2, 2],
+                                         [4, 3, 3]])
+
+    def test_snapshot_keeps_rows_sparse(self):
+        """Test that snapshots and the matrices read like lists, go out as
+        the same JSON, and are never held as lists of every cell
+        """
+        state = self.b.snapshot()
+        self.assertEqual(state["allocation"], [[0, 1, 0], [2, 0, 0],
+                                               [3, 0, 2], [2, 1, 1],
+                                               [0, 0, 2]])
+        self.assertEqual(self.b.maximum[2], [9, 0, 2])
+        self.assertEqual(json.loads(b"".join(BankersStream.stream(state))),
+                         json.loads(json.dumps(
+                             state, default=BankersStream.default)))
+        self.assertEqual(BankersSnapshot.state(
+            BankersSnapshot.dumps(state))["max"], state["max"])
+
+        num_proc, num_res = 2000, 2000
+        b = SparseBankersAlgorithm(
+            num_proc, num_res, [num_proc] * num_res,
+            [{i: 1} for i in range(num_proc)],
+            [{i: 2} for i in range(num_proc)], trusted=True)
+        tracemalloc.start()
+        state = b.snapshot()
+        self.assertEqual(sum(map(sum, state["allocation"])), num_proc)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        # The dense matrices would take 8 bytes a cell
+        self.assertLess(peak, num_proc * num_res)
+
+    def test_safety_order_matches_restart_scan(self):
+        """Test on random sparse systems that every safety check and
+        request gives exactly what the list backend gives, as the state
+        changes
+        """
+        rng = random.Random(0)
+        for _ in range(30):
+            num_proc = rng.randint(1, 12)
+            num_res = rng.randint(1, 40)
+            allocation = [[0] * num_res for _ in range(num_proc)]
+            maximum = [[0] * num_res for _ in range(num_proc)]
+            for i in range(num_proc):
+                for j in rng.sample(range(num_res), min(num_res, 3)):
+                    allocation[i][j] = rng.randint(0, 3)
+                    maximum[i][j] = allocation[i][j] + rng.randint(0, 4)
+            resources = [sum(col) + rng.randint(0, 4)
+                         for col in zip(*allocation)]
+            expected = ba(num_proc, num_res, resources,
+                          [list(row) for row in allocation],
+                          [list(row) for row in maximum])
+            b = SparseBankersAlgorithm(num_proc, num_res, resources,
+                                       allocation, maximum)
+            expected.verbosity = b.verbosity = "none"
+
+            for _ in range(30):
+                running = [i for i in range(b.num_proc) if i not in b.free]
+                kind = rng.random()
+                if kind < 0.5 and running:
+                    i = rng.choice(running)
+                    req = [0] * num_res
+                    for j in rng.sample(range(num_res), min(num_res, 2)):
+                        req[j] = rng.randint(-1, 2)
+                    self.assertEqual(b.request(i, req)[:2],
+                                     expected.request(i, req)[:2])
+                elif kind < 0.65 and running:
+                    i = rng.choice(running)
+                    released = [rng.randint(0, max(count, 0))
+                                for count in expected.allocation[i]]
+                    self.assertEqual(b.release(i, released),
+                                     expected.release(i, released))
+                elif kind < 0.8:
+                    # Sometimes less is left than is held
+                    change = [{"op": "set", "matrix": "resources",
+                               "res": rng.randrange(num_res),
+                               "value": rng.randint(0, 6)}]
+                    b.patch(change)
+                    expected.patch(change)
+                elif kind < 0.9 and running:
+                    i = rng.choice(running)
+                    b.finish(i)
+                    expected.finish(i)
+                else:
+                    row = [0] * num_res
+                    j = rng.randrange(num_res)
+                    row[j] = rng.randint(0, max(expected.resources[j], 0))
+                    self.assertEqual(b.add_process(row),
+                                     expected.add_process(row))
+                self.assertEqual(b.safety()[:2], expected.safety()[:2])
+                self.assertEqual(b.need, expected.need)
+                self.assertEqual(b.available, expected.available)
+
+    def test_choose_backend(self):
+        """Test that only systems with many resources and few nonzero
+        claims get the sparse backend
+        """
+        sparse = [[1] + [0] * 99 for _ in range(10)]
+        self.assertIs(choose_backend(100, sparse), SparseBankersAlgorithm)
+        self.assertIs(choose_backend(100, [[1] * 100 for _ in range(10)]),
+                      ba)
+        self.assertIs(choose_backend(3, [[1, 0, 0]]), ba)
+        self.assertIs(choose_backend("100", sparse), ba)
+        self.assertEqual(self.b.allocation_rows[3], {0: 2, 1: 1, 2: 1})
+        self.assertEqual(self.b.need_rows[2], {0: 6})
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,208 @@
+"""Deadlock detection for Bankers Algorithm systems.
+
+Avoidance needs every process to declare its maximum claim up front.
+Detection only needs what each process holds and the request it is blocked
+on, set with BankersAlgorithm.wait(). Processes whose outstanding request
+fits in the free resources are let finish and give back what they hold,
+until no more can. The processes left over are deadlocked. Maximum claims
+play no part.
+
+A full run looks at every process. It remembers the order the processes
+finished in, how much of each resource was left over just before each of
+them ran, and the allocation and outstanding request each one had. A later
+run only looks at the processes changed since then, found in the journal,
+and at the processes that were deadlocked:
+
+* A process that finished can still finish in the same order if what was
+  left over for it then covers everything taken since. Resources taken by
+  changed processes only ever come out of what was left over, so checking
+  the smallest amount left over for any process against the total taken is
+  enough for the processes that did not change. The changed ones are
+  checked one by one.
+* Once they have all finished, the free resources are everything not held
+  by the processes that were deadlocked or are new, and only those are
+  searched again.
+
+If any check fails, a process was removed, too many processes changed or
+the journal no longer goes back far enough, the run is a full one.
+"""
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from BankersAlgorithm import BankersAlgorithm
+from BankersAlgorithm import safe_order
+
+
+class DeadlockDetector:
+    # Share of the processes that may have changed before a full run is
+    # cheaper than checking all of them
+    full_share = 0.25
+
+    def __init__(self, system: BankersAlgorithm):
+        """Find deadlocked processes of a system
+
+        Args:
+            system (BankersAlgorithm): The system
+        """
+        self.system = system
+
+        # What the last full run found, see _full
+        self._baseline = None
+
+    def detect(self) -> Tuple[List[int], bool]:
+        """Find the deadlocked processes
+
+        Returns:
+            Tuple[List[int], bool]: The deadlocked processes, and if only
+                                    the changed and deadlocked processes
+                                    were looked at
+        """
+        system = self.system
+        while True:
+            seq = system._read_begin()
+            waits = len(system._waiting_log)
+            deadlocked = None
+            if self._baseline is not None:
+                deadlocked = self._incremental(self._baseline)
+            baseline = None
+            if deadlocked is None:
+                baseline = self._full()
+                deadlocked = baseline["deadlocked"]
+            if system._read_end(seq):
+                break
+
+        if baseline is not None:
+            # Outstanding requests changed before the full run are in it
+            with system._lock:
+                del system._waiting_log[:waits]
+            self._baseline = baseline
+        return list(deadlocked), baseline is None
+
+    def _full(self) -> Dict:
+        """Look at every process
+
+        Returns:
+            Dict: The deadlocked processes and everything _incremental needs
+        """
+        system = self.system
+        num_proc = system.num_proc
+        num_res = system.num_res
+        requests = [[0] * num_res for _ in range(num_proc)]
+        for proc_num, row in system._waiting.items():
+            requests[proc_num] = list(row)
+        order = system._detect_order(requests)
+
+        finished = [False] * num_proc
+        for i in order:
+            finished[i] = True
+
+        # What was left over just before each process finished
+        allocation = system.allocation
+        work = list(system.available)
+        position = {}
+        slack = []
+        for k, i in enumerate(order):
+            position[i] = k
+            slack.append([work[j] - requests[i][j] for j in range(num_res)])
+            row = allocation[i]
+            for j in range(num_res):
+                work[j] += row[j]
+        if slack:
+            min_slack = [min(column) for column in zip(*slack)]
+        else:
+            min_slack = [float("inf")] * num_res
+
+        return {"version": system.version, "num_proc": num_proc,
+                "resources": list(system.resources),
+                "allocation": [list(row) for row in allocation],
+                "requests": {proc_num: list(row) for proc_num, row
+                             in system._waiting.items()},
+                "position": position, "slack": slack,
+                "min_slack": min_slack,
+                "deadlocked": [i for i in range(num_proc) if not finished[i]]}
+
+    def _incremental(self, baseline: Dict) -> Optional[List[int]]:
+        """Look at the processes changed since the last full run and the
+        ones deadlocked then
+
+        Args:
+            baseline (Dict): What the last full run found
+
+        Returns:
+            Optional[List[int]]: The deadlocked processes, or None if a full
+                                 run is needed
+        """
+        system = self.system
+        changes = system.changes_since(baseline["version"])
+        if changes is None:
+            return None
+
+        touched = set(system._waiting_log)
+        for change in changes["changes"]:
+            if change["op"] == "remove_process":
+                return None
+            if change.get("proc") is not None:
+                touched.add(change["proc"])
+
+        num_proc = system.num_proc
+        num_res = system.num_res
+        old = baseline["num_proc"]
+        new = list(range(old, num_proc))
+        if len(touched) + len(new) > self.full_share * num_proc:
+            return None
+
+        resources = system.resources
+        held = {i: system._held(i)
+                for i in touched.union(baseline["deadlocked"], new)
+                if i < num_proc}
+        requests = system._waiting
+        zero = [0] * num_res
+        gained = [resources[j] - baseline["resources"][j]
+                  for j in range(num_res)]
+
+        # How much each changed process took or gave back, and the total
+        # taken by processes that changed or are new
+        taken = [0] * num_res
+        growth = {}
+        for i in touched:
+            if i >= old:
+                continue
+            growth[i] = [held[i][j] - baseline["allocation"][i][j]
+                         for j in range(num_res)]
+            for j in range(num_res):
+                taken[j] += max(growth[i][j], 0)
+        for i in new:
+            for j in range(num_res):
+                taken[j] += held[i][j]
+
+        min_slack = baseline["min_slack"]
+        if any(min_slack[j] < taken[j] - gained[j] for j in range(num_res)):
+            return None
+
+        position = baseline["position"]
+        for i, grown in growth.items():
+            k = position.get(i)
+            if k is None:
+                # Was deadlocked, so it is looked at again below
+                continue
+            request = requests.get(i, zero)
+            request_then = baseline["requests"].get(i, zero)
+            slack = baseline["slack"][k]
+            for j in range(num_res):
+                # Everything the other processes took, and what this one
+                # took or gave back itself
+                left = (request_then[j] + slack[j] + gained[j] - taken[j] +
+                        max(grown[j], 0) - grown[j])
+                if request[j] > left:
+                    return None
+
+        candidates = baseline["deadlocked"] + new
+        work = [resources[j] - sum(held[i][j] for i in candidates)
+                for j in range(num_res)]
+        order = safe_order(work,
+                           [list(requests.get(i, zero)) for i in candidates],
+                           [held[i] for i in candidates])
+        finished = {candidates[k] for k in order}
+        return [i for i in candidates if i not in finished]
@@ -0,0 +1,115 @@
+import random
+import unittest
+from BankersAlgorithm import BankersAlgorithm as ba
+from NumpyBankersAlgorithm import NumpyBankersAlgorithm
+from SparseBankersAlgorithm import SparseBankersAlgorithm
+
+
+def reference(b):
+    """Deadlocked processes found by rescanning every process from 0 after
+    each one finishes"""
+    state = b.snapshot()
+    waiting = b.waiting
+    work = [state["resources"][j] - sum(row[j] for row in state["allocation"])
+            for j in range(state["num_res"])]
+    finished = [False] * state["num_proc"]
+    progress = True
+    while progress:
+        progress = False
+        for i in range(state["num_proc"]):
+            request = waiting.get(i, [0] * state["num_res"])
+            if not finished[i] and all(r <= w for r, w in zip(request, work)):
+                finished[i] = True
+                work = [w + a for w, a in zip(work, state["allocation"][i])]
+                progress = True
+    return [i for i in range(state["num_proc"]) if not finished[i]]
+
+
+class BankersDeadlocksTestCases(unittest.TestCase):
+    backend = ba
+
+    def setUp(self):
+        """Two processes each hold what the other waits for, a third one
+        is free to finish
+        """
+        self.b = self.backend(3, 2, [2, 1],
+                              [[1, 0], [0, 1], [1, 0]],
+                              [[2, 1], [2, 1], [2, 1]])
+        self.b.wait(0, [0, 1])
+        self.b.wait(1, [1, 0])
+
+    def test_deadlocked_processes(self):
+        """Test that a cycle is found, and broken by a release"""
+        # Process 2 is not waiting, so it gives back its resource_0 and
+        # process 1 can finish, then process 0
+        self.assertEqual(self.b.deadlocks(), [])
+        self.b.wait(2, [0, 1])
+        self.assertEqual(self.b.deadlocks(), [0, 1, 2])
+
+        self.b.release(1, [0, 1])
+        self.assertEqual(self.b.deadlocks(), [])
+        self.b.finish(2)
+        self.assertEqual(self.b.waiting, {0: [0, 1], 1: [1, 0]})
+        with self.assertRaises(ValueError):
+            self.b.wait(2, [1, 0])
+        with self.assertRaises(ValueError):
+            self.b.wait(0, [-1, 0])
+
+    def test_incremental_runs_match_full_runs(self):
+        """Test on random changes that every run finds what a full search
+        finds, and most runs only look at what changed
+        """
+        rng = random.Random(0)
+        num_proc, num_res = 60, 3
+        resources = [40, 40, 40]
+        allocation = [[0] * num_res for _ in range(num_proc)]
+        for j in range(num_res):
+            for _ in range(resources[j] - 2):
+                allocation[rng.randrange(num_proc)][j] += 1
+        b = self.backend(num_proc, num_res, resources, allocation,
+                         [list(resources) for _ in range(num_proc)])
+        for i in range(0, num_proc, 2):
+            b.wait(i, [rng.randint(0, 2) for _ in range(num_res)])
+
+        for step in range(400):
+            running = [i for i in range(b.num_proc) if i not in b.free]
+            i = rng.choice(running)
+            kind = rng.random()
+            if kind < 0.4:
+                b.wait(i, [rng.randint(0, 2) for _ in range(num_res)])
+            elif kind < 0.6:
+                # Grant part of what it waits for, if it is free
+                available = b.calculate_available()
+                j = rng.randrange(num_res)
+                if available[j] > 0:
+                    b.patch([{"op": "set", "matrix": "allocation",
+                              "proc": i, "res": j,
+                              "value": int(b.allocation[i][j]) + 1}])
+            elif kind < 0.8:
+                held = [int(count) for count in b.allocation[i]]
+                b.release(i, [rng.randint(0, count) for count in held])
+            elif kind < 0.9:
+                b.finish(i)
+                b.add_process([1] * num_res)
+            elif kind < 0.95:
+                b.patch([{"op": "set", "matrix": "resources",
+                          "res": rng.randrange(num_res),
+                          "value": rng.randint(38, 44)}])
+            else:
+                b.patch([{"op": "remove_process", "proc": i}])
+            self.assertEqual(b.deadlocks(), reference(b))
+
+        self.assertGreater(b.stats["deadlock_incremental_runs"],
+                           b.stats["deadlock_full_runs"])
+
+
+class NumpyBankersDeadlocksTestCases(BankersDeadlocksTestCases):
+    backend = NumpyBankersAlgorithm
+
+
+class SparseBankersDeadlocksTestCases(BankersDeadlocksTestCases):
+    backend = SparseBankersAlgorithm
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+"""Check many candidate requests against one snapshot of a system.
+
+Every worker process gets the snapshot once, in binary form, when it starts
+and builds its own copy of the system from it. Tasks only carry the
+candidates, so the snapshot is never pickled per task. Batches too small to
+be worth the pool are checked in this process against a clone.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain
+from typing import List
+from typing import Optional
+from typing import Tuple
+import os
+
+from BankersAlgorithm import BankersAlgorithm
+import BankersSnapshot
+
+# Batches with fewer candidates times matrix cells than this are checked
+# without a pool
+PARALLEL_CELLS = 1_000_000
+
+# Chunks of candidates handed to each worker
+CHUNKS_PER_WORKER = 4
+
+# The copy of the system in a worker process
+_system = None
+
+
+def _start_worker(data: bytes, backend):
+    global _system
+    _system = BankersSnapshot.loads(data, backend)
+    # Fill the cached safe sequence so most candidates skip the safety
+    # algorithm
+    _system.safety()
+
+
+def _evaluate_chunk(candidates: List[Tuple[int, List[int]]]) -> List[str]:
+    return [_system.evaluate_request(proc_num, resource_req)
+            for proc_num, resource_req in candidates]
+
+
+def evaluate_requests(system: BankersAlgorithm,
+                      candidates: List[Tuple[int, List[int]]],
+                      processes: Optional[int] = None) -> List[str]:
+    """Find which of many requests could each be granted on their own
+    right now, without changing the system
+
+    Args:
+        system (BankersAlgorithm): The system
+        candidates (List[Tuple[int, List[int]]]): (process number, resource
+                                                  request) pairs
+        processes (Optional[int]): Most worker processes to use, defaults
+                                   to one per core
+
+    Returns:
+        List[str]: grantable, unsafe or invalid for each request
+    """
+    candidates = list(candidates)
+    processes = min(processes or os.cpu_count() or 1, len(candidates))
+    if (processes <= 1 or len(candidates) * system.num_proc *
+            system.num_res < PARALLEL_CELLS):
+        snapshot = system.clone()
+        snapshot.safety()
+        return [snapshot.evaluate_request(proc_num, resource_req)
+                for proc_num, resource_req in candidates]
+
+    data = BankersSnapshot.dumps(system.snapshot())
+    size = -(-len(candidates) // (processes * CHUNKS_PER_WORKER))
+    chunks = [candidates[i:i + size]
+              for i in range(0, len(candidates), size)]
+    with ProcessPoolExecutor(processes, initializer=_start_worker,
+                             initargs=(data, type(system))) as pool:
+        return list(chain.from_iterable(pool.map(_evaluate_chunk, chunks)))
@@ -0,0 +1,261 @@
+"""Low overhead metrics for the Bankers Algorithm service.
+
+Calls to the operations wrapped with timed() are counted in timing
+histograms kept in this process, and render() writes them out in the
+Prometheus text format for /metrics. A timed call costs two perf_counter()
+reads, a bisect and a short lock. Set BANKERS_METRICS=0, or call
+enable(False), to skip even that.
+
+A sampling profiler can be turned on and off at runtime. While it runs, a
+background thread looks at the stack of every other thread every few
+milliseconds and counts the stacks it sees, so hot code shows up in
+proportion to the time spent in it. profile() gives the counts as folded
+``outer;inner count`` lines, which flame graph tools read.
+"""
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+from functools import wraps
+from typing import Callable
+from typing import Dict
+from typing import Iterable
+from typing import Optional
+from typing import Tuple
+import os
+import sys
+import threading
+import time
+
+# Upper bounds of the histogram buckets, in seconds
+BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001,
+           0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+           10.0)
+
+# Content type of render()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Deepest stack the profiler keeps, counted from the outermost frame
+MAX_DEPTH = 64
+
+enabled = os.environ.get("BANKERS_METRICS", "1") != "0"
+
+_lock = threading.Lock()
+
+
+class Histogram:
+    """Count of calls in each timing bucket, with the total time"""
+
+    def __init__(self):
+        # The last bucket is for calls slower than every bound
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.errors = 0
+
+    def observe(self, seconds: float, error: bool = False):
+        bucket = bisect_left(BUCKETS, seconds)
+        with _lock:
+            self.counts[bucket] += 1
+            self.sum += seconds
+            self.errors += error
+
+
+# Histogram of each operation by name
+histograms: Dict[str, Histogram] = {}
+
+
+def enable(on: bool = True):
+    """Turn timing on or off for this process"""
+    global enabled
+    enabled = on
+
+
+def histogram(name: str) -> Histogram:
+    """Find the histogram of an operation, making it if it is new"""
+    with _lock:
+        return histograms.setdefault(name, Histogram())
+
+
+def timed(name: str) -> Callable:
+    """Decorator that times every call of a function as an operation.
+    Calls that raise are timed and also counted as errors"""
+    def decorator(function: Callable) -> Callable:
+        times = histogram(name)
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                result = function(*args, **kwargs)
+            except BaseException:
+                times.observe(time.perf_counter() - start, True)
+                raise
+            times.observe(time.perf_counter() - start)
+            return result
+
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def timer(name: str):
+    """Time a block of code as an operation"""
+    if not enabled:
+        yield
+        return
+    times = histograms.get(name) or histogram(name)
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        times.observe(time.perf_counter() - start, True)
+        raise
+    times.observe(time.perf_counter() - start)
+
+
+def _label(value) -> str:
+    return (str(value).replace("\\", "\\\\").replace('"', '\\"')
+            .replace("\n", "\\n"))
+
+
+def render(systems: Iterable[Tuple[str, object]] = ()) -> str:
+    """Write the metrics in the Prometheus text format
+
+    Args:
+        systems (Iterable[Tuple[str, object]]): (ID, system) pairs whose
+                                                 stats counters and size
+                                                 are added
+
+    Returns:
+        str: The metrics
+    """
+    with _lock:
+        snapshot = [(name, list(h.counts), h.sum, h.errors)
+                    for name, h in sorted(histograms.items())]
+        samples = sum(_samples.values())
+
+    lines = ["# HELP bankers_operation_seconds Time spent in each operation",
+             "# TYPE bankers_operation_seconds histogram"]
+    for name, counts, total, _ in snapshot:
+        cumulative = 0
+        for bound, count in zip(BUCKETS, counts):
+            cumulative += count
+            lines.append("bankers_operation_seconds_bucket{" +
+                         f'operation="{name}",le="{bound}"}} {cumulative}')
+        cumulative += counts[-1]
+        lines.append("bankers_operation_seconds_bucket{" +
+                     f'operation="{name}",le="+Inf"}} {cumulative}')
+        lines.append(f'bankers_operation_seconds_sum{{operation="{name}"}} ' +
+                     f"{total}")
+        lines.append("bankers_operation_seconds_count{" +
+                     f'operation="{name}"}} {cumulative}')
+
+    lines += ["# HELP bankers_operation_errors_total Calls that raised",
+              "# TYPE bankers_operation_errors_total counter"]
+    for name, _, _, errors in snapshot:
+        lines.append(f'bankers_operation_errors_total{{operation="{name}"}} ' +
+                     f"{errors}")
+
+    systems = [(_label(system_id), system) for system_id, system in systems]
+    if systems:
+        lines += ["# HELP bankers_processes Processes in each system",
+                  "# TYPE bankers_processes gauge"]
+        lines += [f'bankers_processes{{system="{system_id}"}} ' +
+                  f"{system.num_proc}" for system_id, system in systems]
+        keys = sorted({key for _, system in systems for key in system.stats})
+        for key in keys:
+            lines += [f"# TYPE bankers_{key}_total counter"]
+            lines += [f'bankers_{key}_total{{system="{system_id}"}} ' +
+                      f"{system.stats[key]}"
+                      for system_id, system in systems
+                      if key in system.stats]
+
+    lines += ["# HELP bankers_profiler_samples_total Stacks sampled by " +
+              "the profiler",
+              "# TYPE bankers_profiler_samples_total counter",
+              f"bankers_profiler_samples_total {samples}"]
+    return "\n".join(lines) + "\n"
+
+
+class SamplingProfiler(threading.Thread):
+    """Thread that counts the stacks of the other threads every interval"""
+
+    def __init__(self, interval: float):
+        super().__init__(name="bankers-profiler", daemon=True)
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        own = threading.get_ident()
+        while not self.stopped.wait(self.interval):
+            for thread, frame in sys._current_frames().items():
+                if thread == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} " +
+                                 f"({os.path.basename(code.co_filename)})")
+                    frame = frame.f_back
+                stack.reverse()
+                stack = ";".join(stack[:MAX_DEPTH])
+                with _lock:
+                    _samples[stack] += 1
+
+
+# Folded stacks counted by the profiler since it was last started
+_samples = Counter()
+_profiler: Optional[SamplingProfiler] = None
+
+
+def start_profiler(interval: float = 0.005) -> bool:
+    """Start sampling stacks, dropping the samples of any earlier run
+
+    Args:
+        interval (float): Seconds between samples
+
+    Returns:
+        bool: False if the profiler was already running
+
+    Raises:
+        ValueError: If the interval is not above 0
+    """
+    global _profiler
+    if interval <= 0:
+        raise ValueError(f"Profiler interval {interval} is not above 0")
+    with _lock:
+        if profiling():
+            return False
+        _samples.clear()
+        _profiler = SamplingProfiler(interval)
+        _profiler.start()
+        return True
+
+
+def stop_profiler() -> bool:
+    """Stop sampling stacks, keeping the samples
+
+    Returns:
+        bool: False if the profiler was not running
+    """
+    global _profiler
+    with _lock:
+        profiler, _profiler = _profiler, None
+    if profiler is None:
+        return False
+    profiler.stopped.set()
+    profiler.join()
+    return True
+
+
+def profiling() -> bool:
+    """Check if the profiler is running"""
+    return _profiler is not None
+
+
+def profile() -> str:
+    """The sampled stacks as folded lines, most common first"""
+    with _lock:
+        samples = _samples.most_common()
+    return "".join(f"{stack} {count}\n" for stack, count in samples)
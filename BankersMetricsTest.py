@@ -0,0 +1,75 @@
+import time
+import unittest
+import BankersMetrics
+from BankersAlgorithm import BankersAlgorithm as ba
+
+
+class BankersMetricsTestCases(unittest.TestCase):
+    def setUp(self):
+        self.b = ba(5, 3, [10, 5, 7],
+                    [[0, 1, 0], [2, 0, 0], [3, 0, 2], [2, 1, 1], [0, 0, 2]],
+                    [[7, 5, 3], [3, 2, 2], [9, 0, 2], [2, 2, 2], [4, 3, 3]])
+        self.b.verbosity = "none"
+
+    def test_operations_are_timed(self):
+        """Test that calls and calls that raise are counted, and that
+        nothing is counted while timing is off
+        """
+        safety = BankersMetrics.histogram("safety")
+        request = BankersMetrics.histogram("request")
+        calls, errors = sum(safety.counts), request.errors
+
+        self.b.safety()
+        self.b.safety()
+        with self.assertRaises(ValueError):
+            self.b.request(9, [0, 0, 0])
+        self.assertEqual(sum(safety.counts), calls + 2)
+        self.assertEqual(request.errors, errors + 1)
+
+        BankersMetrics.enable(False)
+        try:
+            self.b.safety()
+        finally:
+            BankersMetrics.enable()
+        self.assertEqual(sum(safety.counts), calls + 2)
+
+    def test_render(self):
+        """Test that the histograms are cumulative and end in +Inf, and the
+        counters of each system are added
+        """
+        with BankersMetrics.timer("test"):
+            pass
+        text = BankersMetrics.render([("a", self.b)])
+        lines = text.splitlines()
+        buckets = [int(line.rsplit(" ", 1)[1]) for line in lines
+                   if line.startswith('bankers_operation_seconds_bucket'
+                                      '{operation="test"')]
+        self.assertEqual(len(buckets), len(BankersMetrics.BUCKETS) + 1)
+        self.assertEqual(buckets, sorted(buckets))
+        self.assertIn('bankers_operation_seconds_count{operation="test"} ' +
+                      str(buckets[-1]), lines)
+        self.assertIn('bankers_processes{system="a"} 5', lines)
+        self.assertIn('bankers_safety_misses_total{system="a"} 0', lines)
+
+    def test_profiler(self):
+        """Test that the profiler samples this thread while it runs and can
+        only be started once
+        """
+        self.assertTrue(BankersMetrics.start_profiler(0.001))
+        try:
+            self.assertFalse(BankersMetrics.start_profiler(0.001))
+            self.assertTrue(BankersMetrics.profiling())
+            end = time.perf_counter() + 0.1
+            while time.perf_counter() < end:
+                self.b.safety()
+        finally:
+            self.assertTrue(BankersMetrics.stop_profiler())
+        self.assertFalse(BankersMetrics.stop_profiler())
+        self.assertIn("test_profiler (BankersMetricsTest.py)",
+                      BankersMetrics.profile())
+        with self.assertRaises(ValueError):
+            BankersMetrics.start_profiler(0)
+
+
+if __name__ == "__main__":
+    unittest.main()
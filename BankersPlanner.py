@@ -0,0 +1,114 @@
+"""Plan which of a queue of pending requests to grant together.
+
+request() grants or refuses one request against the current state, so
+granting a queue first come first served can refuse small requests that
+would have fitted around a big one. plan_grants() picks a maximal set of
+requests that can all be granted together while the system stays safe,
+trying the most valuable requests first.
+
+Granting a request never makes a refused request safe again. The grant
+takes resources from the pool that a refused request could have used,
+and only takes away need that the refused request never had. So one pass
+over the requests is enough: a request refused once is never tried again,
+and no request left out of the plan could be added to it afterwards.
+Requests that only give resources back always fit and are planned first.
+Requests that both take and give back resources are tried like the rest,
+but then the plan is not guaranteed to be maximal.
+
+Each request is tried on a copy of the system with request(), which checks
+it against the cached safe sequence of the requests granted before it, so
+most requests cost O(num_res) rather than a safety check. Requests that
+take at least as much as a request of the same process that was refused as
+unsafe are refused without being tried.
+"""
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from BankersAlgorithm import BankersAlgorithm
+from BankersAlgorithm import GRANTABLE
+from BankersAlgorithm import INVALID
+from BankersAlgorithm import QUIET
+from BankersAlgorithm import UNSAFE
+
+
+def plan_grants(system: BankersAlgorithm,
+                requests: List[Tuple[int, List[int]]],
+                weights: Optional[List[float]] = None) -> Dict:
+    """Find a maximal set of requests that can be granted together, without
+    changing the system
+
+    Args:
+        system (BankersAlgorithm): The system
+        requests (List[Tuple[int, List[int]]]): (process number, resource
+                                                request) pairs
+        weights (Optional[List[float]]): Priority of each request, higher
+                                         weights are tried first. Defaults
+                                         to trying the requests that take
+                                         the smallest share of the
+                                         resources first, to grant as many
+                                         as possible
+
+    Returns:
+        Dict: Indexes into requests that are granted in the order to grant
+              them, refused as unsafe and refused as invalid, an order for
+              request_batch() that admits them like this, the total weight
+              granted and the safe sequence once they are granted
+
+    Raises:
+        ValueError: If there is not one weight per request
+    """
+    if weights is not None and len(weights) != len(requests):
+        raise ValueError(f"{len(weights)} weights given for " +
+                         f"{len(requests)} requests")
+
+    plan = system.clone()
+    resources = [max(count, 1) for count in plan.resources]
+
+    def key(i: int) -> Tuple:
+        resource_req = requests[i][1]
+        # Requests that only give resources back first
+        gives_back = all(count <= 0 for count in resource_req)
+        share = sum(max(count, 0) / resources[j]
+                    for j, count in enumerate(resource_req[:len(resources)]))
+        return (not gives_back, -weights[i] if weights is not None else 0,
+                share, i)
+
+    granted = []
+    unsafe = []
+    invalid = []
+    # Requests of each process refused as unsafe
+    refused = {}
+    for i in sorted(range(len(requests)), key=key):
+        proc_num, resource_req = requests[i]
+        try:
+            if (len(resource_req) == plan.num_res and
+                    any(all(a >= b for a, b in zip(resource_req, smaller))
+                        for smaller in refused.get(proc_num, ()))):
+                # The process and the length were checked by the request
+                # that was refused
+                verdict = UNSAFE
+            elif plan.request(proc_num, resource_req, QUIET)[0]:
+                verdict = GRANTABLE
+            else:
+                verdict = UNSAFE
+            if verdict == UNSAFE and not plan.fits(proc_num, resource_req):
+                verdict = INVALID
+        except ValueError:
+            verdict = INVALID
+
+        if verdict == GRANTABLE:
+            granted.append(i)
+        elif verdict == UNSAFE:
+            unsafe.append(i)
+            refused.setdefault(proc_num, []).append(resource_req)
+        else:
+            invalid.append(i)
+
+    return {"granted": granted, "unsafe": sorted(unsafe),
+            "invalid": sorted(invalid),
+            "order": granted + sorted(unsafe + invalid),
+            "weight": (sum(weights[i] for i in granted)
+                       if weights is not None else len(granted)),
+            "safe_seq": plan.safety(QUIET)[1]}
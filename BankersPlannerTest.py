@@ -0,0 +1,85 @@
+import random
+import unittest
+from BankersAlgorithm import BankersAlgorithm as ba
+from BankersPlanner import plan_grants
+
+
+def system():
+    return ba(5, 3, [10, 5, 7],
+              [[0, 1, 0], [2, 0, 0], [3, 0, 2], [2, 1, 1], [0, 0, 2]],
+              [[7, 5, 3], [3, 2, 2], [9, 0, 2], [2, 2, 2], [4, 3, 3]])
+
+
+requests = [(0, [3, 2, 0]), (1, [1, 0, 2]), (3, [0, 1, 0]), (4, [2, 0, 0]),
+            (0, [0, 1, 0]), (2, [0, 0, 1])]
+
+
+class BankersPlannerTestCases(unittest.TestCase):
+    def setUp(self):
+        self.b = system()
+        self.b.verbosity = "none"
+
+    def test_plan_grants_more_than_first_come_first_served(self):
+        """Test that the plan grants more requests than granting them in
+        the order they came, and request_batch() follows it
+        """
+        first_come = [r[0] for r in system().request_batch(requests)]
+        self.assertEqual(first_come.count(True), 2)
+
+        plan = plan_grants(self.b, requests)
+        self.assertEqual(plan["granted"], [2, 3, 4])
+        self.assertEqual(plan["unsafe"], [1])
+        self.assertEqual(plan["invalid"], [0, 5])
+        self.assertEqual(plan["weight"], 3)
+        # Planning leaves the system alone
+        self.assertEqual(self.b.allocation[3], [2, 1, 1])
+
+        results = self.b.request_batch(requests, "plan")
+        self.assertEqual([i for i, r in enumerate(results) if r[0]],
+                         [2, 3, 4])
+        self.assertEqual(self.b.safety()[1], plan["safe_seq"])
+
+    def test_weights_come_first(self):
+        """Test that a heavy request is granted even when it leaves less
+        room for the rest
+        """
+        plan = plan_grants(self.b, requests, [10, 1, 1, 1, 1, 1])
+        self.assertEqual(plan["granted"], [0, 2])
+        self.assertEqual(plan["weight"], 11)
+        self.assertEqual(plan["order"][:2], [0, 2])
+        with self.assertRaises(ValueError):
+            plan_grants(self.b, requests, [1])
+
+    def test_plans_are_safe_and_maximal(self):
+        """Test on random systems that every planned request is granted in
+        the plan order, and no request left out could be granted after
+        them
+        """
+        rng = random.Random(0)
+        for _ in range(100):
+            num_proc = rng.randint(1, 6)
+            num_res = rng.randint(1, 3)
+            allocation = [[rng.randint(0, 3) for _ in range(num_res)]
+                          for _ in range(num_proc)]
+            maximum = [[a + rng.randint(0, 4) for a in row]
+                       for row in allocation]
+            resources = [sum(col) + rng.randint(0, 4)
+                         for col in zip(*allocation)]
+            b = ba(num_proc, num_res, resources, allocation, maximum)
+            b.verbosity = "none"
+            if not b.safety()[0]:
+                continue
+            pending = [(rng.randrange(num_proc),
+                        [rng.randint(0, 2) for _ in range(num_res)])
+                       for _ in range(rng.randint(0, 8))]
+
+            plan = plan_grants(b, pending)
+            for i in plan["granted"]:
+                self.assertTrue(b.request(*pending[i])[0])
+            self.assertTrue(b.safety()[0])
+            for i in plan["unsafe"] + plan["invalid"]:
+                self.assertFalse(b.clone().request(*pending[i])[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,162 @@
+from collections import OrderedDict
+from typing import Callable
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Tuple
+
+from BankersAlgorithm import BankersAlgorithm
+from BankersStateStore import SharedSystem
+
+
+class BankersRegistry:
+    def __init__(self, factory: Callable[[Dict], BankersAlgorithm],
+                 max_systems: int = 1000, max_cells: int = 50_000_000,
+                 pinned: Iterable[str] = (), store=None):
+        """Keep many independent Bankers Algorithm systems keyed by an ID.
+        When there are too many systems, or they hold too many matrix
+        cells between them, the least recently used ones are dropped
+
+        Args:
+            factory (Callable[[Dict], BankersAlgorithm]): Builds a system
+                                                          from a config
+            max_systems (int): Most systems to keep at once
+            max_cells (int): Most allocation and maximum cells to keep
+                             across all of the systems
+            pinned (Iterable[str]): IDs that are never evicted
+            store: Optional state store shared with other processes, see
+                   BankersStateStore. Evicting a system then only drops
+                   the local copy
+        """
+        self.factory = factory
+        self.store = store
+        self.max_systems = max_systems
+        self.max_cells = max_cells
+        self.pinned = set(pinned)
+
+        # Least recently used system first, as (system, cells) pairs
+        self._systems = OrderedDict()
+        self.cells = 0
+
+    @staticmethod
+    def _cells(system: BankersAlgorithm) -> int:
+        return system.stored_cells()
+
+    def create(self, system_id: str, config: Dict) -> BankersAlgorithm:
+        """Build a system from a config and store it, replacing any system
+        already stored under the same ID
+
+        Args:
+            system_id (str): ID to store the system under
+            config (Dict): Config handed to the factory
+
+        Returns:
+            BankersAlgorithm: The new system
+
+        Raises:
+            ValueError: If the config is invalid or the system alone is
+                        bigger than the cell limit
+        """
+        return self.add(system_id, self.factory(config),
+                        config.get("backend", "auto"))
+
+    def add(self, system_id: str, system: BankersAlgorithm,
+            backend: str = "list") -> BankersAlgorithm:
+        """Store a system that is already built, replacing any system
+        already stored under the same ID
+
+        Args:
+            system_id (str): ID to store the system under
+            system (BankersAlgorithm): The system
+            backend (str): Backend the factory rebuilds the system with in
+                           other processes, when there is a store
+
+        Returns:
+            BankersAlgorithm: The stored system
+
+        Raises:
+            ValueError: If the system alone is bigger than the cell limit
+        """
+        cells = self._cells(system)
+        if cells > self.max_cells:
+            raise ValueError(f"System needs {cells} cells, more than the " +
+                             f"limit of {self.max_cells}")
+
+        self._drop(system_id)
+        if self.store is not None:
+            with self.store.locked(system_id):
+                self.store.put(system_id, dict(system.snapshot(),
+                                               backend=backend))
+            system = SharedSystem(self.store, system_id, self.factory)
+        self._add(system_id, system, cells)
+        return system
+
+    def _add(self, system_id: str, system: BankersAlgorithm, cells: int):
+        self._systems[system_id] = (system, cells)
+        self.cells += cells
+        self._evict(keep=system_id)
+
+    def get(self, system_id: str) -> BankersAlgorithm:
+        """Look up a system and mark it as recently used
+
+        Args:
+            system_id (str): ID of the system
+
+        Returns:
+            BankersAlgorithm: The system
+
+        Raises:
+            KeyError: If there is no system with that ID
+        """
+        if (system_id not in self._systems and self.store is not None and
+                self.store.version(system_id) is not None):
+            # Another process made this system
+            system = SharedSystem(self.store, system_id, self.factory)
+            self._add(system_id, system, self._cells(system))
+        system, _ = self._systems[system_id]
+        self._systems.move_to_end(system_id)
+        return system
+
+    def delete(self, system_id: str) -> bool:
+        """Drop a system
+
+        Args:
+            system_id (str): ID of the system
+
+        Returns:
+            bool: If there was a system to drop
+        """
+        stored = self.store is not None and self.store.delete(system_id)
+        return self._drop(system_id) or stored
+
+    def _drop(self, system_id: str) -> bool:
+        """Drop the local copy of a system"""
+        system = self._systems.pop(system_id, None)
+        if system is None:
+            return False
+        self.cells -= system[1]
+        return True
+
+    def _evict(self, keep: str):
+        """Drop least recently used systems until the limits are met,
+        never dropping a pinned system or the one being kept
+        """
+        for system_id in list(self._systems):
+            if (len(self._systems) <= self.max_systems and
+                    self.cells <= self.max_cells):
+                break
+            if system_id != keep and system_id not in self.pinned:
+                self._drop(system_id)
+
+    def items(self) -> List[Tuple[str, BankersAlgorithm]]:
+        """The systems kept in this process, as (ID, system) pairs"""
+        return [(system_id, system)
+                for system_id, (system, _) in list(self._systems.items())]
+
+    def __contains__(self, system_id: str) -> bool:
+        if self.store is not None:
+            return self.store.version(system_id) is not None
+        return system_id in self._systems
+
+    def __len__(self) -> int:
+        return len(self._systems)
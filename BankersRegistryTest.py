@@ -0,0 +1,73 @@
+import unittest
+from BankersAlgorithm import BankersAlgorithm as ba
+from BankersRegistry import BankersRegistry
+from SparseBankersAlgorithm import SparseBankersAlgorithm
+
+
+def factory(config):
+    return ba(config["num_proc"], config["num_res"], config["resources"],
+              config["allocation"], config["max"])
+
+
+def config(num_proc):
+    return {"num_proc": num_proc, "num_res": 1, "resources": [num_proc],
+            "allocation": [[0]] * num_proc, "max": [[1]] * num_proc}
+
+
+class BankersRegistryTestCases(unittest.TestCase):
+    def test_systems_are_kept_apart(self):
+        """Test that each ID gets its own system and deleted systems are
+        gone
+        """
+        registry = BankersRegistry(factory)
+        registry.create("a", config(2))
+        registry.create("b", config(3))
+        self.assertEqual(registry.get("a").num_proc, 2)
+        self.assertEqual(registry.get("b").num_proc, 3)
+
+        self.assertTrue(registry.delete("a"))
+        self.assertFalse(registry.delete("a"))
+        with self.assertRaises(KeyError):
+            registry.get("a")
+
+    def test_least_recently_used_system_is_evicted(self):
+        """Test that going over the system limit drops the system that was
+        used longest ago, but never a pinned one
+        """
+        registry = BankersRegistry(factory, max_systems=2, pinned=["p"])
+        registry.create("p", config(1))
+        registry.create("a", config(1))
+        registry.create("b", config(1))
+        self.assertIn("p", registry)
+        self.assertNotIn("a", registry)
+        self.assertIn("b", registry)
+
+    def test_cell_limit(self):
+        """Test that the cell limit evicts old systems and refuses systems
+        that could never fit
+        """
+        registry = BankersRegistry(factory, max_cells=10)
+        registry.create("a", config(4))
+        registry.create("b", config(4))
+        self.assertNotIn("a", registry)
+        self.assertEqual(registry.cells, 9)
+
+        with self.assertRaises(ValueError):
+            registry.create("c", config(5))
+
+    def test_sparse_systems_count_their_nonzero_cells(self):
+        """Test that a sparse system is weighed by the cells it keeps, so
+        one with far more cells than the limit when dense still fits
+        """
+        num_proc, num_res = 25_000, 1000
+        b = SparseBankersAlgorithm(
+            num_proc, num_res, [num_proc] * num_res,
+            [{} for _ in range(num_proc)],
+            [{i % num_res: 1} for i in range(num_proc)], trusted=True)
+        registry = BankersRegistry(factory, max_cells=50_000_000)
+        registry.add("sparse", b)
+        self.assertEqual(registry.cells, num_res + 3 * num_proc)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,232 @@
+"""Replay traces of resource requests through a Bankers Algorithm system.
+
+Traces are read lazily one event at a time, so a trace of any length is
+replayed in memory bounded by the size of the system. An event is a process
+number and a resource request, negative counts give resources back. Traces
+can be
+
+* CSV, one ``proc_id,r0,r1,...`` line per event, with an optional header
+* JSON lines, one ``{"proc_id": i, "resource_req": [...]}`` per line
+* binary, a header of a magic number and num_res, then one run of
+  ``1 + num_res`` little endian int64 cells per event
+
+For example ``python BankersReplay.py trace.csv --snapshot system.bank``
+"""
+from typing import Callable
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+import argparse
+import array
+import csv
+import json
+import struct
+import sys
+import time
+
+from BankersAlgorithm import BankersAlgorithm
+from BankersAlgorithm import QUIET
+
+# Magic, num_res
+BINARY_HEADER = struct.Struct("<4s4xq")
+BINARY_MAGIC = b"BTRC"
+
+# Events read from a binary trace at a time
+CHUNK_EVENTS = 4096
+
+Event = Tuple[int, List[int]]
+
+
+def read_csv(path: str) -> Iterator[Event]:
+    """Read events from a CSV trace"""
+    with open(path, newline="") as f:
+        for row in csv.reader(f):
+            if not row or not row[0].strip().lstrip("-").isdigit():
+                # Blank lines and the header
+                continue
+            yield int(row[0]), [int(cell) for cell in row[1:]]
+
+
+def read_jsonl(path: str) -> Iterator[Event]:
+    """Read events from a JSON lines trace"""
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                event = json.loads(line)
+                yield int(event["proc_id"]), event["resource_req"]
+
+
+def read_binary(path: str) -> Iterator[Event]:
+    """Read events from a binary trace, a chunk of events at a time
+
+    Raises:
+        ValueError: If the file is not a binary trace
+    """
+    with open(path, "rb") as f:
+        header = f.read(BINARY_HEADER.size)
+        if len(header) < BINARY_HEADER.size:
+            raise ValueError("Trace is too short for its header")
+        magic, num_res = BINARY_HEADER.unpack(header)
+        if magic != BINARY_MAGIC:
+            raise ValueError(f"Trace starts with {magic}, " +
+                             f"not {BINARY_MAGIC}")
+
+        cells = 1 + num_res
+        while True:
+            chunk = array.array("q")
+            data = f.read(8 * cells * CHUNK_EVENTS)
+            if len(data) % (8 * cells):
+                raise ValueError("Trace ends part way through an event")
+            chunk.frombytes(data)
+            if sys.byteorder == "big":
+                chunk.byteswap()
+            for i in range(0, len(chunk), cells):
+                yield chunk[i], chunk[i + 1:i + cells].tolist()
+            if len(data) < 8 * cells * CHUNK_EVENTS:
+                return
+
+
+def write_binary(path: str, num_res: int, events: Iterable[Event]):
+    """Write events to a binary trace, for example to convert a CSV trace
+    into one that is faster to read"""
+    with open(path, "wb") as f:
+        f.write(BINARY_HEADER.pack(BINARY_MAGIC, num_res))
+        for proc_num, resource_req in events:
+            cells = array.array("q", [proc_num, *resource_req])
+            if sys.byteorder == "big":
+                cells.byteswap()
+            f.write(cells.tobytes())
+
+
+def read_trace(path: str) -> Iterator[Event]:
+    """Read events from a trace, picking the reader from the extension:
+    .csv, .jsonl or anything else for binary"""
+    if path.endswith(".csv"):
+        return read_csv(path)
+    if path.endswith(".jsonl"):
+        return read_jsonl(path)
+    return read_binary(path)
+
+
+def replay(system: BankersAlgorithm, events: Iterable[Event],
+           progress: Optional[Callable[[Dict], None]] = None,
+           every: int = 100_000) -> Dict:
+    """Make every request of a trace in order
+
+    Args:
+        system (BankersAlgorithm): System to make the requests on, it is
+                                   changed by every granted request
+        events (Iterable[Event]): (process number, resource request) pairs
+        progress (Optional[Callable[[Dict], None]]): Called with the stats
+                                                    so far every few events
+        every (int): Events between calls to progress
+
+    Returns:
+        Dict: Number of events, how many were granted, refused as unsafe
+              or invalid, the grant rate and events per second, and for
+              each process how many requests it made, how many were
+              granted and how many refused requests it waited through
+              before a grant, on average and at most
+    """
+    stats = {"events": 0, "granted": 0, "unsafe": 0, "invalid": 0}
+
+    # Per process [requests, granted, refused since the last grant,
+    # total wait, longest wait]
+    processes = {}
+    start = time.perf_counter()
+
+    def summary() -> Dict:
+        elapsed = time.perf_counter() - start
+        return dict(stats,
+                    grant_rate=stats["granted"] / max(stats["events"], 1),
+                    seconds=elapsed,
+                    events_per_second=stats["events"] / max(elapsed, 1e-9))
+
+    for proc_num, resource_req in events:
+        stats["events"] += 1
+        process = processes.get(proc_num)
+        if process is None:
+            process = processes[proc_num] = [0, 0, 0, 0, 0]
+        process[0] += 1
+
+        try:
+            granted = system.request(proc_num, resource_req, QUIET)[0]
+        except ValueError:
+            stats["invalid"] += 1
+            granted = None
+
+        if granted:
+            stats["granted"] += 1
+            process[1] += 1
+            process[3] += process[2]
+            process[4] = max(process[4], process[2])
+            process[2] = 0
+        elif granted is not None:
+            if system.fits(proc_num, resource_req):
+                stats["unsafe"] += 1
+            else:
+                stats["invalid"] += 1
+            process[2] += 1
+
+        if progress is not None and stats["events"] % every == 0:
+            progress(summary())
+
+    result = summary()
+    result["processes"] = {
+        proc_num: {"requests": requests, "granted": granted,
+                   "waiting": waiting,
+                   "mean_wait": total_wait / max(granted, 1),
+                   "max_wait": max_wait}
+        for proc_num, (requests, granted, waiting, total_wait, max_wait)
+        in sorted(processes.items())}
+    return result
+
+
+def print_progress(stats: Dict):
+    print(f"{stats['events']} events, {stats['events_per_second']:.0f}/s, " +
+          f"{stats['grant_rate']:.1%} granted", file=sys.stderr)
+
+
+def main(args: List[str] = None):
+    parser = argparse.ArgumentParser(
+        description="Replay a trace of requests through a system")
+    parser.add_argument("trace", help=".csv, .jsonl or binary trace")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--snapshot", help="Binary snapshot of the system")
+    source.add_argument("--config", help="JSON config of the system, as " +
+                        "posted to /systems/<id>")
+    parser.add_argument("--backend", choices=["list", "numpy"],
+                        default="list")
+    parser.add_argument("--every", type=int, default=100_000,
+                        help="Events between progress reports")
+    parser.add_argument("--output", help="JSON file for the stats")
+    args = parser.parse_args(args)
+
+    backend = BankersAlgorithm
+    if args.backend == "numpy":
+        from NumpyBankersAlgorithm import NumpyBankersAlgorithm
+        backend = NumpyBankersAlgorithm
+
+    if args.snapshot:
+        system = backend.load(args.snapshot)
+    else:
+        with open(args.config) as f:
+            config = json.load(f)["config"]
+        system = backend(config["num_proc"], config["num_res"],
+                         config["resources"], config["allocation"],
+                         config["max"])
+
+    stats = replay(system, read_trace(args.trace), print_progress,
+                   args.every)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(stats, f, indent=1)
+    else:
+        json.dump(stats, sys.stdout, indent=1)
+
+
+if __name__ == "__main__":
+    main()
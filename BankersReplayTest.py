@@ -0,0 +1,81 @@
+import json
+import os
+import random
+import tempfile
+import unittest
+from BankersAlgorithm import BankersAlgorithm as ba
+import BankersReplay
+
+
+def system():
+    return ba(5, 3, [10, 5, 7],
+              [[0, 1, 0], [2, 0, 0], [3, 0, 2], [2, 1, 1], [0, 0, 2]],
+              [[7, 5, 3], [3, 2, 2], [9, 0, 2], [2, 2, 2], [4, 3, 3]])
+
+
+class BankersReplayTestCases(unittest.TestCase):
+    def setUp(self):
+        """Set up a random trace written in every format"""
+        rng = random.Random(0)
+        self.events = [(rng.randrange(6), [rng.randint(-1, 2)
+                                           for _ in range(3)])
+                       for _ in range(500)]
+        self.directory = tempfile.TemporaryDirectory()
+        self.paths = {name: os.path.join(self.directory.name, name)
+                      for name in ("trace.csv", "trace.jsonl", "trace.bin")}
+
+        with open(self.paths["trace.csv"], "w") as f:
+            f.write("proc_id,r0,r1,r2\n")
+            for proc_num, resource_req in self.events:
+                f.write(",".join(map(str, [proc_num, *resource_req])) + "\n")
+        with open(self.paths["trace.jsonl"], "w") as f:
+            for proc_num, resource_req in self.events:
+                f.write(json.dumps({"proc_id": proc_num,
+                                    "resource_req": resource_req}) + "\n")
+        BankersReplay.write_binary(self.paths["trace.bin"], 3, self.events)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_every_format_reads_the_same_events(self):
+        for path in self.paths.values():
+            self.assertEqual(list(BankersReplay.read_trace(path)),
+                             self.events)
+
+    def test_replay_matches_making_the_requests(self):
+        """Test that a replay leaves the system as making the requests one
+        by one does, and that its counts add up
+        """
+        expected = system()
+        granted = 0
+        for proc_num, resource_req in self.events:
+            try:
+                granted += expected.request(proc_num, resource_req)[0]
+            except ValueError:
+                pass
+
+        reports = []
+        b = system()
+        stats = BankersReplay.replay(
+            b, BankersReplay.read_trace(self.paths["trace.bin"]),
+            reports.append, every=100)
+        self.assertEqual(b.allocation, expected.allocation)
+        self.assertEqual(stats["granted"], granted)
+        self.assertEqual(stats["events"], len(self.events))
+        self.assertEqual(stats["granted"] + stats["unsafe"] +
+                         stats["invalid"], stats["events"])
+        self.assertGreater(stats["unsafe"], 0)
+        self.assertEqual(len(reports), 5)
+        self.assertEqual(sum(process["requests"] for process
+                             in stats["processes"].values()),
+                         len(self.events))
+
+    def test_truncated_binary_trace(self):
+        with open(self.paths["trace.bin"], "ab") as f:
+            f.write(b"\0" * 8)
+        with self.assertRaises(ValueError):
+            list(BankersReplay.read_binary(self.paths["trace.bin"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
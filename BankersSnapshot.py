@@ -0,0 +1,142 @@
+"""Compact binary snapshots of a Bankers Algorithm system.
+
+A snapshot is a fixed size header followed by int64 cells, all little
+endian. The header holds a magic number, the version, num_proc and num_res.
+The cells are the resources, then the allocation and maximum row by row,
+then the slots of finished processes. MmapStateStore keeps its files in the
+same format.
+"""
+from itertools import chain
+from typing import Dict
+from typing import Tuple
+import array
+import mmap
+import os
+import struct
+import sys
+
+from BankersAlgorithm import BankersAlgorithm
+
+# Magic, version, num_proc, num_res
+HEADER = struct.Struct("<4s4xqqq")
+MAGIC = b"BANK"
+CELL = struct.Struct("<q")
+
+
+def dumps(state: Dict) -> bytes:
+    """Write a state as a snapshot
+
+    Args:
+        state (Dict): State from BankersAlgorithm.snapshot()
+
+    Returns:
+        bytes: The snapshot
+    """
+    cells = array.array("q", chain(state["resources"],
+                                   chain.from_iterable(state["allocation"]),
+                                   chain.from_iterable(state["max"]),
+                                   state.get("free", [])))
+    if sys.byteorder == "big":
+        cells.byteswap()
+    return HEADER.pack(MAGIC, state.get("version", 0), state["num_proc"],
+                       state["num_res"]) + cells.tobytes()
+
+
+def parse(data) -> Tuple[int, int, int, memoryview]:
+    """Read the header of a snapshot
+
+    Args:
+        data: Snapshot as bytes, an mmap or any other buffer
+
+    Returns:
+        Tuple[int, int, int, memoryview]: The version, num_proc, num_res and
+                                          the cells, without copying them
+
+    Raises:
+        ValueError: If the data is not a snapshot
+    """
+    if len(data) < HEADER.size:
+        raise ValueError("Snapshot is too short for its header")
+    magic, version, num_proc, num_res = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError(f"Snapshot starts with {magic}, not {MAGIC}")
+    if sys.byteorder == "big":
+        raise ValueError("Snapshots can only be read on little endian hosts")
+
+    cells = memoryview(data)[HEADER.size:]
+    if cells.nbytes % CELL.size or (
+            cells.nbytes // CELL.size < num_res * (2 * num_proc + 1)):
+        raise ValueError(f"Snapshot of {num_proc} processes and {num_res} " +
+                         "resources is cut short")
+    return version, num_proc, num_res, cells.cast("B").cast("q")
+
+
+def state(data) -> Dict:
+    """Read a snapshot back as a state, like BankersAlgorithm.snapshot()"""
+    version, num_proc, num_res, cells = parse(data)
+    size = num_proc * num_res
+    allocation = cells[num_res:num_res + size].tolist()
+    maximum = cells[num_res + size:num_res + 2 * size].tolist()
+    return {"num_proc": num_proc, "num_res": num_res,
+            "resources": cells[:num_res].tolist(),
+            "allocation": [allocation[i:i + num_res]
+                           for i in range(0, size, num_res)],
+            "max": [maximum[i:i + num_res]
+                    for i in range(0, size, num_res)],
+            "free": cells[num_res + 2 * size:].tolist(),
+            "version": version}
+
+
+def loads(data, backend=BankersAlgorithm) -> BankersAlgorithm:
+    """Build a system from a snapshot. Only the size of the snapshot, its
+    free slots and that no allocation cell is below 0 are checked, not
+    every cell
+
+    Args:
+        data: Snapshot as bytes, an mmap or any other buffer
+        backend: BankersAlgorithm class to build
+
+    Returns:
+        BankersAlgorithm: The system
+
+    Raises:
+        ValueError: If the data is not a snapshot, or not the snapshot of a
+                    system the constructor would build
+    """
+    _, num_proc, num_res, cells = parse(data)
+    size = num_proc * num_res
+    b = backend.from_buffers(num_proc, num_res, cells[:num_res],
+                             cells[num_res:num_res + size],
+                             cells[num_res + size:num_res + 2 * size],
+                             copy=False)
+    b._restore_free(cells[num_res + 2 * size:].tolist())
+    return b
+
+
+def save(system: BankersAlgorithm, path: str):
+    """Save a system to a snapshot file. The file is written next to the
+    old one and swapped in, so nobody ever reads a half written snapshot"""
+    with open(path + ".tmp", "wb") as f:
+        f.write(dumps(system.snapshot()))
+    os.replace(path + ".tmp", path)
+
+
+def load(path: str, backend=BankersAlgorithm) -> BankersAlgorithm:
+    """Open a snapshot file with mmap. The numpy backend uses the mapped
+    pages as its arrays, so a snapshot of any size opens in constant time
+    and processes that open the same file share its pages until they
+    change them. Changes are never written back to the file
+
+    Args:
+        path (str): Path of the snapshot
+        backend: BankersAlgorithm class to build
+
+    Returns:
+        BankersAlgorithm: The system
+
+    Raises:
+        ValueError: If the file is not a snapshot
+    """
+    with open(path, "rb") as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    return loads(data, backend)
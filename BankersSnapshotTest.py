@@ -0,0 +1,106 @@
+import array
+import os
+import tempfile
+import unittest
+from BankersAlgorithm import BankersAlgorithm as ba
+from NumpyBankersAlgorithm import NumpyBankersAlgorithm, np
+from SparseBankersAlgorithm import SparseBankersAlgorithm
+import BankersSnapshot
+
+
+class BankersSnapshotTestCases(unittest.TestCase):
+    backend = ba
+
+    def setUp(self):
+        """Set up a system with a finished process, and a directory for
+        the snapshot files
+        """
+        self.b = self.backend(5, 3, [10, 5, 7],
+                              [[0, 1, 0],
+                               [2, 0, 0],
+                               [3, 0, 2],
+                               [2, 1, 1],
+                               [0, 0, 2]],
+                              [[7, 5, 3],
+                               [3, 2, 2],
+                               [9, 0, 2],
+                               [2, 2, 2],
+                               [4, 3, 3]])
+        self.b.finish(2)
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "system.bank")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_save_and_load(self):
+        """Test that a loaded snapshot has the same state, and that changes
+        to it are never written back to the file
+        """
+        self.b.save(self.path)
+        b = self.backend.load(self.path)
+        self.assertEqual(b.allocation, self.b.allocation)
+        self.assertEqual(b.maximum, self.b.maximum)
+        self.assertEqual(b.resources, self.b.resources)
+        self.assertEqual(b.free, [2])
+        self.assertEqual(b.safety()[:2], self.b.safety()[:2])
+
+        self.assertTrue(b.request(1, [1, 0, 2])[0])
+        self.assertEqual(self.backend.load(self.path).allocation[1],
+                         [2, 0, 0])
+
+    def test_bad_snapshots_are_refused(self):
+        """Test that data that is not a whole snapshot is refused"""
+        data = BankersSnapshot.dumps(self.b.snapshot())
+        self.assertEqual(BankersSnapshot.state(data)["allocation"],
+                         self.b.allocation)
+        for bad in (b"", b"JUNK" + data[4:], data[:-64]):
+            with self.assertRaises(ValueError):
+                BankersSnapshot.loads(bad, self.backend)
+
+    def test_bad_free_slots_are_refused(self):
+        """Test that a snapshot whose free slots are out of range, given
+        twice or still hold or claim resources is refused
+        """
+        state = self.b.snapshot()
+        for free in ([7], [-1], [2, 2], [1], [2, 4]):
+            with self.assertRaises(ValueError):
+                BankersSnapshot.loads(BankersSnapshot.dumps(
+                    dict(state, free=free)), self.backend)
+        b = BankersSnapshot.loads(BankersSnapshot.dumps(state), self.backend)
+        self.assertEqual(b.free, [2])
+
+    def test_negative_allocation_is_refused(self):
+        """Test that a snapshot the constructor would refuse, with a process
+        holding less than nothing, is refused too
+        """
+        data = BankersSnapshot.dumps(
+            {"num_proc": 2, "num_res": 1, "resources": [1],
+             "allocation": [[-1], [1]], "max": [[0], [2]], "free": []})
+        with self.assertRaises(ValueError):
+            BankersSnapshot.loads(data, self.backend)
+        with self.assertRaises(ValueError):
+            self.backend.from_buffers(2, 1, array.array("q", [1]),
+                                      array.array("q", [0, -1]),
+                                      array.array("q", [0, 2]))
+
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class NumpyBankersSnapshotTestCases(BankersSnapshotTestCases):
+    backend = NumpyBankersAlgorithm
+
+    def test_load_maps_the_file(self):
+        """Test that the numpy backend uses the mapped file as its arrays
+        instead of copying it
+        """
+        self.b.save(self.path)
+        b = self.backend.load(self.path)
+        self.assertFalse(b.allocation_array.flags.owndata)
+
+
+class SparseBankersSnapshotTestCases(BankersSnapshotTestCases):
+    backend = SparseBankersAlgorithm
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,514 @@
+from contextlib import contextmanager
+from typing import Callable
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+import fcntl
+import json
+import mmap
+import os
+import sqlite3
+import struct
+import threading
+
+from BankersAlgorithm import BankersAlgorithm
+from BankersAlgorithm import first_version
+import BankersSnapshot
+
+
+def new_version(version: Optional[int]) -> int:
+    """Version for a whole new system. Versions start from the clock so a
+    system that was deleted and made again never reuses a version another
+    process may still have cached, see first_version()"""
+    return max((version or 0) + 1, first_version())
+
+
+class SQLiteStateStore:
+    def __init__(self, path: str):
+        """Keep the state of every system in a SQLite database so that
+        several processes can share it. Each allocation row is stored on
+        its own so a granted request only rewrites one row
+
+        Args:
+            path (str): Path of the database file
+        """
+        self.path = path
+        self._local = threading.local()
+        with self.locked():
+            # base is the version the whole system was last stored at,
+            # and each row keeps the version it was last changed at
+            self._db.execute("CREATE TABLE IF NOT EXISTS systems (" +
+                             "id TEXT PRIMARY KEY, version INTEGER, " +
+                             "config TEXT, base INTEGER)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS allocation (" +
+                             "id TEXT, proc INTEGER, row TEXT, " +
+                             "version INTEGER, PRIMARY KEY (id, proc))")
+
+    @property
+    def _db(self) -> sqlite3.Connection:
+        # sqlite3 connections can not be shared between threads
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, isolation_level=None,
+                                 timeout=60)
+            self._local.db = db
+        return db
+
+    @contextmanager
+    def locked(self, system_id: Optional[str] = None):
+        """Hold the write lock of the database across every process"""
+        db = self._db
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    def version(self, system_id: str) -> Optional[int]:
+        """Version of a stored system, or None if there is no such system"""
+        row = self._db.execute("SELECT version FROM systems WHERE id = ?",
+                               (system_id,)).fetchone()
+        return None if row is None else row[0]
+
+    def get(self, system_id: str) -> Optional[Dict]:
+        """Read a whole system back as a config, or None if there is no
+        such system"""
+        row = self._db.execute("SELECT version, config FROM systems " +
+                               "WHERE id = ?", (system_id,)).fetchone()
+        if row is None:
+            return None
+        config = json.loads(row[1])
+        config["version"] = row[0]
+        config["allocation"] = [
+            json.loads(alloc) for alloc, in self._db.execute(
+                "SELECT row FROM allocation WHERE id = ? ORDER BY proc",
+                (system_id,))]
+        return config
+
+    def put(self, system_id: str, config: Dict) -> int:
+        """Store a whole system, replacing any system with the same ID
+
+        Returns:
+            int: The new version of the system
+        """
+        version = new_version(self.version(system_id))
+        rest = {key: value for key, value in config.items()
+                if key not in ("allocation", "version")}
+        self._db.execute("INSERT OR REPLACE INTO systems " +
+                         "VALUES (?, ?, ?, ?)",
+                         (system_id, version,
+                          json.dumps(rest, default=list), version))
+        self._db.execute("DELETE FROM allocation WHERE id = ?", (system_id,))
+        self._db.executemany("INSERT INTO allocation VALUES (?, ?, ?, ?)",
+                             ((system_id, i, json.dumps(row), version)
+                              for i, row in enumerate(config["allocation"])))
+        return version
+
+    def put_rows(self, system_id: str, rows: Dict[int, Iterable[int]]) -> int:
+        """Store changed allocation rows of a system
+
+        Returns:
+            int: The new version of the system
+        """
+        version = self.version(system_id) + 1
+        self._db.execute("UPDATE systems SET version = ? WHERE id = ?",
+                         (version, system_id))
+        self._db.executemany("UPDATE allocation SET row = ?, version = ? " +
+                             "WHERE id = ? AND proc = ?",
+                             ((json.dumps(list(row)), version, system_id, i)
+                              for i, row in rows.items()))
+        return version
+
+    def rows_since(self, system_id: str,
+                   version: int) -> Optional[Dict[int, List[int]]]:
+        """The allocation rows changed after a version, for a process that
+        has the system at that version to catch up without reading all of
+        it
+
+        Returns:
+            Optional[Dict[int, List[int]]]: The changed rows, or None if
+                                            the whole system was stored
+                                            again since that version
+        """
+        row = self._db.execute("SELECT base FROM systems WHERE id = ?",
+                               (system_id,)).fetchone()
+        if row is None or row[0] is None or row[0] > version:
+            return None
+        return {i: json.loads(alloc) for i, alloc in self._db.execute(
+            "SELECT proc, row FROM allocation WHERE id = ? AND version > ?",
+            (system_id, version))}
+
+    def delete(self, system_id: str) -> bool:
+        """Drop a stored system
+
+        Returns:
+            bool: If there was a system to drop
+        """
+        self._db.execute("DELETE FROM allocation WHERE id = ?", (system_id,))
+        return self._db.execute("DELETE FROM systems WHERE id = ?",
+                                (system_id,)).rowcount > 0
+
+
+class MmapStateStore:
+    # Files are BankersSnapshot snapshots
+    HEADER = BankersSnapshot.HEADER
+    CELL = BankersSnapshot.CELL
+
+    # Records of the log of changed rows kept next to each data file, as
+    # (version, process) pairs. The first one is (version, -1) for the
+    # version the whole system was stored at
+    ROW = struct.Struct("<qq")
+
+    # Most records in a log before it starts again
+    ROW_LOG_SIZE = 4096
+
+    def __init__(self, directory: str = "/dev/shm/bankers"):
+        """Keep the state of every system in a memory mapped file so that
+        processes on one host share it. Each file is a binary snapshot, see
+        BankersSnapshot, so rows can be changed in place. Writers take an
+        flock on a lock file next to the data file
+
+        Args:
+            directory (str): Directory for the files, defaults to shared
+                             memory
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+        # system_id -> (inode, mmap) of the data files mapped so far
+        self._maps = {}
+        self._lock = threading.RLock()
+
+    def _path(self, system_id: str) -> str:
+        if not system_id.replace("-", "").replace("_", "").isalnum():
+            raise ValueError(f"System ID {system_id} is not allowed")
+        return os.path.join(self.directory, system_id)
+
+    @contextmanager
+    def locked(self, system_id: str):
+        """Hold the write lock of a system across every process"""
+        with self._lock, open(self._path(system_id) + ".lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _map(self, system_id: str) -> Optional[mmap.mmap]:
+        """Map the current data file of a system. A whole new system is
+        written to a new file that replaces the old one, so the mapping is
+        redone whenever the file changed underneath it"""
+        path = self._path(system_id) + ".bank"
+        try:
+            inode = os.stat(path).st_ino
+        except FileNotFoundError:
+            self._maps.pop(system_id, None)
+            return None
+
+        mapped = self._maps.get(system_id)
+        if mapped is None or mapped[0] != inode:
+            with open(path, "r+b") as f:
+                mapped = (inode, mmap.mmap(f.fileno(), 0))
+            self._maps[system_id] = mapped
+        return mapped[1]
+
+    def version(self, system_id: str) -> Optional[int]:
+        """Version of a stored system, or None if there is no such system"""
+        data = self._map(system_id)
+        return None if data is None else self.HEADER.unpack_from(data)[1]
+
+    def get(self, system_id: str) -> Optional[Dict]:
+        """Read a whole system back as a config, or None if there is no
+        such system"""
+        data = self._map(system_id)
+        if data is None:
+            return None
+        return BankersSnapshot.state(data)
+
+    def put(self, system_id: str, config: Dict) -> int:
+        """Store a whole system, replacing any system with the same ID
+
+        Returns:
+            int: The new version of the system
+        """
+        version = new_version(self.version(system_id))
+        path = self._path(system_id) + ".bank"
+
+        # Write the new file next to the old one and swap it in, so other
+        # processes never map a half written file
+        with open(path + ".tmp", "wb") as f:
+            f.write(BankersSnapshot.dumps(dict(config, version=version)))
+        os.replace(path + ".tmp", path)
+        self._start_log(system_id, version)
+        return version
+
+    def _start_log(self, system_id: str, version: int):
+        """Start the log of changed rows again from a version"""
+        with open(self._path(system_id) + ".rows", "wb") as f:
+            f.write(self.ROW.pack(version, -1))
+
+    def put_rows(self, system_id: str, rows: Dict[int, Iterable[int]]) -> int:
+        """Store changed allocation rows of a system in place
+
+        Returns:
+            int: The new version of the system
+        """
+        data = self._map(system_id)
+        magic, version, num_proc, num_res = self.HEADER.unpack_from(data)
+        row_format = struct.Struct(f"<{num_res}q")
+        for i, row in rows.items():
+            row_format.pack_into(data, self.HEADER.size +
+                                 self.CELL.size * num_res * (1 + i), *row)
+        version += 1
+        self.HEADER.pack_into(data, 0, magic, version, num_proc, num_res)
+
+        path = self._path(system_id) + ".rows"
+        if os.path.getsize(path) >= self.ROW.size * self.ROW_LOG_SIZE:
+            # Processes further behind than this read the whole system
+            self._start_log(system_id, version)
+        else:
+            with open(path, "ab") as f:
+                f.write(b"".join(self.ROW.pack(version, i) for i in rows))
+        return version
+
+    def rows_since(self, system_id: str,
+                   version: int) -> Optional[Dict[int, List[int]]]:
+        """The allocation rows changed after a version, for a process that
+        has the system at that version to catch up without reading all of
+        it
+
+        Returns:
+            Optional[Dict[int, List[int]]]: The changed rows, or None if
+                                            the whole system was stored
+                                            again since that version, or
+                                            the log no longer goes back
+                                            that far
+        """
+        data = self._map(system_id)
+        try:
+            with open(self._path(system_id) + ".rows", "rb") as f:
+                log = f.read()
+        except FileNotFoundError:
+            return None
+        if data is None or len(log) < self.ROW.size:
+            return None
+        records = self.ROW.iter_unpack(log)
+        if next(records)[0] > version:
+            return None
+
+        num_res = self.HEADER.unpack_from(data)[3]
+        row_format = struct.Struct(f"<{num_res}q")
+        changed = sorted({i for changed, i in records if changed > version})
+        return {i: list(row_format.unpack_from(
+                    data, self.HEADER.size +
+                    self.CELL.size * num_res * (1 + i)))
+                for i in changed}
+
+    def delete(self, system_id: str) -> bool:
+        """Drop a stored system
+
+        Returns:
+            bool: If there was a system to drop
+        """
+        self._maps.pop(system_id, None)
+        try:
+            os.remove(self._path(system_id) + ".rows")
+        except FileNotFoundError:
+            pass
+        try:
+            os.remove(self._path(system_id) + ".bank")
+            return True
+        except FileNotFoundError:
+            return False
+
+
+class SharedSystem:
+    def __init__(self, store, system_id: str,
+                 factory: Callable[..., BankersAlgorithm]):
+        """A Bankers Algorithm system whose state lives in a state store
+        shared with other processes. When another process only changed
+        allocation rows they are set in the local system, which keeps its
+        cached arrays. When it stored the whole system, the system is
+        rebuilt from the store. Every change made here is written back
+        before the store's lock is released
+
+        Args:
+            store: SQLiteStateStore or MmapStateStore holding the state
+            system_id (str): ID of the system in the store
+            factory (Callable[..., BankersAlgorithm]): Builds a system from
+                                                       a config, and takes
+                                                       trusted=True for
+                                                       configs read back
+                                                       from the store
+        """
+        self.store = store
+        self.system_id = system_id
+        self.factory = factory
+        self._system = None
+        self._version = None
+        self._backend = "auto"
+
+    def _sync(self):
+        """Bring the local system up to date if the stored one moved on.
+        Has to be called with the store locked"""
+        version = self.store.version(self.system_id)
+        if version is None:
+            raise KeyError(self.system_id)
+        if version == self._version:
+            return
+
+        rows = None
+        if self._system is not None:
+            rows = self.store.rows_since(self.system_id, self._version)
+        if rows is not None:
+            # Only requests and releases were made, set the rows they
+            # changed in place
+            self._system.patch([{"op": "set_row", "matrix": "allocation",
+                                 "proc": i, "row": row}
+                                for i, row in rows.items()])
+        else:
+            config = self.store.get(self.system_id)
+            # The stored state was checked by the process that made it
+            system = self.factory(config, trusted=True)
+            # Outstanding requests are only kept by this process
+            if self._system is not None:
+                for proc_num, row in self._system.waiting.items():
+                    if (proc_num < system.num_proc and
+                            proc_num not in system.free):
+                        system.wait(proc_num, row)
+            self._system = system
+            self._backend = config.get("backend", "auto")
+        self._version = version
+
+    def _system_synced(self) -> BankersAlgorithm:
+        with self.store.locked(self.system_id):
+            self._sync()
+        return self._system
+
+    def request(self, proc_num, resource_req, verbosity=None):
+        with self.store.locked(self.system_id):
+            self._sync()
+            result = self._system.request(proc_num, resource_req, verbosity)
+            if result[0]:
+                self._version = self.store.put_rows(
+                    self.system_id,
+                    {proc_num: self._system._held(proc_num)})
+        return result
+
+    def commit(self, proc_num, resource_req, safe_seq, version):
+        # version is one of the local system, from check_request()
+        with self.store.locked(self.system_id):
+            self._sync()
+            committed = self._system.commit(proc_num, resource_req,
+                                            safe_seq, version)
+            if committed:
+                self._version = self.store.put_rows(
+                    self.system_id,
+                    {proc_num: self._system._held(proc_num)})
+        return committed
+
+    def request_batch(self, requests, order=None, verbosity=None):
+        with self.store.locked(self.system_id):
+            self._sync()
+            results = self._system.request_batch(requests, order, verbosity)
+            changed = {requests[i][0] for i, result in enumerate(results)
+                       if result[0]}
+            if changed:
+                self._version = self.store.put_rows(
+                    self.system_id,
+                    {i: self._system._held(i) for i in changed})
+        return results
+
+    def _put(self):
+        """Write the whole local system back to the store. Has to be called
+        with the store locked"""
+        self._version = self.store.put(self.system_id, dict(
+            self._system.snapshot(), backend=self._backend))
+
+    def patch(self, changes):
+        with self.store.locked(self.system_id):
+            self._sync()
+            self._system.patch(changes)
+            self._put()
+            return self._version
+
+    def add_process(self, maximum):
+        with self.store.locked(self.system_id):
+            self._sync()
+            proc_num = self._system.add_process(maximum)
+            self._put()
+        return proc_num
+
+    def release(self, proc_num, resource_rel=None):
+        with self.store.locked(self.system_id):
+            self._sync()
+            released = self._system.release(proc_num, resource_rel)
+            self._version = self.store.put_rows(
+                self.system_id, {proc_num: self._system._held(proc_num)})
+        return released
+
+    def exchange(self, proc_num, acquire, release, verbosity=None):
+        with self.store.locked(self.system_id):
+            self._sync()
+            result = self._system.exchange(proc_num, acquire, release,
+                                           verbosity)
+            if result[0]:
+                self._version = self.store.put_rows(
+                    self.system_id,
+                    {proc_num: self._system._held(proc_num)})
+        return result
+
+    def finish(self, proc_num):
+        with self.store.locked(self.system_id):
+            self._sync()
+            self._system.finish(proc_num)
+            self._put()
+
+    # Versions of the local system are different in every process, so the
+    # version of the stored system is the one handed out
+
+    @property
+    def version(self) -> int:
+        with self.store.locked(self.system_id):
+            self._sync()
+            return self._version
+
+    def snapshot(self):
+        with self.store.locked(self.system_id):
+            self._sync()
+            return dict(self._system.snapshot(), version=self._version)
+
+    def changes_since(self, version):
+        # Only this process saw the local changes, so there are none to
+        # hand out past the current version
+        current = self.version
+        if version != current:
+            return None
+        return {"version": current, "changes": []}
+
+    def __getattr__(self, name):
+        # Everything else reads from an up to date local system. Reads run
+        # outside the store lock, the local system keeps them consistent
+        return getattr(self._system_synced(), name)
+
+
+def open_state_store(url: str):
+    """Open a state store from a URL
+
+    Args:
+        url (str): sqlite:///path/to/file.db or mmap:///path/to/directory
+
+    Returns:
+        The state store
+
+    Raises:
+        ValueError: If the URL is not one of the supported kinds
+    """
+    if url.startswith("sqlite://"):
+        return SQLiteStateStore(url[len("sqlite://"):])
+    if url.startswith("mmap://"):
+        return MmapStateStore(url[len("mmap://"):])
+    raise ValueError(f"Unknown state store {url}")
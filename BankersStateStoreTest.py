@@ -0,0 +1,138 @@
+import os
+import tempfile
+import unittest
+from BankersAlgorithm import BankersAlgorithm as ba
+from BankersAlgorithm import MAX_VERSION
+from BankersRegistry import BankersRegistry
+from BankersStateStore import MmapStateStore, SQLiteStateStore
+
+
+def factory(config, trusted=False):
+    b = ba(config["num_proc"], config["num_res"], config["resources"],
+           config["allocation"], config["max"], trusted)
+    for proc_num in config.get("free", []):
+        b.finish(proc_num)
+    return b
+
+
+config = {"num_proc": 5, "num_res": 3, "resources": [10, 5, 7],
+          "allocation": [[0, 1, 0], [2, 0, 0], [3, 0, 2],
+                         [2, 1, 1], [0, 0, 2]],
+          "max": [[7, 5, 3], [3, 2, 2], [9, 0, 2],
+                  [2, 2, 2], [4, 3, 3]]}
+
+
+class MmapStateStoreTestCases(unittest.TestCase):
+    def make_store(self):
+        return MmapStateStore(self.directory.name)
+
+    def setUp(self):
+        """Set up two registries on one store, standing in for two
+        gunicorn workers
+        """
+        self.directory = tempfile.TemporaryDirectory()
+        self.first = BankersRegistry(factory, store=self.make_store())
+        self.second = BankersRegistry(factory, store=self.make_store())
+        self.first.create("a", config)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_systems_are_shared(self):
+        """Test that a system made by one worker is found by the other"""
+        self.assertIn("a", self.second)
+        self.assertEqual(self.second.get("a").allocation,
+                         config["allocation"])
+
+    def test_requests_are_seen_by_every_worker(self):
+        """Test that a request granted by one worker is seen by the other,
+        and checked against the state the other worker changed
+        """
+        self.assertTrue(self.first.get("a").request(1, [1, 0, 2])[0])
+        self.assertEqual(self.second.get("a").allocation[1], [3, 0, 2])
+
+        # The second worker has to see the first grant to refuse this
+        self.assertFalse(self.second.get("a").request(0, [0, 2, 0])[0])
+        self.assertTrue(self.second.get("a").request(3, [0, 1, 0])[0])
+        self.assertEqual(self.first.get("a").allocation[3], [2, 2, 1])
+
+    def test_patches_and_versions_are_shared(self):
+        """Test that a patch made by one worker reaches the other, and both
+        workers hand out the same version for the same state
+        """
+        self.second.get("a").request(1, [1, 0, 2])
+        version = self.first.get("a").patch(
+            [{"op": "add_process", "allocation": [0, 0, 0],
+              "max": [1, 1, 1]}])
+        self.assertEqual(self.second.get("a").num_proc, 6)
+        self.assertEqual(self.second.get("a").allocation[1], [3, 0, 2])
+        self.assertEqual(self.second.get("a").snapshot()["version"], version)
+        self.assertEqual(self.first.get("a").version, version)
+        self.assertLessEqual(version, MAX_VERSION)
+        self.assertIsNone(self.second.get("a").changes_since(version - 1))
+
+    def test_finished_slots_are_shared(self):
+        """Test that a slot freed by one worker is reused by the other"""
+        self.assertEqual(self.second.get("a").release(3), [2, 1, 1])
+        self.first.get("a").finish(1)
+        self.assertEqual(self.second.get("a").free, [1])
+        self.assertEqual(self.second.get("a").add_process([1, 1, 1]), 1)
+        self.assertEqual(self.first.get("a").free, [])
+        self.assertEqual(self.first.get("a").allocation[3], [0, 0, 0])
+
+    def test_releases_and_exchanges_are_shared(self):
+        """Test that a partial release and an exchange made by one worker
+        are seen by the other
+        """
+        self.assertEqual(self.first.get("a").release(2, [1, 0, 0]),
+                         [1, 0, 0])
+        self.assertTrue(self.second.get("a").exchange(
+            4, [0, 1, 0], [0, 0, 1], "none")[0])
+        self.assertEqual(self.first.get("a").allocation[2], [2, 0, 2])
+        self.assertEqual(self.first.get("a").allocation[4], [0, 1, 1])
+
+    def test_granted_rows_are_set_in_place(self):
+        """Test that a worker catches up with requests and releases made by
+        another one by setting the rows they changed, keeping its system
+        and its cached arrays, and only rebuilds when the whole system was
+        stored again
+        """
+        shared = self.second.get("a")
+        self.assertTrue(shared.safety()[0])
+        system = shared._system
+        need = system.need
+
+        self.assertTrue(self.first.get("a").request(1, [1, 0, 2])[0])
+        self.assertEqual(self.first.get("a").release(3, [1, 0, 0]),
+                         [1, 0, 0])
+        self.assertEqual(shared.allocation[1], [3, 0, 2])
+        self.assertEqual(shared.allocation[3], [1, 1, 1])
+        self.assertIs(shared._system, system)
+        self.assertIs(system.need, need)
+        self.assertEqual(system.need, system.calculate_need())
+        self.assertEqual(system.available, system.calculate_available())
+        self.assertEqual(shared.version, self.first.get("a").version)
+
+        self.first.get("a").finish(4)
+        self.assertEqual(shared.free, [4])
+        self.assertIsNot(shared._system, system)
+
+    def test_replaced_and_deleted_systems(self):
+        """Test that replacing or deleting a system reaches every worker"""
+        self.second.get("a")
+        self.first.create("a", dict(config, resources=[20, 20, 20]))
+        self.assertEqual(self.second.get("a").resources, [20, 20, 20])
+
+        self.assertTrue(self.first.delete("a"))
+        self.assertNotIn("a", self.second)
+        with self.assertRaises(KeyError):
+            self.second.get("a").safety()
+
+
+class SQLiteStateStoreTestCases(MmapStateStoreTestCases):
+    def make_store(self):
+        return SQLiteStateStore(os.path.join(self.directory.name, "state.db"))
+
+
+if __name__ == "__main__":
+    unittest.main()
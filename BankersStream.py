@@ -0,0 +1,120 @@
+"""Fast request and response encodings for the HTTP routes.
+
+Big states and logs are written out as JSON a group of rows at a time
+rather than as one string. The first bytes go out while the rest is still
+being encoded, and the whole body never has to be held as text at once.
+
+Requests can also be posted as raw int64 cells, the same cells snapshots
+use. They are read without going through text at all.
+"""
+from typing import Iterator
+from typing import List
+from typing import Sequence
+from typing import Tuple
+import json
+import os
+
+from BankersAlgorithm import int64_cells
+
+# Content type of bodies made of int64 cells
+BINARY = "application/octet-stream"
+
+# Responses with more list items than this are streamed
+STREAM_ITEMS = int(os.environ.get("BANKERS_STREAM_ITEMS", 10_000))
+
+# List items encoded together by json.dumps
+GROUP_ITEMS = 10_000
+
+# Bytes collected before a chunk is handed out
+CHUNK_BYTES = 64 * 1024
+
+
+def is_list(value) -> bool:
+    """Check if a value is written as a JSON list. Sequences that are not
+    lists, such as the rows of sparse systems, are written as lists too"""
+    return isinstance(value, Sequence) and not isinstance(value, str)
+
+
+def default(value):
+    """Turn values json.dumps does not know into ones it does, for its
+    default argument
+
+    Raises:
+        TypeError: If the value can not be written as JSON
+    """
+    if is_list(value):
+        return list(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON " +
+                    "serializable")
+
+
+def size(value) -> int:
+    """Count the list items in a JSON value, including the items of lists
+    inside lists, to decide if it is worth streaming"""
+    if isinstance(value, dict):
+        return sum(map(size, value.values()))
+    if is_list(value):
+        return len(value) + sum(len(item) for item in value
+                                if isinstance(item, list))
+    return 1
+
+
+def stream(value) -> Iterator[bytes]:
+    """Encode a value as JSON in chunks of about CHUNK_BYTES
+
+    Args:
+        value: Dicts, lists and anything json.dumps takes
+
+    Returns:
+        Iterator[bytes]: The chunks, in order
+    """
+    chunk = []
+    length = 0
+    for piece in _pieces(value):
+        chunk.append(piece)
+        length += len(piece)
+        if length >= CHUNK_BYTES:
+            yield "".join(chunk).encode()
+            chunk = []
+            length = 0
+    if chunk:
+        yield "".join(chunk).encode()
+
+
+def _pieces(value) -> Iterator[str]:
+    if isinstance(value, dict):
+        yield "{"
+        for k, (key, item) in enumerate(value.items()):
+            yield (", " if k else "") + json.dumps(str(key)) + ": "
+            yield from _pieces(item)
+        yield "}"
+    elif is_list(value) and len(value) > 1:
+        # Rows of a matrix count as all of their cells
+        row = len(value[0]) if isinstance(value[0], list) else 1
+        step = max(GROUP_ITEMS // max(row, 1), 1)
+        yield "["
+        for start in range(0, len(value), step):
+            # Each group is encoded as a list, without its brackets
+            group = json.dumps(value[start:start + step])[1:-1]
+            yield (", " if start else "") + group
+        yield "]"
+    else:
+        yield json.dumps(value, default=default)
+
+
+def read_request(data: bytes, num_res: int) -> Tuple[int, List[int]]:
+    """Read a resource request posted as int64 cells, the process number
+    and then one cell per resource
+
+    Args:
+        data (bytes): The body
+        num_res (int): Number of resources of the system
+
+    Returns:
+        Tuple[int, List[int]]: The process number and the request
+
+    Raises:
+        ValueError: If the body is not num_res + 1 int64 cells
+    """
+    cells = int64_cells(data, num_res + 1, "request")
+    return cells[0], cells[1:].tolist()
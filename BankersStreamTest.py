@@ -0,0 +1,45 @@
+import array
+import json
+import unittest
+from unittest import mock
+from BankersAlgorithm import BankersAlgorithm as ba
+import BankersStream
+
+
+class BankersStreamTestCases(unittest.TestCase):
+    def setUp(self):
+        self.b = ba(5, 3, [10, 5, 7],
+                    [[0, 1, 0], [2, 0, 0], [3, 0, 2], [2, 1, 1], [0, 0, 2]],
+                    [[7, 5, 3], [3, 2, 2], [9, 0, 2], [2, 2, 2], [4, 3, 3]])
+
+    def test_stream_is_the_same_json(self):
+        """Test that a state and logs streamed in many small chunks read
+        back as the same value
+        """
+        state = self.b.snapshot()
+        state["log"] = ["Executing proc {}".format(i) for i in range(50)]
+        state["empty"] = []
+        with mock.patch.object(BankersStream, "GROUP_ITEMS", 4), \
+                mock.patch.object(BankersStream, "CHUNK_BYTES", 16):
+            chunks = list(BankersStream.stream(state))
+        self.assertGreater(len(chunks), 10)
+        self.assertEqual(json.loads(b"".join(chunks)), state)
+        # Both matrices count their rows and cells, lists of nothing count
+        # nothing
+        self.assertEqual(BankersStream.size(state), 3 + 2 * 20 + 50 + 3)
+
+    def test_read_request(self):
+        """Test that a request posted as int64 cells is read as the
+        process number and a list, and the wrong size is refused
+        """
+        body = array.array("q", [1, 1, 0, 2]).tobytes()
+        proc_id, resources = BankersStream.read_request(body,
+                                                        self.b.num_res)
+        self.assertEqual((proc_id, resources), (1, [1, 0, 2]))
+        self.assertTrue(self.b.request(proc_id, resources)[0])
+        with self.assertRaises(ValueError):
+            BankersStream.read_request(body[:-8], self.b.num_res)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,427 @@
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from BankersAlgorithm import BankersAlgorithm
+from BankersMetrics import timed
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class NumpyBankersAlgorithm(BankersAlgorithm):
+    """Bankers Algorithm that keeps its state in contiguous int64 arrays.
+
+    The list based API still works, ``allocation``, ``maximum`` and
+    ``resources`` are converted to lists when they are read and back to
+    arrays when they are assigned. The arrays themselves are available as
+    ``allocation_array``, ``maximum_array`` and ``resources_array``. int64
+    arrays that are assigned are used as they are, without a copy.
+    """
+
+    backend = "numpy"
+
+    def __init__(self, num_proc: int, num_res: int, resources: List[int],
+                 allocation: List[List[int]], maximum: List[List[int]],
+                 trusted: bool = False):
+        """Initialize the Bankers Algorithm
+
+        Args:
+            num_proc (int): Number of processes
+            num_res (int): Number of resources
+            resources (List[int]): Quantity of resources available
+            allocation (List[List[int]]): Current resource allocation
+                                          for processes, or an array
+            maximum (List[List[int]]): Maximum possible resource allocation,
+                                       or an array
+            trusted (bool): Skip checking the arguments, for states the
+                            system made itself such as snapshots and clones
+
+        Raises:
+            ImportError: If numpy is not installed
+        """
+        if np is None:
+            raise ImportError("numpy is required for the numpy backend")
+
+        super().__init__(num_proc, num_res, resources, allocation, maximum,
+                         trusted)
+
+    @timed("validate")
+    def _validate(self, num_proc: int, num_res: int, resources,
+                  allocation, maximum):
+        """Check the arguments to __init__. Arrays are checked by their
+        shape and dtype instead of cell by cell
+
+        Raises:
+            ValueError: Explaining what is wrong
+        """
+        if not (isinstance(allocation, np.ndarray) and
+                isinstance(maximum, np.ndarray)):
+            return super()._validate(num_proc, num_res, resources,
+                                     allocation, maximum)
+
+        for name, matrix in (("allocation", allocation),
+                             ("maximum", maximum)):
+            if matrix.shape != (num_proc, num_res):
+                raise ValueError(f"Shape of {name} matrix must be " +
+                                 f"{(num_proc, num_res)}, {matrix.shape} " +
+                                 "is not")
+            if matrix.dtype.kind not in "iu":
+                raise ValueError(f"All values in {name} matrix should be " +
+                                 f"of type int. {matrix.dtype} is not int")
+        if allocation.size and allocation.min() < 0:
+            raise ValueError("All values in allocation matrix should be " +
+                             f"at least 0. {allocation.min()} is not")
+        if len(resources) != num_res:
+            raise ValueError("Length of resource array must equal number " +
+                             f"of resources, {len(resources)} is not " +
+                             f" {num_res}")
+
+    @staticmethod
+    def _least(cells: memoryview) -> int:
+        """The smallest of flat cells without going through ints"""
+        if not cells.nbytes:
+            return 0
+        return int(np.frombuffer(cells, dtype=np.int64).min())
+
+    @staticmethod
+    def _rows(cells: memoryview, num_proc: int, num_res: int, copy: bool):
+        """Reshape flat cells into an array without going through lists,
+        and without copying them unless asked to or they are read only"""
+        rows = np.frombuffer(cells, dtype=np.int64).reshape(num_proc,
+                                                            num_res)
+        if copy or not rows.flags.writeable:
+            rows = rows.copy()
+        return rows
+
+    @property
+    def resources(self) -> List[int]:
+        return self.resources_array.tolist()
+
+    @resources.setter
+    def resources(self, resources: List[int]):
+        self.resources_array = np.asarray(resources, dtype=np.int64)
+        self.invalidate()
+
+    @property
+    def allocation(self) -> List[List[int]]:
+        return self.allocation_array.tolist()
+
+    @allocation.setter
+    def allocation(self, allocation: List[List[int]]):
+        self.allocation_array = np.asarray(
+            allocation, dtype=np.int64).reshape(self.num_proc, self.num_res)
+        self.invalidate()
+
+    @property
+    def maximum(self) -> List[List[int]]:
+        return self.maximum_array.tolist()
+
+    @maximum.setter
+    def maximum(self, maximum: List[List[int]]):
+        self.maximum_array = np.asarray(
+            maximum, dtype=np.int64).reshape(self.num_proc, self.num_res)
+        self.invalidate()
+
+    def calculate_available(self) -> List[int]:
+        """Calculate the available array. This contains the number of
+        free resources that are not allocated to a process. available[i] = k
+        means that there are k instances of resource i free
+
+        Returns:
+            List[int]: a List, num_res long, that contains the avaiable
+                       resource count
+        """
+        return self._available_array().tolist()
+
+    def calculate_need(self) -> List[List[int]]:
+        """Calculate the need array. This contains the number of resources
+        that a process could request. need[i][j] = k means that process i
+        could request k more instances of resource j
+
+        Returns:
+            List[List[int]]: The need array
+        """
+        return self._need_array().tolist()
+
+    @timed("calculate_available")
+    def _available_array(self):
+        return self.resources_array - self.allocation_array.sum(axis=0)
+
+    @timed("calculate_need")
+    def _need_array(self):
+        return self.maximum_array - self.allocation_array
+
+    @property
+    def need(self):
+        """The need array as an int64 array, calculated once and then kept
+        up to date by every request"""
+        return self._cached("_need", self._need_array)
+
+    @property
+    def available(self):
+        """The available array as an int64 array, calculated once and then
+        kept up to date by every request"""
+        return self._cached("_available", self._available_array)
+
+    def _apply(self, proc_num: int, resource_req):
+        """Add resources to the allocation of a process and update the
+        need and available arrays to match
+
+        Args:
+            proc_num (int): Process number to allocate to
+            resource_req: Number of resources to add
+        """
+        need = self.need
+        available = self.available
+        self.allocation_array[proc_num] += resource_req
+        need[proc_num] -= resource_req
+        available -= resource_req
+        self._record([{"op": "set_row", "matrix": "allocation",
+                       "proc": proc_num,
+                       "row": self.allocation_array[proc_num].tolist()}])
+
+    def _matrices(self) -> Tuple:
+        return self.resources_array, self.allocation_array, self.maximum_array
+
+    def _add_row(self, allocation: List[int], maximum: List[int]):
+        """Add a process after the last one, updating the need and
+        available arrays to match. The arrays are copied to grow them"""
+        allocation = np.asarray(allocation, dtype=np.int64)
+        maximum = np.asarray(maximum, dtype=np.int64)
+        self.allocation_array = np.vstack([self.allocation_array,
+                                           allocation])
+        self.maximum_array = np.vstack([self.maximum_array, maximum])
+        if self._need is not None:
+            self._need = np.vstack([self._need, maximum - allocation])
+        if self._available is not None:
+            self._available -= allocation
+        self.num_proc += 1
+
+    def _grow(self) -> int:
+        """Add empty slots after the last process for add_process(). The
+        arrays grow by half at a time so they are copied less and less
+        often as processes are added
+
+        Returns:
+            int: The number of slots added
+        """
+        slots = self.num_proc // 2 + 1
+        empty = np.zeros((slots, self.num_res), dtype=np.int64)
+        self.allocation_array = np.vstack([self.allocation_array, empty])
+        self.maximum_array = np.vstack([self.maximum_array, empty])
+        if self._need is not None:
+            self._need = np.vstack([self._need, empty])
+        self.num_proc += slots
+        return slots
+
+    def _remove_row(self, proc_num: int):
+        """Remove a process, the processes after it move down by one. The
+        need and available arrays are updated to match"""
+        if self._available is not None:
+            self._available += self.allocation_array[proc_num]
+        self.allocation_array = np.delete(self.allocation_array, proc_num,
+                                          axis=0)
+        self.maximum_array = np.delete(self.maximum_array, proc_num, axis=0)
+        if self._need is not None:
+            self._need = np.delete(self._need, proc_num, axis=0)
+        self.num_proc -= 1
+
+    def _as_vector(self, resource_req: List[int]):
+        """Convert a resource vector to an int64 array"""
+        return np.asarray(resource_req, dtype=np.int64)
+
+    def _first_over(self, proc_num: int, resource_req) -> Optional[int]:
+        """Find the first resource a request asks for more of than the
+        process needs or than is available, in one vectorized comparison
+
+        Args:
+            proc_num (int): Process number that the request is being made on
+            resource_req: Number of extra resources requested
+
+        Returns:
+            Optional[int]: The resource, or None if the request fits
+        """
+        over = np.flatnonzero((resource_req > self.need[proc_num]) |
+                              (resource_req > self.available))
+        return int(over[0]) if over.size else None
+
+    def _below_zero(self, proc_num: int, resource_req) -> bool:
+        """Check if a request would take a process below zero resources"""
+        return bool(
+            (self.allocation_array[proc_num] + resource_req).min() < 0)
+
+    def _safe_order(self, proc_num: Optional[int] = None,
+                    resource_req=None) -> List[int]:
+        """Find the order processes can finish in, without changing the
+        state of the system. Every unfinished process that can run with
+        the current work vector is found with one comparison over the whole
+        need matrix, and all of them are finished together, lowest process
+        number first
+
+        Args:
+            proc_num (Optional[int]): Process to pretend to grant a request
+                                      to first
+            resource_req: The request to pretend to grant
+
+        Returns:
+            List[int]: The processes that were able to finish, in order
+        """
+        work = self.available.copy()
+        need = self.need
+        if proc_num is not None:
+            work -= resource_req
+            need = need.copy()
+            need[proc_num] -= resource_req
+
+        finish = np.zeros(self.num_proc, dtype=bool)
+        return self._finish_batches(work, need, finish, [], proc_num,
+                                    resource_req)
+
+    def _finish_batches(self, work, need, finish, process_order: List[int],
+                        proc_num: Optional[int] = None,
+                        resource_req=None) -> List[int]:
+        """Finish every process that can run with the work vector together,
+        until no more can, see _safe_order
+
+        Args:
+            work: Resources free at the start, this is modified
+            need: Resources each process could still request
+            finish: Which processes have already finished, this is modified
+            process_order (List[int]): Processes that have already finished
+                                       in order, this is added to
+            proc_num (Optional[int]): Process pretended to be granted a
+                                      request
+            resource_req: The request pretended to be granted
+
+        Returns:
+            List[int]: The processes that were able to finish, in order
+        """
+        while True:
+            runnable = np.flatnonzero(~finish & (need <= work).all(axis=1))
+            if not runnable.size:
+                break
+            finish[runnable] = True
+            work += self.allocation_array[runnable].sum(axis=0)
+            if proc_num is not None and proc_num in runnable:
+                work += resource_req
+            process_order.extend(runnable.tolist())
+
+        return process_order
+
+    def _detect_order(self, requests: List[List[int]]) -> List[int]:
+        """Find the order processes can finish in when each one only needs
+        its outstanding request, finishing them in batches, see
+        _safe_order
+
+        Args:
+            requests (List[List[int]]): Outstanding request of each process
+
+        Returns:
+            List[int]: The processes that were able to finish, in order
+        """
+        requests = np.asarray(requests, dtype=np.int64).reshape(
+            self.num_proc, self.num_res)
+        return self._finish_batches(self.available.copy(), requests,
+                                    np.zeros(self.num_proc, dtype=bool), [])
+
+    def _repair_order(self, process_order: List[int]) -> List[int]:
+        """Check a safe sequence found at an earlier version against the
+        current state, see BankersAlgorithm._repair_order. The whole
+        sequence is checked with one comparison over the need rows
+
+        Args:
+            process_order (List[int]): An earlier safe sequence
+
+        Returns:
+            List[int]: The processes that were able to finish, in order
+        """
+        order = np.asarray(process_order, dtype=np.intp)
+        # Processes removed since then end the sequence
+        gone = np.flatnonzero(order >= self.num_proc)
+        if gone.size:
+            order = order[:gone[0]]
+
+        allocation = self.allocation_array[order]
+        work = self.available + np.cumsum(allocation, axis=0) - allocation
+        fits = (self.need[order] <= work).all(axis=1)
+        k = len(order) if fits.all() else int(np.argmin(fits))
+
+        finish = np.zeros(self.num_proc, dtype=bool)
+        finish[order[:k]] = True
+        work = self.available + allocation[:k].sum(axis=0)
+        return self._finish_batches(work, self.need, finish,
+                                    order[:k].tolist())
+
+    def _order_holds(self, proc_num: int, resource_req,
+                     process_order: List[int]) -> bool:
+        """Check if a sequence of every running process is still a safe
+        sequence once a request is granted, see
+        BankersAlgorithm._order_holds. The whole sequence is checked with
+        one comparison over the need rows
+
+        Args:
+            proc_num (int): Process number that the request is being made on
+            resource_req: Number of extra resources requested
+            process_order (List[int]): The sequence
+
+        Returns:
+            bool: If every process can finish in that order
+        """
+        order = np.asarray(process_order, dtype=np.intp)
+        # Indexing with the order copies the rows
+        allocation = self.allocation_array[order]
+        need = self.need[order]
+        asked = order == proc_num
+        allocation[asked] += resource_req
+        need[asked] -= resource_req
+        work = (self.available - resource_req + np.cumsum(allocation, axis=0)
+                - allocation)
+        return bool((need <= work).all())
+
+    def _remember_safe(self, process_order: List[int],
+                       version: Optional[int] = None):
+        """Cache a safe sequence for the current state, see
+        BankersAlgorithm._remember_safe
+
+        Args:
+            process_order (List[int]): A safe sequence for the current state
+            version (Optional[int]): Version the sequence was found at,
+                                     defaults to the current version
+        """
+        if version is None:
+            version = self.version
+        order = np.asarray(process_order, dtype=np.intp)
+        allocation = self.allocation_array[order]
+
+        # Work in hand just before each process in the sequence runs
+        work = self.available + np.cumsum(allocation, axis=0) - allocation
+        slack = work - self.need[order]
+
+        safe_bound = np.empty((len(order) + 1, self.num_res), dtype=np.int64)
+        safe_bound[0] = np.iinfo(np.int64).max
+        np.minimum.accumulate(slack, axis=0, out=safe_bound[1:])
+
+        position = np.empty(self.num_proc, dtype=np.intp)
+        position[order] = np.arange(len(order))
+
+        self._safe = (version, process_order, position, safe_bound)
+
+    def _fast_safe(self, proc_num: int, resource_req) -> bool:
+        """Check if granting a request keeps the cached safe sequence safe
+
+        Args:
+            proc_num (int): Process number that the request is being made on
+            resource_req: Number of extra resources requested
+
+        Returns:
+            bool: True if the system is known to be safe after the request,
+                  False if the safety algorithm has to be run
+        """
+        safe = self._safe
+        if safe is None or safe[0] != self.version:
+            return False
+        bound = safe[3][safe[2][proc_num]]
+        return bool((resource_req <= bound).all())
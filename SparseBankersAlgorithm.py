@@ -0,0 +1,675 @@
+from bisect import bisect_left
+from itertools import chain
+from itertools import compress
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+import heapq
+
+from BankersAlgorithm import BankersAlgorithm
+from BankersMetrics import timed
+
+# Most nonzero cells in the maximum matrix, as a share of all of them, for
+# choose_backend() to pick the sparse backend
+SPARSE_DENSITY = 0.1
+
+# Fewest resources for choose_backend() to pick the sparse backend, with
+# fewer the dicts cost more than the zeros they leave out
+SPARSE_MIN_RESOURCES = 32
+
+
+class SparseBankersAlgorithm(BankersAlgorithm):
+    """Bankers Algorithm that keeps only the nonzero cells of each process.
+
+    Every row of the allocation, maximum and need matrices is a dict of
+    {resource: count} holding the cells that are not zero, so checking a
+    request, granting it, finishing a process in the safety algorithm and
+    working out the available array only look at the resources that are
+    actually asked for or held. This pays off when there are many resources
+    and each process only uses a few of them, see choose_backend().
+
+    The list based API still works, ``allocation``, ``maximum`` and
+    ``need`` read like lists of lists, and snapshots like those of the
+    other backends, each row only turned into a list when it is read, see
+    DenseRows. The rows themselves are available as ``allocation_rows``,
+    ``maximum_rows`` and ``need_rows``.
+    """
+
+    backend = "sparse"
+
+    def __init__(self, num_proc: int, num_res: int, resources: List[int],
+                 allocation: List[List[int]], maximum: List[List[int]],
+                 trusted: bool = False):
+        """Initialize the Bankers Algorithm
+
+        Args:
+            num_proc (int): Number of processes
+            num_res (int): Number of resources
+            resources (List[int]): Quantity of resources available
+            allocation (List[List[int]]): Current resource allocation
+                                          for processes, or {resource:
+                                          count} rows when trusted
+            maximum (List[List[int]]): Maximum possible resource
+                                       allocation, or {resource: count} rows
+                                       when trusted
+            trusted (bool): Skip checking the arguments, for states the
+                            system made itself such as snapshots and clones
+        """
+        super().__init__(num_proc, num_res, resources, allocation, maximum,
+                         trusted)
+
+    @property
+    def resources(self) -> List[int]:
+        return self._resources
+
+    @resources.setter
+    def resources(self, resources: List[int]):
+        self._resources = list(resources)
+        self.invalidate()
+
+    @property
+    def allocation(self) -> List[List[int]]:
+        return DenseRows(self.allocation_rows, self.num_res)
+
+    @allocation.setter
+    def allocation(self, allocation: List[List[int]]):
+        self.allocation_rows = [sparse_row(row) for row in allocation]
+        self.invalidate()
+
+    @property
+    def maximum(self) -> List[List[int]]:
+        return DenseRows(self.maximum_rows, self.num_res)
+
+    @maximum.setter
+    def maximum(self, maximum: List[List[int]]):
+        self.maximum_rows = [sparse_row(row) for row in maximum]
+        self.invalidate()
+
+    @property
+    def need(self) -> List[List[int]]:
+        """The need array as lists, see need_rows"""
+        return DenseRows(self.need_rows, self.num_res)
+
+    @property
+    def need_rows(self) -> List[Dict[int, int]]:
+        """The nonzero cells of the need array, calculated once and then
+        kept up to date by every request"""
+        return self._cached("_need", self._need_rows)
+
+    @timed("calculate_available")
+    def calculate_available(self) -> List[int]:
+        """Calculate the available array. This contains the number of
+        free resources that are not allocated to a process. available[i] = k
+        means that there are k instances of resource i free
+
+        Returns:
+            List[int]: a List, num_res long, that contains the avaiable
+                       resource count
+        """
+        available = list(self._resources)
+        for row in self.allocation_rows:
+            for j, count in row.items():
+                available[j] -= count
+        return available
+
+    def calculate_need(self) -> List[List[int]]:
+        """Calculate the need array. This contains the number of resources
+        that a process could request. need[i][j] = k means that process i
+        could request k more instances of resource j
+
+        Returns:
+            List[List[int]]: The need array
+        """
+        return [dense_row(row, self.num_res) for row in self._need_rows()]
+
+    @timed("calculate_need")
+    def _need_rows(self) -> List[Dict[int, int]]:
+        need = []
+        for maximum, allocation in zip(self.maximum_rows,
+                                       self.allocation_rows):
+            row = dict(maximum)
+            for j, count in allocation.items():
+                add_cell(row, j, -count)
+            need.append(row)
+        return need
+
+    def stored_cells(self) -> int:
+        """Number of cells the state takes, only the nonzero cells of the
+        rows, and a cell for each row"""
+        return (self.num_res + 2 * self.num_proc +
+                sum(map(len, self.allocation_rows)) +
+                sum(map(len, self.maximum_rows)))
+
+    def snapshot(self) -> Dict:
+        """Take a consistent copy of the state of the system without
+        blocking requests, see BankersAlgorithm.snapshot. Only the nonzero
+        cells are copied, the matrices read like lists, see DenseRows
+
+        Returns:
+            Dict: num_proc, num_res, resources, allocation, max, free and
+                  version
+        """
+        while True:
+            seq = self._read_begin()
+            state = {'num_proc': self.num_proc,
+                     'num_res': self.num_res,
+                     'resources': list(self._resources),
+                     'allocation': DenseRows(self.allocation_rows,
+                                             self.num_res),
+                     'max': DenseRows(self.maximum_rows, self.num_res),
+                     'free': self.free,
+                     'version': self.version}
+            if self._read_end(seq):
+                return state
+
+    def clone(self) -> "SparseBankersAlgorithm":
+        """Copy the system row by row, without going through lists
+
+        Returns:
+            SparseBankersAlgorithm: The copy
+        """
+        while True:
+            seq = self._read_begin()
+            # The setters copy every row
+            b = type(self)(self.num_proc, self.num_res, self._resources,
+                           self.allocation_rows, self.maximum_rows,
+                           trusted=True)
+            free = self.free
+            if self._read_end(seq):
+                break
+        b._restore_free(free)
+        b._waiting = self.waiting
+        b.verbosity = self.verbosity
+        return b
+
+    def _as_vector(self, resource_req: List[int]) -> Dict[int, int]:
+        """Convert a resource vector to its nonzero cells"""
+        return sparse_row(resource_req)
+
+    def _held(self, proc_num: int) -> List[int]:
+        return dense_row(self.allocation_rows[proc_num], self.num_res)
+
+    def _empty(self, proc_num: int) -> bool:
+        # Rows never keep zero cells
+        return (not self.allocation_rows[proc_num] and
+                not self.maximum_rows[proc_num])
+
+    def _apply(self, proc_num: int, resource_req: Dict[int, int]):
+        """Add resources to the allocation of a process and update the
+        need and available arrays to match, only for the resources asked
+        for
+
+        Args:
+            proc_num (int): Process number to allocate to
+            resource_req (Dict[int, int]): Number of resources to add
+        """
+        allocation = self.allocation_rows[proc_num]
+        need = self.need_rows[proc_num]
+        available = self.available
+        for j, count in resource_req.items():
+            add_cell(allocation, j, count)
+            add_cell(need, j, -count)
+            available[j] -= count
+        self._record([{"op": "set", "matrix": "allocation", "proc": proc_num,
+                       "res": j, "value": allocation.get(j, 0)}
+                      for j in resource_req])
+
+    def _matrices(self) -> Tuple:
+        return self._resources, self.allocation_rows, self.maximum_rows
+
+    def _set_cell(self, matrix: str, proc_num: Optional[int], res_num: int,
+                  value: int):
+        """Set one cell and update the need and available arrays to match
+
+        Args:
+            matrix (str): resources, allocation or max
+            proc_num (Optional[int]): Process of the cell, None for
+                                      resources
+            res_num (int): Resource of the cell
+            value (int): New value of the cell
+        """
+        if matrix == "resources":
+            return super()._set_cell(matrix, proc_num, res_num, value)
+
+        rows = (self.allocation_rows if matrix == "allocation" else
+                self.maximum_rows)
+        change = value - rows[proc_num].get(res_num, 0)
+        add_cell(rows[proc_num], res_num, change)
+        if matrix == "allocation":
+            change = -change
+            if self._available is not None:
+                self._available[res_num] += change
+        if self._need is not None:
+            add_cell(self._need[proc_num], res_num, change)
+
+    def _add_row(self, allocation: List[int], maximum: List[int]):
+        """Add a process after the last one, updating the need and
+        available arrays to match"""
+        allocation = sparse_row(allocation)
+        maximum = sparse_row(maximum)
+        self.allocation_rows.append(allocation)
+        self.maximum_rows.append(maximum)
+        if self._need is not None:
+            need = dict(maximum)
+            for j, count in allocation.items():
+                add_cell(need, j, -count)
+            self._need.append(need)
+        if self._available is not None:
+            for j, count in allocation.items():
+                self._available[j] -= count
+        self.num_proc += 1
+
+    def _remove_row(self, proc_num: int):
+        """Remove a process, the processes after it move down by one. The
+        need and available arrays are updated to match"""
+        allocation = self.allocation_rows.pop(proc_num)
+        self.maximum_rows.pop(proc_num)
+        if self._need is not None:
+            self._need.pop(proc_num)
+        if self._available is not None:
+            for j, count in allocation.items():
+                self._available[j] += count
+        self.num_proc -= 1
+
+    def _first_over(self, proc_num: int,
+                    resource_req: Dict[int, int]) -> Optional[int]:
+        """Find the first resource a request asks for more of than the
+        process needs or than is available. Resources the request leaves
+        out are only over when their need or available count is already
+        below zero
+
+        Args:
+            proc_num (int): Process number that the request is being made on
+            resource_req (Dict[int, int]): Number of extra resources
+                                           requested
+
+        Returns:
+            Optional[int]: The resource, or None if the request fits
+        """
+        need = self.need_rows[proc_num]
+        available = self.available
+        over = [j for j, count in resource_req.items()
+                if count > need.get(j, 0) or count > available[j]]
+        over += [j for j, count in need.items()
+                 if count < 0 and j not in resource_req]
+        if min(available, default=0) < 0:
+            over += [j for j, count in enumerate(available)
+                     if count < 0 and j not in resource_req]
+        return min(over) if over else None
+
+    def _below_zero(self, proc_num: int,
+                    resource_req: Dict[int, int]) -> bool:
+        """Check if a request would take a process below zero resources"""
+        allocation = self.allocation_rows[proc_num]
+        return (any(allocation.get(j, 0) + count < 0
+                    for j, count in resource_req.items()) or
+                any(count < 0 for j, count in allocation.items()
+                    if j not in resource_req))
+
+    def _safe_order(self, proc_num: Optional[int] = None,
+                    resource_req: Optional[Dict[int, int]] = None
+                    ) -> List[int]:
+        """Find the order processes can finish in, without changing the
+        state of the system, see sparse_safe_order
+
+        Args:
+            proc_num (Optional[int]): Process to pretend to grant a request
+                                      to first
+            resource_req (Optional[Dict[int, int]]): The request to pretend
+                                                     to grant
+
+        Returns:
+            List[int]: The processes that were able to finish, in order
+        """
+        work = list(self.available)
+        need = self.need_rows
+        allocation = self.allocation_rows
+        if proc_num is not None:
+            # Only the row of the requesting process changes, so copy the
+            # outer lists and replace that one row
+            need = list(need)
+            need[proc_num] = dict(need[proc_num])
+            allocation = list(allocation)
+            allocation[proc_num] = dict(allocation[proc_num])
+            for j, count in resource_req.items():
+                work[j] -= count
+                add_cell(need[proc_num], j, -count)
+                add_cell(allocation[proc_num], j, count)
+        return sparse_safe_order(work, need, allocation)
+
+    def _detect_order(self, requests: List[List[int]]) -> List[int]:
+        """Find the order processes can finish in when each one only needs
+        its outstanding request, see sparse_safe_order
+
+        Args:
+            requests (List[List[int]]): Outstanding request of each process
+
+        Returns:
+            List[int]: The processes that were able to finish, in order
+        """
+        return sparse_safe_order(list(self.available),
+                                 [sparse_row(row) for row in requests],
+                                 self.allocation_rows)
+
+    def _order_holds(self, proc_num: int, resource_req: Dict[int, int],
+                     process_order: List[int]) -> bool:
+        """Check if a sequence of every running process is still a safe
+        sequence once a request is granted, see
+        BankersAlgorithm._order_holds
+
+        Args:
+            proc_num (int): Process number that the request is being made on
+            resource_req (Dict[int, int]): Number of extra resources
+                                           requested
+            process_order (List[int]): The sequence
+
+        Returns:
+            bool: If every process can finish in that order
+        """
+        work = list(self.available)
+        for j, count in resource_req.items():
+            work[j] -= count
+        # Less than nothing left blocks even the processes that need none
+        if min(work, default=0) < 0:
+            return False
+        need = self.need_rows
+        allocation = self.allocation_rows
+        for i in process_order:
+            asked = resource_req if i == proc_num else {}
+            if any(count - asked.get(j, 0) > work[j]
+                   for j, count in need[i].items()):
+                return False
+            for j, count in chain(allocation[i].items(), asked.items()):
+                work[j] += count
+                if work[j] < 0:
+                    return False
+        return True
+
+    def _remember_safe(self, process_order: List[int],
+                       version: Optional[int] = None):
+        """Cache a safe sequence for the current state, see
+        BankersAlgorithm._remember_safe. A process that needs none of a
+        resource never leaves less of it over than the processes before it
+        had, so the bound of each resource is the available count, lowered
+        only at the positions of processes that need some of it. Each
+        resource keeps the positions where its bound went down, and the
+        bound it went down to
+
+        Args:
+            process_order (List[int]): A safe sequence for the current state
+            version (Optional[int]): Version the sequence was found at,
+                                     defaults to the current version
+        """
+        if version is None:
+            version = self.version
+        start = list(self.available)
+        work = list(start)
+        need = self.need_rows
+        allocation = self.allocation_rows
+        position = [None] * self.num_proc
+        bounds = {}
+
+        def lower(j: int, k: int, value: int):
+            column = bounds.get(j)
+            if column is None:
+                bounds[j] = ([k], [value])
+            elif value < column[1][-1]:
+                column[0].append(k)
+                column[1].append(value)
+
+        for k, i in enumerate(process_order):
+            position[i] = k
+            for j, count in need[i].items():
+                lower(j, k, work[j] - count)
+            for j, count in allocation[i].items():
+                work[j] += count
+                if count < 0:
+                    # The processes after this one see less than was
+                    # available
+                    lower(j, k + 1, work[j])
+
+        self._safe = (version, process_order, position, (start, bounds))
+
+    def _fast_safe(self, proc_num: int,
+                   resource_req: Dict[int, int]) -> bool:
+        """Check if granting a request keeps the cached safe sequence safe
+
+        Args:
+            proc_num (int): Process number that the request is being made on
+            resource_req (Dict[int, int]): Number of extra resources
+                                           requested
+
+        Returns:
+            bool: True if the system is known to be safe after the request,
+                  False if the safety algorithm has to be run
+        """
+        safe = self._safe
+        if safe is None or safe[0] != self.version:
+            return False
+        k = safe[2][proc_num]
+        if k == 0:
+            return True
+        start, bounds = safe[3]
+        for j, count in resource_req.items():
+            bound = start[j]
+            column = bounds.get(j)
+            if column is not None:
+                lowered = bisect_left(column[0], k)
+                if lowered:
+                    bound = min(bound, column[1][lowered - 1])
+            if count > bound:
+                return False
+        return True
+
+    def _repair_order(self, process_order: List[int]) -> List[int]:
+        """Check a safe sequence found at an earlier version against the
+        current state, see BankersAlgorithm._repair_order
+
+        Args:
+            process_order (List[int]): An earlier safe sequence
+
+        Returns:
+            List[int]: The processes that were able to finish, in order
+        """
+        work = list(self.available)
+        need = self.need_rows
+        allocation = self.allocation_rows
+        # Resources with less than nothing left block even the processes
+        # that need none of them
+        below = {j for j, count in enumerate(work) if count < 0}
+        finished = [False] * self.num_proc
+        prefix = []
+        for i in process_order:
+            if (i >= self.num_proc or
+                    any(count > work[j] for j, count in need[i].items()) or
+                    any(j not in need[i] for j in below)):
+                break
+            finished[i] = True
+            prefix.append(i)
+            for j, count in allocation[i].items():
+                work[j] += count
+                if work[j] >= 0:
+                    below.discard(j)
+
+        rest = [i for i in range(self.num_proc) if not finished[i]]
+        return prefix + [rest[k] for k in sparse_safe_order(
+            work, [need[i] for i in rest], [allocation[i] for i in rest])]
+
+
+class DenseRows(Sequence):
+    """A copy of {resource: count} rows that reads like a list of lists of
+    num_res counts. A row is only turned into a list when it is read, so
+    the whole matrix is never held as lists at once. Rows read by index are
+    kept, so changes made to them show up when the rows are read again, as
+    with a list of lists.
+    """
+
+    def __init__(self, rows: List[Dict[int, int]], num_res: int):
+        """Copy the rows
+
+        Args:
+            rows (List[Dict[int, int]]): The nonzero cells of each row
+            num_res (int): Length of each row
+        """
+        self.rows = [dict(row) for row in rows]
+        self.num_res = num_res
+        self._read = {}
+
+    def _row(self, i: int) -> List[int]:
+        row = self._read.get(i)
+        if row is None:
+            row = dense_row(self.rows[i], self.num_res)
+        return row
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._row(i) for i in range(len(self.rows))[index]]
+        i = range(len(self.rows))[index]
+        if i not in self._read:
+            self._read[i] = dense_row(self.rows[i], self.num_res)
+        return self._read[i]
+
+    def __iter__(self):
+        return map(self._row, range(len(self.rows)))
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, DenseRows) and not (self._read or other._read):
+            return self.num_res == other.num_res and self.rows == other.rows
+        return (isinstance(other, Sequence) and len(self) == len(other) and
+                all(row == list(other_row)
+                    for row, other_row in zip(self, other)))
+
+    def __repr__(self) -> str:
+        return repr(list(self))
+
+
+def sparse_row(row) -> Dict[int, int]:
+    """The nonzero cells of a row as {resource: count}, from a list or from
+    another such dict, which is copied"""
+    if isinstance(row, dict):
+        return {j: count for j, count in row.items() if count}
+    return dict(compress(enumerate(row), row))
+
+
+def dense_row(row: Dict[int, int], num_res: int) -> List[int]:
+    """A {resource: count} row as a list of num_res counts"""
+    dense = [0] * num_res
+    for j, count in row.items():
+        dense[j] = count
+    return dense
+
+
+def add_cell(row: Dict[int, int], res_num: int, change: int):
+    """Add to one cell of a {resource: count} row, dropping it at zero"""
+    count = row.get(res_num, 0) + change
+    if count:
+        row[res_num] = count
+    else:
+        row.pop(res_num, None)
+
+
+def sparse_safe_order(work: List[int], need: List[Dict[int, int]],
+                      allocation: List[Dict[int, int]]) -> List[int]:
+    """Find the same order as BankersAlgorithm.safe_order, from {resource:
+    count} rows. A process is only blocked on the resources it needs some
+    of, so setting up costs one step per nonzero need, and finishing a
+    process one step per resource it holds.
+
+    Args:
+        work (List[int]): Resources free at the start, this is modified
+        need (List[Dict[int, int]]): Resources each process could still
+                                     request
+        allocation (List[Dict[int, int]]): Resources held by each process
+
+    Returns:
+        List[int]: The processes that were able to finish, in order
+    """
+    num_proc = len(need)
+
+    # blocked[i] is the number of resources process i needs more of than
+    # are currently in work
+    blocked = [0] * num_proc
+
+    # For each resource anyone is blocked on, the processes blocked on it
+    # sorted by their need
+    waiting = {}
+    below = [j for j, count in enumerate(work) if count < 0]
+    for i, row in enumerate(need):
+        for j, count in row.items():
+            if count > work[j] and work[j] >= 0:
+                waiting.setdefault(j, []).append((count, i))
+    # With less than nothing of a resource left even the processes that
+    # need none of it are blocked on it
+    for j in below:
+        waiting[j] = [(row.get(j, 0), i) for i, row in enumerate(need)
+                      if row.get(j, 0) > work[j]]
+    for column in waiting.values():
+        column.sort()
+        for _, i in column:
+            blocked[i] += 1
+
+    # Position of the first process in each column that is still blocked
+    position = dict.fromkeys(waiting, 0)
+
+    # Processes that are able to run, smallest process number first
+    ready = [i for i in range(num_proc) if blocked[i] == 0]
+    heapq.heapify(ready)
+
+    process_order = []
+    while ready:
+        i = heapq.heappop(ready)
+        process_order.append(i)
+
+        # Free the resources of the process and unblock every process
+        # that was only waiting on the resources that grew
+        for j, count in allocation[i].items():
+            if count <= 0:
+                continue
+            work[j] += count
+            column = waiting.get(j)
+            if column is None:
+                continue
+            k = position[j]
+            while k < len(column) and column[k][0] <= work[j]:
+                proc = column[k][1]
+                blocked[proc] -= 1
+                if blocked[proc] == 0:
+                    heapq.heappush(ready, proc)
+                k += 1
+            position[j] = k
+
+    return process_order
+
+
+def choose_backend(num_res: int, maximum: List[List[int]]) -> type:
+    """Pick the backend for a system from how many of its maximum claims
+    are zero. Claims bound allocations and needs, so they are as sparse as
+    the claims are
+
+    Args:
+        num_res (int): Number of resources
+        maximum (List[List[int]]): Maximum possible resource allocation
+
+    Returns:
+        type: SparseBankersAlgorithm when there are at least
+              SPARSE_MIN_RESOURCES resources and at most SPARSE_DENSITY of
+              the cells are nonzero, BankersAlgorithm otherwise
+    """
+    # Anything invalid is left for the backend to report
+    if type(num_res) is not int or num_res < SPARSE_MIN_RESOURCES:
+        return BankersAlgorithm
+    cells = 0
+    nonzero = 0
+    for row in maximum:
+        if type(row) is not list:
+            return BankersAlgorithm
+        cells += len(row)
+        nonzero += len(row) - row.count(0)
+    if cells and nonzero <= SPARSE_DENSITY * cells:
+        return SparseBankersAlgorithm
+    return BankersAlgorithm
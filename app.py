@@ -1,7 +1,19 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, abort
+from flask import jsonify as flask_jsonify
 import json
+import os
+import weakref
 from BankersAlgorithm import BankersAlgorithm as ba
+import BankersMetrics
+import BankersSnapshot
+import BankersStream
+from BankersRegistry import BankersRegistry
+from BankersStateStore import open_state_store
+from NumpyBankersAlgorithm import NumpyBankersAlgorithm
+from SparseBankersAlgorithm import SparseBankersAlgorithm, choose_backend
 app = Flask(__name__)
+# The matrices of sparse systems read like lists without being lists
+app.json.default = BankersStream.default
 
 
 default_config = {'num_proc': 5, 'num_res': 3, 'resources': [10, 5, 7],
@@ -11,12 +23,71 @@ default_config = {'num_proc': 5, 'num_res': 3, 'resources': [10, 5, 7],
                           [2, 2, 2], [4, 3, 3]]}
 
 
-def bankers_algorithm_factory(config=default_config):
-    return ba(config["num_proc"], config["num_res"], config["resources"],
-              config["allocation"], config["max"])
+backends = {'list': ba, 'numpy': NumpyBankersAlgorithm,
+            'sparse': SparseBankersAlgorithm}
 
+# Every JSON response is timed as serialization in /metrics
+serialize = BankersMetrics.timed("serialize")(flask_jsonify)
 
-b = bankers_algorithm_factory()
+
+def jsonify(body):
+    # Big states and logs go out a chunk at a time instead of as one string
+    if BankersStream.size(body) > BankersStream.STREAM_ITEMS:
+        return app.response_class(BankersStream.stream(body),
+                                  mimetype="application/json")
+    return serialize(body)
+
+# The last /safety body of each system at each verbosity, as (ETag, body),
+# dropped along with the system
+safety_bodies = weakref.WeakKeyDictionary()
+
+
+def safety_etag(b, verbosity):
+    # Versions are never handed out twice, even by a system made again
+    return f"{b.version}-{verbosity or b.verbosity}"
+
+
+def bankers_algorithm_factory(config=default_config, trusted=False):
+    # trusted skips checking every cell, only for states the system made
+    backend = config.get("backend", "auto")
+    if backend == "auto":
+        # Systems with many resources but few claims on each get the
+        # sparse backend
+        backend = choose_backend(config["num_res"], config["max"])
+    else:
+        backend = backends[backend]
+    # Copy the matrices so systems never share rows with the config
+    b = backend(config["num_proc"], config["num_res"],
+                list(config["resources"]),
+                [list(row) for row in config["allocation"]],
+                [list(row) for row in config["max"]], trusted)
+    # Slots of finished processes stay free for new processes, and have to
+    # be empty like those of a loaded snapshot
+    b._restore_free(list(config.get("free", [])))
+    return b
+
+
+# The routes without a system ID work on the default system
+DEFAULT_SYSTEM = "default"
+
+registry = BankersRegistry(
+    bankers_algorithm_factory,
+    max_systems=int(os.environ.get("BANKERS_MAX_SYSTEMS", 1000)),
+    max_cells=int(os.environ.get("BANKERS_MAX_CELLS", 50_000_000)),
+    pinned=[DEFAULT_SYSTEM],
+    # Set BANKERS_STATE to share the systems between gunicorn workers,
+    # e.g. mmap:///dev/shm/bankers or sqlite:///var/lib/bankers.db
+    store=(open_state_store(os.environ["BANKERS_STATE"])
+           if "BANKERS_STATE" in os.environ else None))
+if DEFAULT_SYSTEM not in registry:
+    registry.create(DEFAULT_SYSTEM, default_config)
+
+
+def get_system(system_id):
+    try:
+        return registry.get(system_id)
+    except KeyError:
+        abort(404, f"No system with ID {system_id}")
 
 
 @app.route("/")
@@ -25,54 +96,339 @@ def index():
 
 
 @app.route("/request", methods=["POST"])
-def resource_request():
-    proc_id = int(request.form["proc_id"])
-    resources = list(map(int, request.form.getlist("resource_req[]")))
+@app.route("/systems/<system_id>/request", methods=["POST"])
+def resource_request(system_id=DEFAULT_SYSTEM):
+    b = get_system(system_id)
     try:
-        is_safe, safe_sequence, log = b.request(proc_id, resources)
+        proc_id, resources, verbosity = request_args(b)
+        is_safe, safe_sequence, log = b.request(proc_id, resources,
+                                                verbosity)
         return jsonify({"is_safe": is_safe,
                         "safe_seq": safe_sequence,
-                        "log": log})
+                        "log": list(log)})
     except ValueError as ve:
         return jsonify({"is_safe": False,
                         "safe_seq": [],
                         "log": ["Value Error: " + str(ve)]})
 
 
+def request_args(b):
+    """The process number, request and verbosity posted to /request, as
+    form fields, a JSON object or int64 cells, see BankersStream"""
+    verbosity = request.values.get("verbosity")
+    if request.mimetype == BankersStream.BINARY:
+        try:
+            proc_id, resources = BankersStream.read_request(
+                request.get_data(), b.num_res)
+        except ValueError as ve:
+            # Cells of the wrong size are not a request at all
+            abort(400, str(ve))
+    elif request.is_json:
+        body = request.get_json()
+        proc_id, resources = parse_request(body)
+        verbosity = body.get("verbosity", verbosity)
+    else:
+        proc_id = int(request.form["proc_id"])
+        resources = list(map(int, request.form.getlist("resource_req[]")))
+    return proc_id, resources, verbosity
+
+
+def parse_request(req):
+    """The process number and request of a request posted as JSON
+
+    Raises:
+        ValueError: If the request is missing a field or has a value that
+                    is not an int
+    """
+    try:
+        return int(req["proc_id"]), list(map(int, req["resource_req"]))
+    except (KeyError, TypeError) as e:
+        raise ValueError("Requests should be objects with a proc_id and a " +
+                         f"resource_req list, {type(e).__name__} {e}")
+
+
+def batch_requests(body):
+    """The (process number, request) pairs posted to /request_batch,
+    /evaluate and /plan
+
+    Raises:
+        ValueError: If there is no list of requests, or a request is
+                    missing a field or has a value that is not an int
+    """
+    try:
+        requests = list(body["requests"])
+    except (KeyError, TypeError) as e:
+        raise ValueError("Batches should be objects with a requests list, " +
+                         f"{type(e).__name__} {e}")
+    return [parse_request(req) for req in requests]
+
+
+@app.route("/request_batch", methods=["POST"])
+@app.route("/systems/<system_id>/request_batch", methods=["POST"])
+def resource_request_batch(system_id=DEFAULT_SYSTEM):
+    b = get_system(system_id)
+    body = request.get_json(force=True)
+    try:
+        results = b.request_batch(batch_requests(body), body.get("order"),
+                                  body.get("verbosity"))
+        return jsonify({"results": [{"is_safe": is_safe,
+                                     "safe_seq": safe_sequence,
+                                     "log": list(log)}
+                                    for is_safe, safe_sequence, log
+                                    in results]})
+    except ValueError as ve:
+        return jsonify({"results": [],
+                        "log": ["Value Error: " + str(ve)]})
+
+
+@app.route("/evaluate", methods=["POST"])
+@app.route("/systems/<system_id>/evaluate", methods=["POST"])
+def evaluate(system_id=DEFAULT_SYSTEM):
+    # Read only, nothing is granted
+    b = get_system(system_id)
+    try:
+        candidates = batch_requests(request.get_json(force=True))
+    except ValueError as ve:
+        return jsonify({"results": [],
+                        "log": ["Value Error: " + str(ve)]})
+    return jsonify({"results": b.evaluate_requests(candidates)})
+
+
+@app.route("/plan", methods=["POST"])
+@app.route("/systems/<system_id>/plan", methods=["POST"])
+def plan(system_id=DEFAULT_SYSTEM):
+    # Read only, post the order to /request_batch to grant the plan
+    b = get_system(system_id)
+    body = request.get_json(force=True)
+    try:
+        return jsonify(b.plan_grants(batch_requests(body),
+                                     body.get("weights")))
+    except ValueError as ve:
+        return jsonify({"status": "error", "error": str(ve)})
+
+
 @app.route("/safety", methods=["GET"])
-def safety():
+@app.route("/systems/<system_id>/safety", methods=["GET"])
+def safety(system_id=DEFAULT_SYSTEM):
+    b = get_system(system_id)
+    verbosity = request.values.get("verbosity")
+    # Taken before the check, a change during it only makes the tag stale
+    etag = safety_etag(b, verbosity)
+    if etag in request.if_none_match:
+        return "", 304, {"ETag": f'"{etag}"'}
+
+    bodies = safety_bodies.setdefault(b, {})
+    cached = bodies.get(verbosity)
+    if cached is None or cached[0] != etag:
+        try:
+            is_safe, safe_sequence, log = b.safety(verbosity)
+        except ValueError as ve:
+            return jsonify({"is_safe": False,
+                            "safe_seq": [],
+                            "log": ["Value Error: " + str(ve)]})
+        # Big bodies are kept as the chunks they are streamed in
+        cached = (etag, list(jsonify({"is_safe": is_safe,
+                                      "safe_seq": safe_sequence,
+                                      "log": list(log)}).response))
+        bodies[verbosity] = cached
+    response = app.response_class(cached[1], mimetype="application/json")
+    response.set_etag(etag)
+    return response
+
+
+@app.route("/update", methods=["POST"])
+@app.route("/systems/<system_id>/update", methods=["POST"])
+def update(system_id=DEFAULT_SYSTEM):
+    # A binary snapshot is read straight into the arrays of the backend
+    if request.mimetype == BankersStream.BINARY:
+        return upload_snapshot(system_id)
+    if request.is_json:
+        config = request.get_json()["config"]
+    else:
+        config = json.loads(request.form["config"])["config"]
     try:
-        is_safe, safe_sequence, log = b.safety()
+        registry.create(system_id, config)
+        return jsonify({"status": "success"})
+    except Exception as e:
+        registry.create(system_id, default_config)
+        return jsonify({"status": "error", "error": str(e)})
+
+
+@app.route("/update", methods=["PATCH"])
+@app.route("/systems/<system_id>/update", methods=["PATCH"])
+def patch(system_id=DEFAULT_SYSTEM):
+    b = get_system(system_id)
+    try:
+        version = b.patch(request.get_json(force=True)["changes"])
+        return jsonify({"status": "success", "version": version})
+    except ValueError as ve:
+        return jsonify({"status": "error", "error": str(ve)})
+
+
+@app.route("/processes", methods=["POST"])
+@app.route("/systems/<system_id>/processes", methods=["POST"])
+def add_process(system_id=DEFAULT_SYSTEM):
+    b = get_system(system_id)
+    try:
+        proc_id = b.add_process(request.get_json(force=True)["max"])
+        return jsonify({"status": "success", "proc_id": proc_id})
+    except ValueError as ve:
+        return jsonify({"status": "error", "error": str(ve)})
+
+
+@app.route("/processes/<int:proc_id>/release", methods=["POST"])
+@app.route("/systems/<system_id>/processes/<int:proc_id>/release",
+           methods=["POST"])
+def release(proc_id, system_id=DEFAULT_SYSTEM):
+    # Without a release vector every resource the process holds is released
+    b = get_system(system_id)
+    body = request.get_json(force=True, silent=True) or {}
+    try:
+        return jsonify({"status": "success",
+                        "released": b.release(proc_id, body.get("release"))})
+    except ValueError as ve:
+        return jsonify({"status": "error", "error": str(ve)})
+
+
+@app.route("/processes/<int:proc_id>/exchange", methods=["POST"])
+@app.route("/systems/<system_id>/processes/<int:proc_id>/exchange",
+           methods=["POST"])
+def exchange(proc_id, system_id=DEFAULT_SYSTEM):
+    b = get_system(system_id)
+    body = request.get_json(force=True)
+    try:
+        is_safe, safe_sequence, log = b.exchange(
+            proc_id, body["acquire"], body["release"], body.get("verbosity"))
         return jsonify({"is_safe": is_safe,
                         "safe_seq": safe_sequence,
-                        "log": log})
+                        "log": list(log)})
     except ValueError as ve:
         return jsonify({"is_safe": False,
                         "safe_seq": [],
                         "log": ["Value Error: " + str(ve)]})
 
 
-@app.route("/update", methods=["POST"])
-def update():
-    config = json.loads(request.form["config"])["config"]
-    global b
+@app.route("/processes/<int:proc_id>/wait", methods=["POST"])
+@app.route("/systems/<system_id>/processes/<int:proc_id>/wait",
+           methods=["POST"])
+def wait(proc_id, system_id=DEFAULT_SYSTEM):
+    # The request a blocked process waits on, for /deadlocks
+    b = get_system(system_id)
+    try:
+        b.wait(proc_id, request.get_json(force=True)["request"])
+        return jsonify({"status": "success"})
+    except ValueError as ve:
+        return jsonify({"status": "error", "error": str(ve)})
+
+
+@app.route("/deadlocks", methods=["GET"])
+@app.route("/systems/<system_id>/deadlocks", methods=["GET"])
+def deadlocks(system_id=DEFAULT_SYSTEM):
+    b = get_system(system_id)
+    return jsonify({"deadlocked": b.deadlocks(), "version": b.version})
+
+
+@app.route("/processes/<int:proc_id>/finish", methods=["POST"])
+@app.route("/systems/<system_id>/processes/<int:proc_id>/finish",
+           methods=["POST"])
+def finish(proc_id, system_id=DEFAULT_SYSTEM):
+    b = get_system(system_id)
+    try:
+        b.finish(proc_id)
+        return jsonify({"status": "success"})
+    except ValueError as ve:
+        return jsonify({"status": "error", "error": str(ve)})
+
+
+@app.route("/systems/<system_id>", methods=["POST"])
+def create_system(system_id):
     try:
-        b = bankers_algorithm_factory(config)
+        registry.create(system_id, request.get_json(force=True)["config"])
         return jsonify({"status": "success"})
     except Exception as e:
-        b = bankers_algorithm_factory(default_config)
         return jsonify({"status": "error", "error": str(e)})
 
 
+@app.route("/systems/<system_id>", methods=["DELETE"])
+def delete_system(system_id):
+    if system_id == DEFAULT_SYSTEM or not registry.delete(system_id):
+        abort(404, f"No system with ID {system_id} to delete")
+    return jsonify({"status": "success"})
+
+
+@app.route("/snapshot", methods=["GET"])
+@app.route("/systems/<system_id>/snapshot", methods=["GET"])
+def download_snapshot(system_id=DEFAULT_SYSTEM):
+    state = get_system(system_id).snapshot()
+    return BankersSnapshot.dumps(state), 200, {
+        "Content-Type": "application/octet-stream",
+        "ETag": f'"{state["version"]}"'}
+
+
+@app.route("/snapshot", methods=["POST"])
+@app.route("/systems/<system_id>/snapshot", methods=["POST"])
+def upload_snapshot(system_id=DEFAULT_SYSTEM):
+    backend = request.args.get("backend", "list")
+    try:
+        if backend not in backends:
+            raise ValueError(f"Unknown backend {backend}")
+        b = BankersSnapshot.loads(request.get_data(), backends[backend])
+        registry.add(system_id, b, backend)
+        return jsonify({"status": "success"})
+    except ValueError as ve:
+        return jsonify({"status": "error", "error": str(ve)})
+
+
+@app.route("/metrics")
+def metrics():
+    # Each gunicorn worker keeps its own metrics
+    return BankersMetrics.render(registry.items()), 200, {
+        "Content-Type": BankersMetrics.CONTENT_TYPE}
+
+
+@app.route("/metrics/profile", methods=["GET"])
+def profile():
+    return BankersMetrics.profile(), 200, {"Content-Type": "text/plain"}
+
+
+@app.route("/metrics/profile", methods=["POST"])
+def toggle_profile():
+    # enabled=0 stops the profiler, anything else starts it
+    if request.values.get("enabled", "1") == "0":
+        return jsonify({"status": "success",
+                        "stopped": BankersMetrics.stop_profiler()})
+    try:
+        started = BankersMetrics.start_profiler(
+            float(request.values.get("interval", 0.005)))
+        return jsonify({"status": "success", "started": started})
+    except ValueError as ve:
+        return jsonify({"status": "error", "error": str(ve)})
+
+
 @app.route("/current")
-def current():
-    return jsonify({
-        'num_proc': b.num_proc,
-        'num_res': b.num_res,
-        'resources': b.resources,
-        'allocation': b.allocation,
-        'max': b.maximum
-    })
+@app.route("/systems/<system_id>", methods=["GET"])
+@app.route("/systems/<system_id>/current")
+def current(system_id=DEFAULT_SYSTEM):
+    b = get_system(system_id)
+    if str(b.version) in request.if_none_match:
+        return "", 304
+    if request.accept_mimetypes.best == BankersStream.BINARY:
+        return download_snapshot(system_id)
+
+    # Clients that already have the state at some version can ask for the
+    # changes since then, they get the whole state if those are gone
+    changes = None
+    if "since" in request.args:
+        try:
+            since = int(request.args["since"])
+        except ValueError:
+            abort(400, "since should be a version, " +
+                  f"{request.args['since']} is not")
+        changes = b.changes_since(since)
+    state = changes or b.snapshot()
+    response = jsonify(state)
+    response.set_etag(str(state["version"]))
+    return response
 
 
 if __name__ == "__main__":
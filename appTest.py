@@ -0,0 +1,234 @@
+import array
+import json
+import unittest
+from unittest import mock
+from app import app, default_config, registry
+import BankersSnapshot
+import BankersStream
+
+
+class AppTestCases(unittest.TestCase):
+    def setUp(self):
+        """Set up a client and a system of its own, so the tests never
+        touch the default system
+        """
+        self.client = app.test_client()
+        self.url = "/systems/app-test"
+        response = self.client.post(self.url, json={"config": default_config})
+        self.assertEqual(response.get_json(), {"status": "success"})
+
+    def tearDown(self):
+        registry.delete("app-test")
+
+    def test_malformed_batches(self):
+        """Test that a batch with a missing field or a value that is not
+        an int is answered with an error instead of failing the request
+        """
+        good = {"proc_id": 1, "resource_req": [1, 0, 2]}
+        for bad in ({"resource_req": [1, 0, 2]},
+                    {"proc_id": "one", "resource_req": [1, 0, 2]},
+                    {"proc_id": 1, "resource_req": None},
+                    {"proc_id": 1, "resource_req": [1, "x", 2]}):
+            for route in ("request_batch", "evaluate"):
+                response = self.client.post(f"{self.url}/{route}",
+                                            json={"requests": [good, bad]})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.get_json()["results"], [])
+                self.assertIn("Value Error", response.get_json()["log"][0])
+            response = self.client.post(f"{self.url}/plan",
+                                        json={"requests": [good, bad]})
+            self.assertEqual(response.get_json()["status"], "error")
+        response = self.client.post(f"{self.url}/request_batch", json=[])
+        self.assertEqual(response.get_json()["results"], [])
+
+        # Nothing in the batches was granted
+        self.assertEqual(registry.get("app-test").allocation,
+                         default_config["allocation"])
+        response = self.client.post(f"{self.url}/request_batch",
+                                    json={"requests": [good]})
+        self.assertTrue(response.get_json()["results"][0]["is_safe"])
+
+    def test_snapshot_with_bad_free_slots(self):
+        """Test that an uploaded snapshot with a free slot out of range is
+        refused and the system is left as it was
+        """
+        state = registry.get("app-test").snapshot()
+        response = self.client.post(
+            f"{self.url}/snapshot",
+            data=BankersSnapshot.dumps(dict(state, free=[7])),
+            content_type="application/octet-stream")
+        self.assertEqual(response.get_json()["status"], "error")
+        self.assertEqual(registry.get("app-test").snapshot(), state)
+        response = self.client.post(f"{self.url}/processes",
+                                    json={"max": [1, 1, 1]})
+        self.assertEqual(response.get_json()["proc_id"], 5)
+
+    def test_snapshot_with_negative_allocation(self):
+        """Test that an uploaded snapshot with a process holding less than
+        nothing is refused, as /update would refuse the same config
+        """
+        state = registry.get("app-test").snapshot()
+        negative = {"num_proc": 2, "num_res": 1, "resources": [1],
+                    "allocation": [[-1], [1]], "max": [[0], [2]],
+                    "free": []}
+        for route in ("snapshot", "update"):
+            response = self.client.post(
+                f"{self.url}/{route}", data=BankersSnapshot.dumps(negative),
+                content_type="application/octet-stream")
+            self.assertEqual(response.get_json()["status"], "error")
+            self.assertEqual(registry.get("app-test").snapshot(), state)
+
+    def test_config_with_bad_free_slots(self):
+        """Test that a config whose free slots still hold resources is
+        refused, instead of the resources being dropped
+        """
+        state = registry.get("app-test").snapshot()
+        for free in ([1], [9], [2, 2]):
+            response = self.client.post(self.url, json={
+                "config": dict(default_config, free=free)})
+            self.assertEqual(response.get_json()["status"], "error")
+            self.assertEqual(registry.get("app-test").snapshot(), state)
+
+        config = dict(default_config, free=[2])
+        config["allocation"] = [list(row) for row in config["allocation"]]
+        config["max"] = [list(row) for row in config["max"]]
+        config["allocation"][2] = config["max"][2] = [0, 0, 0]
+        response = self.client.post(self.url, json={"config": config})
+        self.assertEqual(response.get_json()["status"], "success")
+        self.assertEqual(registry.get("app-test").free, [2])
+
+    def test_safety_etags(self):
+        """Test that /safety answers 304 while the client has the result for
+        the current version and verbosity, and a new result after a change
+        """
+        response = self.client.get(f"{self.url}/safety")
+        self.assertTrue(response.get_json()["is_safe"])
+        etag = response.headers["ETag"]
+        response = self.client.get(f"{self.url}/safety",
+                                   headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+
+        # Another verbosity is another result
+        response = self.client.get(f"{self.url}/safety?verbosity=summary",
+                                   headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()["log"],
+                         ["All processes are finished"])
+
+        self.client.post(f"{self.url}/request",
+                         data={"proc_id": 1, "resource_req[]": [1, 0, 2]})
+        response = self.client.get(f"{self.url}/safety",
+                                   headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers["ETag"], etag)
+        self.assertEqual(response.get_json(),
+                         self.client.get(f"{self.url}/safety").get_json())
+
+    def test_current_etags_and_changes(self):
+        """Test that /current answers 304 for the version the client has,
+        the changes since an older version, and the whole state when the
+        changes are no longer kept
+        """
+        response = self.client.get(f"{self.url}/current")
+        state = response.get_json()
+        self.assertEqual(state, registry.get("app-test").snapshot())
+        etag = response.headers["ETag"]
+        response = self.client.get(f"{self.url}/current",
+                                   headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+
+        self.client.post(f"{self.url}/request",
+                         data={"proc_id": 1, "resource_req[]": [1, 0, 2]})
+        response = self.client.get(
+            f"{self.url}/current?since={state['version']}",
+            headers={"If-None-Match": etag})
+        changes = response.get_json()
+        self.assertEqual(changes["version"], registry.get("app-test").version)
+        self.assertEqual(response.headers["ETag"],
+                         f'"{changes["version"]}"')
+        self.assertEqual(changes["changes"],
+                         [{"op": "set_row", "matrix": "allocation",
+                           "proc": 1, "row": [3, 0, 2]}])
+
+        response = self.client.get(f"{self.url}/current?since=0")
+        self.assertEqual(response.get_json(),
+                         registry.get("app-test").snapshot())
+        for since in ("abc", "1.5", ""):
+            response = self.client.get(f"{self.url}/current?since={since}")
+            self.assertEqual(response.status_code, 400)
+
+    def test_json_and_binary_requests(self):
+        """Test that requests posted as JSON or as int64 cells are granted
+        like form requests, and that cells of the wrong size are refused
+        """
+        response = self.client.post(f"{self.url}/request",
+                                    json={"proc_id": 1,
+                                          "resource_req": [1, 0, 2],
+                                          "verbosity": "summary"})
+        self.assertTrue(response.get_json()["is_safe"])
+        self.assertEqual(registry.get("app-test").allocation[1], [3, 0, 2])
+        response = self.client.post(f"{self.url}/request",
+                                    json={"resource_req": [1, 0, 2]})
+        self.assertIn("Value Error", response.get_json()["log"][0])
+
+        response = self.client.post(
+            f"{self.url}/request",
+            data=array.array("q", [3, 0, 1, 0]).tobytes(),
+            content_type="application/octet-stream")
+        self.assertTrue(response.get_json()["is_safe"])
+        self.assertEqual(registry.get("app-test").allocation[3], [2, 2, 1])
+        for cells in ([3, 0, 1], [3, 0, 1, 0, 0]):
+            response = self.client.post(
+                f"{self.url}/request", data=array.array("q", cells).tobytes(),
+                content_type="application/octet-stream")
+            self.assertEqual(response.status_code, 400)
+        response = self.client.post(
+            f"{self.url}/request", data=b"\0" * 31,
+            content_type="application/octet-stream")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(registry.get("app-test").allocation[3], [2, 2, 1])
+
+    def test_streamed_states(self):
+        """Test that states streamed a chunk at a time and binary snapshots
+        both read back as the snapshot of the system
+        """
+        self.client.post(f"{self.url}/request",
+                         data={"proc_id": 1, "resource_req[]": [1, 0, 2]})
+        state = registry.get("app-test").snapshot()
+        with mock.patch.object(BankersStream, "STREAM_ITEMS", 4), \
+                mock.patch.object(BankersStream, "stream",
+                                  wraps=BankersStream.stream) as stream:
+            response = self.client.get(f"{self.url}/current")
+            self.assertEqual(json.loads(response.data), state)
+            self.assertEqual(response.headers["ETag"],
+                             f'"{state["version"]}"')
+        stream.assert_called_once_with(state)
+
+        for route, headers in (("snapshot", {}), ("current", {
+                "Accept": "application/octet-stream"})):
+            response = self.client.get(f"{self.url}/{route}",
+                                       headers=headers)
+            self.assertEqual(response.mimetype, "application/octet-stream")
+            self.assertEqual(BankersSnapshot.state(response.data), state)
+            # A loaded system starts versions of its own
+            loaded = BankersSnapshot.loads(response.data).snapshot()
+            self.assertEqual(dict(loaded, version=state["version"]), state)
+
+    def test_sparse_states(self):
+        """Test that a sparse system's state goes out as the same lists
+        whether or not it is streamed
+        """
+        self.client.post(self.url, json={"config": dict(default_config,
+                                                        backend="sparse")})
+        self.assertEqual(registry.get("app-test").backend, "sparse")
+        for items in (BankersStream.STREAM_ITEMS, 4):
+            with mock.patch.object(BankersStream, "STREAM_ITEMS", items):
+                response = self.client.get(f"{self.url}/current")
+            state = json.loads(response.data)
+            self.assertEqual(state["allocation"],
+                             default_config["allocation"])
+            self.assertEqual(state["max"], default_config["max"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,463 @@
+"""asyncio entry point for the Bankers Algorithm service.
+
+Serves the same routes as app.py, run it with any ASGI server, for example
+``uvicorn asgi:app``. Safety checks, plans and deadlock detection on
+systems with at least BANKERS_OFFLOAD_CELLS matrix cells run in a process
+pool, on a system built again from a snapshot with the same backend, so
+cheap routes like /current keep being answered while a big check is
+running. Requests the cached safe sequence already shows are safe never go
+to the pool.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import parse_qs
+import asyncio
+import json
+import os
+
+from BankersAlgorithm import admission_order
+import BankersMetrics
+import BankersSnapshot
+import BankersStream
+from app import DEFAULT_SYSTEM, bankers_algorithm_factory, default_config
+from app import backends, batch_requests, parse_request, registry
+from app import safety_bodies, safety_etag
+
+OFFLOAD_CELLS = int(os.environ.get("BANKERS_OFFLOAD_CELLS", 100_000))
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+pool = None
+
+NOT_FOUND = 404, None, {"status": "error", "error": "Not found"}
+
+
+def offloaded(system) -> bool:
+    return system.num_proc * system.num_res >= OFFLOAD_CELLS
+
+
+def worker_state(system):
+    # Shared systems hand on the backend of the system they keep in sync
+    return dict(system.snapshot(), backend=system.backend)
+
+
+def check_request_in_worker(state, proc_id, resources, verbosity):
+    b = bankers_algorithm_factory(state, trusted=True)
+    return b.check_request(proc_id, resources, verbosity)[:3]
+
+
+def safety_in_worker(state, verbosity):
+    return bankers_algorithm_factory(state, trusted=True).safety(verbosity)
+
+
+def plan_in_worker(state, requests, weights):
+    b = bankers_algorithm_factory(state, trusted=True)
+    return b.plan_grants(requests, weights)
+
+
+def deadlocks_in_worker(state, waiting):
+    b = bankers_algorithm_factory(state, trusted=True)
+    for proc_num, request in waiting.items():
+        b.wait(proc_num, request)
+    return b.deadlocks()
+
+
+async def run(function, *args):
+    """Run a function in the process pool"""
+    global pool
+    if pool is None:
+        pool = ProcessPoolExecutor()
+    return await asyncio.get_running_loop().run_in_executor(
+        pool, function, *args)
+
+
+def request_args(system, form, data, body, content_type, query):
+    """The process number, request and verbosity posted to /request, as
+    form fields, a JSON object or int64 cells, see BankersStream
+
+    Raises:
+        ValueError: If the request is missing a field or has a value that
+                    is not an int
+        BufferError: If int64 cells are not a request at all
+    """
+    if content_type.startswith(BankersStream.BINARY):
+        try:
+            proc_id, resources = BankersStream.read_request(body,
+                                                            system.num_res)
+        except ValueError as ve:
+            raise BufferError(str(ve))
+        return proc_id, resources, query.get("verbosity", [None])[0]
+    if data is not None:
+        return parse_request(data) + (
+            data.get("verbosity", query.get("verbosity", [None])[0]),)
+    return (int(form["proc_id"][0]),
+            list(map(int, form.get("resource_req[]", []))),
+            (form.get("verbosity") or query.get("verbosity") or [None])[0])
+
+
+async def resource_request(system, proc_id, resources, verbosity):
+    if not offloaded(system):
+        return system.request(proc_id, resources, verbosity)
+
+    # Invalid requests and the ones the cached safe sequence shows are safe
+    # are answered here. The rest are checked against a snapshot in the
+    # pool, then committed here unless what changed in the meantime stops
+    # them. The snapshot is taken after the version, so commit() looks at
+    # every change made since the state the worker checked
+    while True:
+        valid, safe_seq, log, version = system.check_request(
+            proc_id, resources, verbosity, search=False)
+        if valid is None:
+            valid, safe_seq, log = await run(
+                check_request_in_worker, worker_state(system), proc_id,
+                resources, verbosity)
+        if not valid:
+            return False, safe_seq, log
+        if system.commit(proc_id, resources, safe_seq, version):
+            log.append("System is safe with new resource allocation")
+            return True, safe_seq, log
+
+
+async def safety(system, query):
+    verbosity = query.get("verbosity", [None])[0]
+    if not offloaded(system):
+        return system.safety(verbosity)
+    return await run(safety_in_worker, worker_state(system), verbosity)
+
+
+async def plan_grants(system, requests, weights):
+    if not offloaded(system):
+        return system.plan_grants(requests, weights)
+    return await run(plan_in_worker, worker_state(system), requests,
+                     weights)
+
+
+async def deadlocks(system):
+    if not offloaded(system):
+        return system.deadlocks(), system.version
+    state = worker_state(system)
+    return (await run(deadlocks_in_worker, state, system.waiting),
+            state["version"])
+
+
+async def request_batch(system, requests, order, verbosity):
+    if not offloaded(system):
+        return system.request_batch(requests, order, verbosity)
+    # Each request is admitted like one posted to /request, so the ones
+    # that need the safety algorithm run it in the pool
+    if order == "plan":
+        order = (await plan_grants(system, requests, None))["order"]
+    results = [None] * len(requests)
+    for i in admission_order(requests, order):
+        proc_id, resources = requests[i]
+        # A bad request should not stop the rest of the batch
+        try:
+            results[i] = await resource_request(system, proc_id, resources,
+                                                verbosity)
+        except ValueError as ve:
+            results[i] = (False, [], ["Value Error: " + str(ve)])
+    return results
+
+
+def result(is_safe, safe_sequence, log):
+    return {"is_safe": is_safe, "safe_seq": safe_sequence, "log": list(log)}
+
+
+def value_error(ve):
+    return {"is_safe": False, "safe_seq": [],
+            "log": ["Value Error: " + str(ve)]}
+
+
+async def handle(method, path, query, body, content_type,
+                 if_none_match="", accept=""):
+    """Route a request
+
+    Returns:
+        Tuple: Status, content type and body, and optionally a list of
+               extra headers. The content type is None when the body is to
+               be sent as JSON. The body is bytes or a list of byte chunks
+    """
+    if method == "GET" and path == "/":
+        with open(os.path.join(ROOT, "templates", "index.html"), "rb") as f:
+            return 200, b"text/html", f.read()
+    if method == "GET" and path == "/static/index.js":
+        with open(os.path.join(ROOT, "static", "index.js"), "rb") as f:
+            return 200, b"application/javascript", f.read()
+    if method == "GET" and path == "/metrics":
+        return (200, BankersMetrics.CONTENT_TYPE.encode(),
+                BankersMetrics.render(registry.items()).encode())
+    if method == "GET" and path == "/metrics/profile":
+        return 200, b"text/plain", BankersMetrics.profile().encode()
+    if method == "POST" and path == "/metrics/profile":
+        # enabled=0 stops the profiler, anything else starts it
+        if query.get("enabled", ["1"])[0] == "0":
+            return 200, None, {"status": "success",
+                               "stopped": BankersMetrics.stop_profiler()}
+        try:
+            started = BankersMetrics.start_profiler(
+                float(query.get("interval", [0.005])[0]))
+            return 200, None, {"status": "success", "started": started}
+        except ValueError as ve:
+            return 200, None, {"status": "error", "error": str(ve)}
+
+    parts = path.strip("/").split("/")
+    system_id = DEFAULT_SYSTEM
+    if parts[0] == "systems" and len(parts) >= 2:
+        system_id = parts[1]
+        parts = parts[2:] or [""]
+    action = parts[0]
+
+    # Only the process routes have more than one part after the system
+    proc_id = None
+    if action == "processes" and len(parts) == 3 and parts[1].isdigit():
+        proc_id = int(parts[1])
+        action = parts[2]
+    elif len(parts) != 1:
+        return NOT_FOUND
+
+    # Snapshots are binary, so they are handled before the body is parsed
+    if action == "snapshot" and method == "GET":
+        try:
+            state = registry.get(system_id).snapshot()
+        except KeyError:
+            return NOT_FOUND
+        return (200, b"application/octet-stream",
+                BankersSnapshot.dumps(state),
+                [(b"etag", f'"{state["version"]}"'.encode())])
+
+    # Binary snapshots posted to /update are read straight into the arrays
+    # of the backend
+    if method == "POST" and (action == "snapshot" or (
+            action == "update" and
+            content_type.startswith(BankersStream.BINARY))):
+        backend = query.get("backend", ["list"])[0]
+        try:
+            if backend not in backends:
+                raise ValueError(f"Unknown backend {backend}")
+            registry.add(system_id, BankersSnapshot.loads(
+                body, backends[backend]), backend)
+            return 200, None, {"status": "success"}
+        except ValueError as ve:
+            return 200, None, {"status": "error", "error": str(ve)}
+
+    if content_type.startswith("application/json"):
+        form = {}
+        data = json.loads(body or b"{}")
+    elif content_type.startswith(BankersStream.BINARY):
+        form = {}
+        data = None
+    else:
+        form = parse_qs(body.decode())
+        data = None
+
+    if action == "" and method == "POST":
+        try:
+            registry.create(system_id, data["config"])
+            return 200, None, {"status": "success"}
+        except Exception as e:
+            return 200, None, {"status": "error", "error": str(e)}
+
+    if action == "" and method == "DELETE":
+        if system_id == DEFAULT_SYSTEM or not registry.delete(system_id):
+            return NOT_FOUND
+        return 200, None, {"status": "success"}
+
+    if action == "update" and method == "POST":
+        if data is not None:
+            config = data["config"]
+        else:
+            config = json.loads(form["config"][0])["config"]
+        try:
+            registry.create(system_id, config)
+            return 200, None, {"status": "success"}
+        except Exception as e:
+            registry.create(system_id, default_config)
+            return 200, None, {"status": "error", "error": str(e)}
+
+    try:
+        system = registry.get(system_id)
+    except KeyError:
+        return NOT_FOUND
+
+    if action == "processes" and method == "POST":
+        try:
+            return 200, None, {"status": "success",
+                               "proc_id": system.add_process(data["max"])}
+        except ValueError as ve:
+            return 200, None, {"status": "error", "error": str(ve)}
+
+    if proc_id is not None and action == "release" and method == "POST":
+        try:
+            return 200, None, {"status": "success",
+                               "released": system.release(
+                                   proc_id, (data or {}).get("release"))}
+        except ValueError as ve:
+            return 200, None, {"status": "error", "error": str(ve)}
+
+    if proc_id is not None and action == "exchange" and method == "POST":
+        try:
+            return 200, None, result(*system.exchange(
+                proc_id, data["acquire"], data["release"],
+                data.get("verbosity")))
+        except ValueError as ve:
+            return 200, None, value_error(ve)
+
+    if proc_id is not None and action == "wait" and method == "POST":
+        try:
+            system.wait(proc_id, data["request"])
+            return 200, None, {"status": "success"}
+        except ValueError as ve:
+            return 200, None, {"status": "error", "error": str(ve)}
+
+    if action == "deadlocks" and method == "GET":
+        deadlocked, version = await deadlocks(system)
+        return 200, None, {"deadlocked": deadlocked, "version": version}
+
+    if proc_id is not None and action == "finish" and method == "POST":
+        try:
+            system.finish(proc_id)
+            return 200, None, {"status": "success"}
+        except ValueError as ve:
+            return 200, None, {"status": "error", "error": str(ve)}
+
+    if action == "update" and method == "PATCH":
+        try:
+            return 200, None, {"status": "success",
+                               "version": system.patch(data["changes"])}
+        except ValueError as ve:
+            return 200, None, {"status": "error", "error": str(ve)}
+
+    if action in ("", "current") and method == "GET":
+        etag = f'"{system.version}"'
+        if etag in if_none_match.split(", "):
+            return 304, b"text/plain", b""
+        # Clients that want the state most as int64 cells get a snapshot
+        if accept.split(",")[0].split(";")[0].strip() == BankersStream.BINARY:
+            state = system.snapshot()
+            return (200, BankersStream.BINARY.encode(),
+                    BankersSnapshot.dumps(state),
+                    [(b"etag", f'"{state["version"]}"'.encode())])
+        changes = None
+        if "since" in query:
+            try:
+                since = int(query["since"][0])
+            except ValueError:
+                return 400, None, {"status": "error", "error":
+                                   "since should be a version, " +
+                                   f"{query['since'][0]} is not"}
+            changes = system.changes_since(since)
+        state = changes or system.snapshot()
+        return 200, None, state, [(b"etag", f'"{state["version"]}"'.encode())]
+
+    if action == "safety" and method == "GET":
+        # Taken before the check, a change during it only makes the tag
+        # stale
+        verbosity = query.get("verbosity", [None])[0]
+        etag = safety_etag(system, verbosity)
+        headers = [(b"etag", f'"{etag}"'.encode())]
+        if f'"{etag}"' in if_none_match.split(", "):
+            return 304, b"text/plain", b"", headers
+        bodies = safety_bodies.setdefault(system, {})
+        cached = bodies.get(verbosity)
+        if cached is None or cached[0] != etag:
+            try:
+                body = result(*await safety(system, query))
+            except ValueError as ve:
+                return 200, None, value_error(ve)
+            # Big bodies are kept as the chunks they are streamed in
+            if BankersStream.size(body) > BankersStream.STREAM_ITEMS:
+                cached = etag, list(BankersStream.stream(body))
+            else:
+                with BankersMetrics.timer("serialize"):
+                    cached = etag, [json.dumps(body).encode()]
+            bodies[verbosity] = cached
+        return 200, b"application/json", cached[1], headers
+
+    if action == "request" and method == "POST":
+        try:
+            return 200, None, result(*await resource_request(
+                system, *request_args(system, form, data, body,
+                                      content_type, query)))
+        except ValueError as ve:
+            return 200, None, value_error(ve)
+        except BufferError as be:
+            return 400, None, {"status": "error", "error": str(be)}
+
+    if action == "evaluate" and method == "POST":
+        try:
+            candidates = batch_requests(data)
+        except ValueError as ve:
+            return 200, None, {"results": [],
+                               "log": ["Value Error: " + str(ve)]}
+        # Big batches start their own process pool, so wait for them in a
+        # thread rather than in the event loop
+        results = await asyncio.get_running_loop().run_in_executor(
+            None, system.evaluate_requests, candidates)
+        return 200, None, {"results": results}
+
+    if action == "plan" and method == "POST":
+        try:
+            return 200, None, await plan_grants(system, batch_requests(data),
+                                                data.get("weights"))
+        except ValueError as ve:
+            return 200, None, {"status": "error", "error": str(ve)}
+
+    if action == "request_batch" and method == "POST":
+        try:
+            results = await request_batch(system, batch_requests(data),
+                                          data.get("order"),
+                                          data.get("verbosity"))
+            return 200, None, {"results": [result(*r) for r in results]}
+        except ValueError as ve:
+            return 200, None, {"results": [],
+                               "log": ["Value Error: " + str(ve)]}
+
+    return NOT_FOUND
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                if pool is not None:
+                    pool.shutdown()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            break
+
+    headers = dict(scope["headers"])
+    status, content_type, response, *extra_headers = await handle(
+        scope["method"], scope["path"],
+        parse_qs(scope["query_string"].decode()), body,
+        headers.get(b"content-type", b"").decode(),
+        headers.get(b"if-none-match", b"").decode(),
+        headers.get(b"accept", b"").decode())
+
+    if content_type is None:
+        content_type = b"application/json"
+        if BankersStream.size(response) > BankersStream.STREAM_ITEMS:
+            # Big states and logs go out a chunk at a time
+            response = BankersStream.stream(response)
+        else:
+            with BankersMetrics.timer("serialize"):
+                response = json.dumps(
+                    response, default=BankersStream.default).encode()
+
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", content_type),
+                            *(extra_headers[0] if extra_headers else [])]})
+    if isinstance(response, bytes):
+        await send({"type": "http.response.body", "body": response})
+        return
+    for chunk in response:
+        await send({"type": "http.response.body", "body": chunk,
+                    "more_body": True})
+    await send({"type": "http.response.body", "body": b""})
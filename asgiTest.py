@@ -0,0 +1,178 @@
+import array
+import asyncio
+import json
+import os
+import pickle
+import tempfile
+import unittest
+from unittest import mock
+from urllib.parse import urlencode
+from BankersAlgorithm import BankersAlgorithm as ba
+from BankersRegistry import BankersRegistry
+from BankersStateStore import SQLiteStateStore
+from app import bankers_algorithm_factory, default_config, registry
+import asgi
+
+
+def handle(method, path, body=b"", content_type="application/json",
+           query="", if_none_match="", accept=""):
+    """Drive asgi.handle() and read a JSON body back"""
+    if isinstance(body, dict):
+        body = json.dumps(body).encode()
+    status, content_type, response, *headers = asyncio.run(asgi.handle(
+        method, path, asgi.parse_qs(query), body, content_type,
+        if_none_match, accept))
+    if content_type == b"application/json":
+        response = json.loads(b"".join(response))
+    return status, response, dict(headers[0]) if headers else {}
+
+
+class AsgiTestCases(unittest.TestCase):
+    def setUp(self):
+        """Set up a system of its own, so the tests never touch the default
+        system
+        """
+        self.path = "/systems/asgi-test"
+        status, body, _ = handle("POST", self.path,
+                                 {"config": default_config})
+        self.assertEqual(body, {"status": "success"})
+
+    def tearDown(self):
+        registry.delete("asgi-test")
+
+    def test_routes(self):
+        """Test that requests posted as a form, as JSON or as int64 cells are
+        granted, that cells of the wrong size are refused, that
+        /current and /safety answer 304 for the version the client has,
+        and that unknown systems and routes are not found
+        """
+        form = urlencode({"proc_id": 1, "resource_req[]": [1, 0, 2]},
+                         doseq=True).encode()
+        status, body, _ = handle("POST", self.path + "/request", form,
+                                 "application/x-www-form-urlencoded")
+        self.assertEqual((status, body["is_safe"]), (200, True))
+        status, body, _ = handle("POST", self.path + "/request",
+                                 {"proc_id": 4, "resource_req": [3, 3, 0]})
+        self.assertFalse(body["is_safe"])
+        self.assertEqual(registry.get("asgi-test").allocation[1], [3, 0, 2])
+
+        status, body, headers = handle("GET", self.path + "/current")
+        self.assertEqual(body["allocation"][1], [3, 0, 2])
+        self.assertEqual(handle("GET", self.path + "/current",
+                                if_none_match=headers[b"etag"].decode())[0],
+                         304)
+
+        self.assertEqual(handle("GET", self.path + "/current",
+                                query="since=abc")[0], 400)
+
+        status, body, headers = handle("GET", self.path + "/safety")
+        self.assertTrue(body["is_safe"])
+        self.assertEqual(handle("GET", self.path + "/safety",
+                                if_none_match=headers[b"etag"].decode())[0],
+                         304)
+
+        status, body, _ = handle("POST", self.path + "/request",
+                                 array.array("q", [3, 0, 1, 0]).tobytes(),
+                                 "application/octet-stream")
+        self.assertTrue(body["is_safe"])
+        self.assertEqual(handle("POST", self.path + "/request",
+                                array.array("q", [3, 0, 1]).tobytes(),
+                                "application/octet-stream")[0], 400)
+        status, body, _ = handle("POST", self.path + "/request",
+                                 {"resource_req": [1, 0, 2]})
+        self.assertIn("Value Error", body["log"][0])
+
+        status, body, _ = handle("POST", self.path + "/request_batch",
+                                 {"requests": [{"proc_id": 1}]})
+        self.assertEqual(body["results"], [])
+        self.assertEqual(handle("GET", "/systems/missing/current")[0], 404)
+        self.assertEqual(handle("GET", self.path + "/nothing/here")[0], 404)
+
+    def test_offloaded_requests_take_the_fast_path(self):
+        """Test that requests on an offloaded system are only sent to the
+        pool when the cached safe sequence can not show they are safe, and
+        that they end the same as on a system that checks them itself
+        """
+        calls = []
+
+        async def run(function, *args):
+            calls.append(function.__name__)
+            return function(*args)
+
+        expected = ba(5, 3, list(default_config["resources"]),
+                      [list(row) for row in default_config["allocation"]],
+                      [list(row) for row in default_config["max"]])
+        requests = [(1, [1, 0, 2]), (3, [0, 1, 0]), (4, [3, 3, 0]),
+                    (0, [0, 1, 0]), (1, [0, 0, 1]), (2, [9, 9, 9])]
+        with mock.patch.object(asgi, "OFFLOAD_CELLS", 0), \
+                mock.patch.object(asgi, "run", run):
+            for proc_id, resource_req in requests:
+                status, body, _ = handle(
+                    "POST", self.path + "/request",
+                    {"proc_id": proc_id, "resource_req": resource_req,
+                     "verbosity": "none"})
+                self.assertEqual(body["is_safe"], expected.request(
+                    proc_id, resource_req)[0])
+
+        self.assertEqual(registry.get("asgi-test").allocation,
+                         expected.allocation)
+        self.assertIn("check_request_in_worker", calls)
+        self.assertLess(len(calls), len(requests))
+        self.assertGreater(registry.get("asgi-test").stats["fast_path_hits"],
+                           0)
+
+    def test_every_backend_and_route_is_offloaded(self):
+        """Test that sparse systems and systems shared through a state store
+        are offloaded too, built again in the worker with their own
+        backend, and that batches, plans and deadlock detection are
+        offloaded with them and answered as on a system that runs them
+        itself
+        """
+        backends = []
+
+        async def run(function, *args):
+            # Workers only get what can be pickled
+            args = pickle.loads(pickle.dumps(args))
+            backends.append(args[0]["backend"])
+            return function(*args)
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        store = SQLiteStateStore(os.path.join(directory.name, "state.db"))
+        shared = BankersRegistry(bankers_algorithm_factory, store=store)
+        config = dict(default_config, backend="sparse")
+        systems = [registry.create("asgi-test", config),
+                   shared.create("shared", config)]
+
+        requests = [(1, [1, 0, 2]), (3, [0, 1, 0]), (4, [3, 3, 0]),
+                    (0, [0, 1, 0]), (1, [0, 0, 1]), (2, [9, 9, 9])]
+        for system in systems:
+            expected = ba(5, 3, list(default_config["resources"]),
+                          [list(row) for row in default_config["allocation"]],
+                          [list(row) for row in default_config["max"]])
+            with mock.patch.object(asgi, "OFFLOAD_CELLS", 0), \
+                    mock.patch.object(asgi, "run", run):
+                self.assertEqual(
+                    asyncio.run(asgi.plan_grants(system, requests, None)),
+                    expected.plan_grants(requests))
+                results = asyncio.run(asgi.request_batch(
+                    system, requests, "plan", "none"))
+                self.assertEqual(
+                    [result[0] for result in results],
+                    [result[0] for result in expected.request_batch(
+                        requests, "plan", "none")])
+                for proc_num, request in ((0, [7, 4, 3]), (2, [6, 0, 0])):
+                    system.wait(proc_num, request)
+                    expected.wait(proc_num, request)
+                self.assertEqual(asyncio.run(asgi.deadlocks(system))[0],
+                                 expected.deadlocks())
+            self.assertEqual(system.allocation, expected.allocation)
+            self.assertEqual(set(backends), {"sparse"})
+
+        # Requests granted on the shared system were written to the store
+        other = BankersRegistry(bankers_algorithm_factory, store=store)
+        self.assertEqual(other.get("shared").allocation, expected.allocation)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -34,13 +34,41 @@ function update_config() {
 	});
 }
 
+// The last state pulled down from the server, kept so later pulls only
+// have to fetch what changed since its version
+let remote_config = null;
+
+function apply_changes(config, changes) {
+	for (const change of changes) {
+		if (change.op == "set" && change.matrix == "resources") {
+			config.resources[change.res] = change.value;
+		} else if (change.op == "set") {
+			config[change.matrix][change.proc][change.res] = change.value;
+		} else if (change.op == "set_row") {
+			config[change.matrix][change.proc] = change.row;
+		} else if (change.op == "add_process") {
+			config.allocation.push(change.allocation);
+			config.max.push(change.max);
+			config.num_proc += 1;
+		} else if (change.op == "remove_process") {
+			config.allocation.splice(change.proc, 1);
+			config.max.splice(change.proc, 1);
+			config.num_proc -= 1;
+		}
+	}
+}
+
 function pulldown_config() {
-	let remote_config = {}
 	$.ajax({
 		type: "GET",
-		url: "/current",
+		url: remote_config ? "/current?since=" + remote_config.version : "/current",
         success: function(data){
-        	remote_config = data;
+        	if (data.changes && remote_config) {
+        		apply_changes(remote_config, data.changes);
+        		remote_config.version = data.version;
+        	} else {
+        		remote_config = data;
+        	}
 
         	let config_as_txt = remote_config["num_proc"].toString() + "\n" +
 						remote_config["num_res"].toString() + "\n" + 